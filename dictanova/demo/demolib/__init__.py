@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+
+"""
+Shared helpers for the Dictanova demo scripts.
+
+The modules of this package are imported by the use case scripts of
+`product-reviews` and `retail-feedbacks`. They are kept free of heavy imports at
+package level so that importing `demolib` stays cheap.
+"""
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+"""
+Chunked execution of the aggregations filtered by large TERMS IN lists.
+
+A `TERMS IN` criterion of an AND filter (or the filter itself) with more ids than the
+chunk size is split into several queries with the same filter on chunks of the ids,
+run concurrently. A document containing terms of several chunks matches several
+queries: the chunk queries are dimensioned by document (`externalId`) and the union of
+the documents is aggregated locally, so that the merge is exact:
+* COUNT: number of distinct documents per group
+* CSAT and NPS: the queries also have a DISTINCT dimension on the rating, the metric
+is derived from the distribution of the union (see metrics.py)
+
+Queries whose IN criterion is under an OR or a NOT, with a `limit` dimension or of
+another type are not chunked.
+
+The document dimension is limited to MAX_DOCUMENTS documents per group: a group of a
+chunk reaching it may be truncated, and so may a chunk of a COUNT query without other
+dimensions whose documents do not add up to its total. The merge then raises a
+ChunkingError rather than returning wrong figures; a smaller chunk size avoids it.
+"""
+
+import collections, copy
+from concurrent.futures import ThreadPoolExecutor
+
+from .metrics import Distribution
+
+CHUNK_SIZE = 200
+
+# Documents per group of a chunk query, a group reaching it may be truncated
+MAX_DOCUMENTS = 10000
+
+DOCUMENT = {"field": "externalId", "group": "DISTINCT", "limit": MAX_DOCUMENTS}
+
+class ChunkingError(ValueError):
+	"""Raised when the documents of a chunk query may have been truncated."""
+
+def _large_in(criterion, size):
+	# Largest TERMS IN criterion over `size` ids among the conjuncts of a filter
+	if not isinstance(criterion, dict):
+		return None
+	if criterion.get("operator") == "AND":
+		found = [c for c in (_large_in(child, size) for child in criterion.get("criteria", [])) if c is not None]
+		return max(found, key=lambda c: len(c["value"])) if found else None
+	if criterion.get("field") == "TERMS" and criterion.get("operator") == "IN" and len(criterion.get("value", [])) > size:
+		return criterion
+	return None
+
+def chunk_queries(query, size=CHUNK_SIZE):
+	"""
+	Queries of the chunks of the largest TERMS IN list of an aggregation query.
+
+	Returns a list of queries, or None if the query has no IN list over `size` ids or
+	cannot be chunked exactly.
+	"""
+	if query.get("type") not in ("COUNT", "CSAT", "NPS"):
+		return None
+	if any("limit" in d for d in query.get("dimensions", [])):
+		return None
+	if _large_in(query.get("query"), size) is None:
+		return None
+	dimensions = list(query.get("dimensions", [])) + [DOCUMENT]
+	if query["type"] != "COUNT":
+		dimensions.append({"field": query["field"], "group": "DISTINCT"})
+	ids = _large_in(query.get("query"), size)["value"]
+	queries = []
+	for start in range(0, len(ids), size):
+		sub = copy.deepcopy(query)
+		sub["type"] = "COUNT"
+		sub["dimensions"] = copy.deepcopy(dimensions)
+		_large_in(sub["query"], size)["value"] = ids[start:start+size]
+		queries.append(sub)
+	return queries
+
+def _check(query, payload, i, documents):
+	# documents: group -> set of the documents of the period i of a chunk
+	for group, docs in documents.items():
+		if len(docs) >= MAX_DOCUMENTS:
+			raise ChunkingError("A chunk query returned %d documents for the group %s, the limit of the "
+				"document dimension: use a smaller chunk size" % (len(docs), list(group)))
+	total = payload["periods"][i].get("total", {}).get("value")
+	if query["type"] == "COUNT" and not query.get("dimensions") and total is not None:
+		returned = len(documents.get((), ()))
+		if returned != total:
+			raise ChunkingError("A chunk query returned %d documents out of %d" % (returned, total))
+
+def merge(query, payloads):
+	"""
+	Merge the responses of chunk_queries into the payload of the query.
+
+	Raises a ChunkingError if the documents of a chunk may have been truncated.
+	"""
+	merged = copy.deepcopy(payloads[0])
+	rated = query["type"] != "COUNT"
+	for i, period in enumerate(merged["periods"]):
+		groups = collections.OrderedDict() # group -> {document: rating}
+		documents = {}
+		for payload in payloads:
+			returned = collections.defaultdict(set) # group -> documents of the chunk
+			for v in payload["periods"][i]["values"]:
+				dims = v["dimensions"]
+				group, doc = (tuple(dims[:-2]), dims[-2]) if rated else (tuple(dims[:-1]), dims[-1])
+				rating = dims[-1] if rated else None
+				groups.setdefault(group, {})[doc] = rating
+				documents[doc] = rating
+				returned[group].add(doc)
+			_check(query, payload, i, returned)
+		if not rated:
+			period["values"] = [{"dimensions": list(g), "value": len(docs), "volume": len(docs)} for g, docs in groups.items()]
+			period["total"] = dict(period.get("total", {}), value=len(documents))
+			continue
+		values = [{"dimensions": list(g) + [r], "value": n}
+			for g, docs in groups.items() for r, n in collections.Counter(docs.values()).items()]
+		distribution = Distribution.from_values(values)
+		metric = distribution.average() if query["type"] == "CSAT" else distribution.nps()
+		period["values"] = [{"dimensions": list(g), "value": m, "volume": n}
+			for g, m, n in zip(distribution.groups, metric, distribution.volume())]
+		total = Distribution.from_values([{"dimensions": [r], "value": n} for r, n in collections.Counter(documents.values()).items()])
+		value = (total.average() if query["type"] == "CSAT" else total.nps()) if len(total) else [None]
+		period["total"] = {"value": value[0], "volume": len(documents)}
+	return merged
+
+def chunked_post(api, url, query, size=CHUNK_SIZE, auth=None, max_workers=4):
+	"""
+	POST an aggregation query as concurrent queries over chunks of its TERMS IN list.
+
+	api: DictanovaClient of the chunk queries, each being memoized and cached
+	Returns a requests.Response holding the merged payload, the first failed response
+	of a chunk, or None if the query cannot be chunked. Raises a ChunkingError if the
+	documents of a chunk may have been truncated.
+	"""
+	from .client import json_response
+	queries = chunk_queries(query, size)
+	if queries is None:
+		return None
+	with ThreadPoolExecutor(max_workers=max_workers) as pool:
+		responses = list(pool.map(lambda q: api.post(url, json=q, auth=auth), queries))
+	for response in responses:
+		if not response.ok:
+			return response
+	return json_response(merge(query, [r.json() for r in responses]), responses[0].url)
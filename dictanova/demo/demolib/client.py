@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+
+"""
+Dictanova API authentication and client shared by the demo scripts.
+
+DictanovaClient memoizes the responses of the API by a canonical key of the request
+(method, URL, sorted parameters, canonical JSON body, see query.py): use cases run in
+the same process share their fetches, and a pipeline can prime the memo with
+prefetched responses. A page of a paginated request (`page`, `pageSize`) is also
+answered from a memoized page of the same request that contains it. With a
+ResponseCache (eg. the directory named by `DICTANOVA_CACHE`), responses are also read
+from and written to a cache shared by processes and hosts; expired entries are
+revalidated with conditional requests and refreshed without their body on `304 Not
+Modified`. Aggregations over a long period can be sharded into concurrent sub-queries
+per month or week (see sharding.py), whose buckets are kept by a SeriesStore
+(`DICTANOVA_SERIES`, see timeseries.py) so that only the open ones are fetched again.
+Aggregations filtered by large TERMS IN lists are run as concurrent queries over
+chunks of the list (see chunking.py) and large request bodies are sent gzip
+compressed. Concurrent identical requests, of threads or asyncio tasks (`apost`), are
+collapsed into one call whose response is shared.
+
+Responses not fetched from the API by the call itself (memo, cache, identical request
+in flight, revalidation) are copies whose `from_cache` attribute is True: their
+`elapsed` time is not the one of the call (see pagination.py).
+"""
+
+import collections, copy, functools, gzip, json, threading
+from concurrent.futures import Future
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+
+from .config import API_URL, api_url, cache_dir, cache_ttl, credentials, series_dir
+from .query import as_json, canonical_json
+from .responsecache import ResponseCache, conditional_headers, revalidated
+
+# The module is shadowed by the `json` arguments, named as in requests
+_dumps = json.dumps
+
+# Size in bytes above which JSON bodies are compressed
+GZIP_MIN = 16384
+# Statuses of a compressed request retried uncompressed: servers refusing compressed
+# bodies answer 415, some 400 or 413
+GZIP_REJECTED = (400, 413, 415)
+
+class DictanovaAPIAuth(requests.auth.AuthBase):
+	"""Attaches Dictanova Bearer Authentication to the given Request object."""
+
+	def __init__(self, id, secret, base_url=None):
+		self.apiclient_id = id
+		self.apiclient_secret = secret
+		self.base_url = base_url or api_url()
+		self._token = None
+		self._lock = threading.Lock()
+
+	def __eq__(self, other):
+		return all([
+			self.apiclient_id == getattr(other, 'apiclient_id', None),
+			self.apiclient_secret == getattr(other, 'apiclient_secret', None)
+		])
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __call__(self, r):
+		r.headers['Authorization'] = self.get_token()
+		return r
+
+	def get_token(self):
+		# Get authentication token, once for all the threads
+		with self._lock:
+			if self._token is None:
+				payload = {
+					"clientId": self.apiclient_id,
+					"clientSecret": self.apiclient_secret
+				}
+				r = requests.post("%s/token" % self.base_url, json=payload)
+				self._token = r.json()
+		# Always use the one in cache
+		return "Bearer %s" % self._token["access_token"]
+
+def auth_from_config(path=None):
+	"""DictanovaAPIAuth with the credentials and base URL of the configuration, see config."""
+	clientId, clientSecret = credentials(path)
+	return DictanovaAPIAuth(clientId, clientSecret)
+
+def _canonical_body(json_body=None, data=None):
+	if json_body is not None:
+		# Equivalent queries (see query.py) have the same key
+		return canonical_json(json_body)
+	if isinstance(data, bytes):
+		return data.decode("utf-8")
+	return data
+
+def _split(url, params=None):
+	# URL without query string and the sorted list of all the parameters
+	parts = urlsplit(url)
+	merged = dict(parse_qsl(parts.query, keep_blank_values=True))
+	merged.update({k: str(v) for k, v in (params or {}).items()})
+	return parts._replace(query="", fragment="").geturl(), sorted(merged.items())
+
+def request_key(method, url, params=None, json=None, data=None, scope=None):
+	"""
+	Canonical key of a request, identical for equivalent requests.
+
+	scope: partition of the responses, eg. a hash of the credentials of a proxy client
+	"""
+	base, items = _split(url, params)
+	return _dumps([method.upper(), base, items, _canonical_body(json, data)] + ([scope] if scope else []))
+
+def page_of(method, url, params=None, json=None, data=None, scope=None):
+	"""
+	Page of a paginated request.
+
+	Returns (key of the request without page parameters, (first item, end item)), or
+	None if the request has no `page` and `pageSize` parameters.
+	"""
+	base, items = _split(url, params)
+	paging = dict(items)
+	try:
+		page, size = int(paging["page"]), int(paging["pageSize"])
+	except (KeyError, ValueError):
+		return None
+	items = [(k, v) for k, v in items if k not in ("page", "pageSize")]
+	key = _dumps([method.upper(), base, items, _canonical_body(json, data)] + ([scope] if scope else []))
+	return key, ((page-1)*size, page*size)
+
+def json_response(payload, url, status_code=200):
+	"""requests.Response holding a JSON payload, eg. derived from a memoized response."""
+	response = requests.Response()
+	response.status_code = status_code
+	response.url = url
+	response.headers["Content-Type"] = "application/json"
+	response._content = _dumps(payload).encode("utf-8")
+	response.encoding = "utf-8"
+	return response
+
+def _from_cache(response):
+	# Copy of a response answered without fetching it, flagged as such
+	response = copy.copy(response)
+	response.from_cache = True
+	return response
+
+class DictanovaClient(object):
+	"""Memoizing client of the API, safe to share between threads."""
+
+	def __init__(self, auth=None, base_url=None, cache=None, series=None, chunk_size=None, gzip_min=GZIP_MIN,
+			max_memo=None):
+		"""
+		auth: default DictanovaAPIAuth of the requests, None to pass one per request
+		base_url: base URL of the API, URLs of the default API are rewritten to it
+		cache: ResponseCache shared with other processes, or None
+		series: SeriesStore of the sharded requests, or None
+		chunk_size: maximal number of ids of a TERMS IN list of an aggregation, see
+		chunking.py (chunking.CHUNK_SIZE if None, 0 to disable)
+		gzip_min: size in bytes above which JSON bodies are compressed, None to disable
+		max_memo: number of responses kept in memory, the least recently used ones being forgotten
+		(eg. by a long-lived proxy), None for all of them
+		"""
+		from .chunking import CHUNK_SIZE
+		self.auth = auth
+		self.base_url = base_url or api_url()
+		self.cache = cache
+		self.series = series
+		self.chunk_size = CHUNK_SIZE if chunk_size is None else chunk_size
+		self.gzip_min = gzip_min
+		self.session = requests.Session()
+		self.max_memo = max_memo
+		self._memo = collections.OrderedDict()
+		self._pages = {} # request key without page -> [(first item, end item, key)]
+		self._lock = threading.Lock()
+		self._flights = {} # (request key, cached) -> Future of the request in flight
+		self.calls = 0
+		self.hits = 0
+		self.shared = 0 # requests answered by an identical request in flight
+		self.revalidated = 0 # expired cached responses revalidated by a 304
+
+	def url(self, url):
+		"""URL of the configured API for an URL of the default API (as in the scripts)."""
+		if url.startswith(API_URL) and self.base_url != API_URL:
+			return self.base_url + url[len(API_URL):]
+		return url
+
+	def _covering(self, method, url, params, json_body, data, scope):
+		# Response derived from a memoized page containing the requested one
+		page = page_of(method, url, params, json_body, data, scope)
+		if page is None:
+			return None
+		group, (first, last) = page
+		for start, stop, key in self._pages.get(group, []):
+			if start <= first and last <= stop and key in self._memo:
+				payload = self._memo[key].json()
+				payload["items"] = payload.get("items", [])[first-start:last-start]
+				paging = dict(_split(url, params)[1])
+				payload["page"], payload["pageSize"] = int(paging["page"]), int(paging["pageSize"])
+				return json_response(payload, self._memo[key].url)
+		return None
+
+	def memoized(self, method, url, params=None, json=None, data=None, cached=True, scope=None):
+		"""
+		Memoized response of a request, or None.
+
+		cached: if False, neither the memo nor the response cache is read (None is
+		returned), eg. for data that can change
+		scope: partition of the responses, see request_key
+		"""
+		if not cached:
+			return None
+		url = self.url(url)
+		key = request_key(method, url, params, json, data, scope)
+		with self._lock:
+			if key in self._memo:
+				self._memo.move_to_end(key)
+				return _from_cache(self._memo[key])
+			response = self._covering(method, url, params, json, data, scope)
+		if response is None and self.cache is not None:
+			response = self.cache.get(key)
+			if response is not None:
+				self._remember(key, method, url, response, params, json, data, scope)
+		return None if response is None else _from_cache(response)
+
+	def prime(self, method, url, response, params=None, json=None, data=None, cached=True, scope=None):
+		"""
+		Memoize the response of a request, only successful responses are kept.
+
+		cached: if False, the response is not written to the response cache
+		scope: partition of the responses, see request_key
+		"""
+		if not response.ok:
+			return
+		url = self.url(url)
+		key = request_key(method, url, params, json, data, scope)
+		self._remember(key, method, url, response, params, json, data, scope)
+		if cached and self.cache is not None:
+			self.cache.put(key, response)
+
+	def _remember(self, key, method, url, response, params, json_body, data, scope=None):
+		with self._lock:
+			self._memo[key] = response
+			page = page_of(method, url, params, json_body, data, scope)
+			if page is not None and "items" in response.json():
+				self._pages.setdefault(page[0], []).append(page[1] + (key,))
+			while self.max_memo is not None and len(self._memo) > self.max_memo:
+				forgotten, _ = self._memo.popitem(last=False)
+				for group in list(self._pages):
+					self._pages[group] = [p for p in self._pages[group] if p[2] != forgotten]
+					if not self._pages[group]:
+						del self._pages[group]
+
+	def request(self, method, url, params=None, json=None, data=None, auth=None, shard=None, cached=True,
+			scope=None):
+		"""
+		Response of a request, from the memo or the API.
+
+		Concurrent identical requests (same canonical key) are sent once: the first one
+		fetches the response, the others wait for it.
+		shard: MONTH or WEEK to fetch an aggregation query as sub-queries over its period
+		cached: if False, the response is fetched again whatever the memo and the response
+		cache, and not written to the response cache, eg. for data that can change;
+		identical requests in flight are still sent once
+		scope: partition of the responses, see request_key
+		The JSON body is a dict or a query value of query.py.
+		"""
+		json = as_json(json)
+		flight = (request_key(method, self.url(url), params, json, data, scope), cached)
+		with self._lock:
+			future = self._flights.get(flight)
+			leader = future is None
+			if leader:
+				future = self._flights[flight] = Future()
+		if not leader:
+			response = _from_cache(future.result())
+			with self._lock:
+				self.shared += 1
+			return response
+		try:
+			response = self._fetch(method, url, params, json, data, auth, shard, cached, scope)
+			future.set_result(response)
+			return response
+		except BaseException as e:
+			future.set_exception(e)
+			raise
+		finally:
+			with self._lock:
+				del self._flights[flight]
+
+	def _fetch(self, method, url, params, json, data, auth, shard, cached, scope):
+		if shard is not None and self.series is not None:
+			# The store decides which buckets are fetched again
+			cached = False
+		response = self.memoized(method, url, params, json, data, cached, scope)
+		if response is not None:
+			with self._lock:
+				self.hits += 1
+			return response
+		if shard is not None and self.series is not None:
+			response = self.series.post(self, url, json, shard, auth)
+		elif shard is not None:
+			# The sub-queries are memoized too, the merged response under the query key
+			from .sharding import sharded_post
+			response = sharded_post(self, url, json, shard, auth)
+		else:
+			response = None
+			if self.chunk_size and isinstance(json, dict) and "/aggregation/" in url:
+				from .chunking import chunked_post
+				response = chunked_post(self, url, json, self.chunk_size, auth)
+			if response is None:
+				response = self._revalidate(method, url, params, json, data, auth, cached, scope)
+		self.prime(method, url, response, params, json, data, cached, scope)
+		return response
+
+	def _revalidate(self, method, url, params, json_body, data, auth, cached, scope):
+		# Conditional request if the cache has an expired response of the request
+		stale = None
+		if cached and self.cache is not None:
+			stale = self.cache.expired(request_key(method, self.url(url), params, json_body, data, scope))
+		response = self._send(method, url, params, json_body, data, auth, conditional_headers(stale))
+		if stale is not None and response.status_code == 304:
+			with self._lock:
+				self.revalidated += 1
+			return _from_cache(revalidated(stale, response))
+		return response
+
+	def _send(self, method, url, params, json_body, data, auth, headers=None):
+		headers = dict(headers or {})
+		with self._lock:
+			self.calls += 1
+			gzip_min = self.gzip_min
+		rejected = None
+		if json_body is not None and gzip_min is not None:
+			body = _dumps(json_body).encode("utf-8")
+			if len(body) >= gzip_min:
+				compressed = dict(headers, **{"Content-Type": "application/json", "Content-Encoding": "gzip"})
+				response = self.session.request(method, self.url(url), params=params, data=gzip.compress(body),
+					headers=compressed, auth=auth or self.auth)
+				if response.status_code not in GZIP_REJECTED:
+					return response
+				# The server may not accept compressed bodies, sent again uncompressed
+				rejected = response.status_code
+		response = self.session.request(method, self.url(url),
+			params=params, json=json_body, data=data, headers=headers, auth=auth or self.auth)
+		if rejected == 415 or (rejected is not None and response.ok):
+			# A 400 or 413 is only due to the compression if the uncompressed body is accepted
+			with self._lock:
+				self.gzip_min = None
+		return response
+
+	def post(self, url, json=None, data=None, params=None, auth=None, shard=None, cached=True):
+		"""Like requests.post, answered from the memo when possible."""
+		return self.request("POST", url, params, json, data, auth, shard, cached)
+
+	async def apost(self, url, json=None, data=None, params=None, auth=None, shard=None, cached=True):
+		"""
+		post() for asyncio tasks, run in the default executor of the loop.
+
+		Identical requests of tasks and threads share the same request in flight.
+		"""
+		# Imported here, the scripts only using post() start faster
+		import asyncio
+		loop = asyncio.get_event_loop()
+		return await loop.run_in_executor(None, functools.partial(
+			self.request, "POST", url, params, json, data, auth, shard, cached))
+
+_client = None
+_client_lock = threading.Lock()
+
+def client():
+	"""DictanovaClient shared by the use cases of the current process."""
+	global _client
+	with _client_lock:
+		if _client is None:
+			from .timeseries import SeriesStore
+			directory, series = cache_dir(), series_dir()
+			_client = DictanovaClient(
+				cache=ResponseCache(directory, cache_ttl()) if directory else None,
+				series=SeriesStore(series) if series else None)
+		return _client
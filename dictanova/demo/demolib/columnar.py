@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+
+"""
+Memory-mapped columnar cache for document content and enrichments.
+
+A store is a directory holding:
+* `content.bin` / `content.off`: the UTF-8 content of all documents in a single blob
+and the int64 byte offsets of each document
+* `externalId.bin` / `externalId.off` and `metadata.bin` / `metadata.off`: the external
+ids and the JSON encoded metadata, stored the same way
+* `enrich.off`: the int64 offsets of the enrichments of each document
+* `term.i4`, `polarity.i1`, `begin.i4`, `end.i4`: the enrichments in fixed-width
+columns
+* `meta.json`: the number of documents, the vocabulary of the term codes and the size
+of each file
+* `write.lock`: locked (flock) by the writer, a store has a single writer at a time
+
+Readers open the files with mmap: slices are zero-copy and several processes reading
+the same store share the page cache. A store is closed (or used as a context manager)
+to unmap its files.
+
+Each batch of documents appended is committed by replacing `meta.json` once its files
+are flushed: readers only see the committed documents, a batch failing or interrupted
+is rolled back (by the writer, or by the next writer opening the store) and a store
+whose files are shorter than recorded is rejected with a ColumnarError. As opening a
+writer truncates the files to their committed sizes, a second writer of a store is
+rejected with a ColumnarError until the first one is closed (or its process dies).
+
+The store is a library helper: no use case script writes or reads one yet.
+"""
+
+import fcntl, json, mmap, os
+import numpy as np
+
+from .interning import Vocabulary
+from .enrichments import EnrichmentArrays, POLARITY_CODES
+
+_BLOBS = ["content", "externalId", "metadata"]
+_COLUMNS = [("term", np.int32), ("polarity", np.int8), ("begin", np.int32), ("end", np.int32)]
+
+class ColumnarError(Exception):
+	"""Raised when the files of a store are shorter than its meta.json records, or when
+	it is already opened by another writer."""
+
+def _column_path(path, name, dtype):
+	return os.path.join(path, "%s.%s" % (name, np.dtype(dtype).str[1:]))
+
+def _file_paths(path):
+	# Name in self._files -> path of the file
+	paths = {}
+	for name in _BLOBS:
+		paths[name] = os.path.join(path, "%s.bin" % name)
+		paths[name+".off"] = os.path.join(path, "%s.off" % name)
+	paths["enrich.off"] = os.path.join(path, "enrich.off")
+	for name, dtype in _COLUMNS:
+		paths[name] = _column_path(path, name, dtype)
+	return paths
+
+def _read_meta(path):
+	with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as fin:
+		return json.load(fin)
+
+class ColumnarWriter(object):
+	"""Append documents of search results to a columnar store."""
+
+	def __init__(self, path, terms=None):
+		"""
+		path: directory of the store, created if needed
+		terms: Vocabulary of the term codes of a new store
+		Raises ColumnarError if the files of an existing store are shorter than committed,
+		or if another writer has the store opened.
+		"""
+		self.path = path
+		os.makedirs(path, exist_ok=True)
+		# Released when closed, or by the system when the process dies
+		self._lock = open(os.path.join(path, "write.lock"), "a")
+		try:
+			fcntl.flock(self._lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+		except BlockingIOError:
+			self._lock.close()
+			raise ColumnarError("%s is opened by another writer" % path)
+		try:
+			self._open(terms)
+		except BaseException:
+			self._lock.close()
+			raise
+
+	def _open(self, terms):
+		path = self.path
+		paths = _file_paths(path)
+		if os.path.exists(os.path.join(path, "meta.json")):
+			meta = _read_meta(path)
+			self.terms = Vocabulary(meta["terms"])
+			self.count = meta["count"]
+			# Roll back what an interrupted writer appended after its last commit
+			for name, size in meta.get("sizes", {}).items():
+				filename = os.path.join(path, name)
+				if os.path.getsize(filename) < size:
+					raise ColumnarError("%s is shorter than committed (%d bytes)" % (filename, size))
+				os.truncate(filename, size)
+		else:
+			self.terms = terms if terms is not None else Vocabulary()
+			self.count = 0
+			for filename in paths.values():
+				open(filename, "wb").close()
+		self._files = {name: open(filename, "ab") for name, filename in paths.items()}
+		# New store, write the first offsets
+		if self.count == 0 and self._files["enrich.off"].tell() == 0:
+			for name in [b+".off" for b in _BLOBS] + ["enrich.off"]:
+				self._files[name].write(np.zeros(1, dtype=np.int64).tobytes())
+			self._commit()
+		self._ends = {name: os.path.getsize(paths[name]) for name in _BLOBS}
+		self._ends["enrich"] = os.path.getsize(paths["term"]) // 4
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def append(self, documents):
+		"""
+		Append documents to the store and commit them.
+
+		documents: iterable of documents (items in search result)
+		If a document can not be stored, none of the batch is and the error is raised.
+		"""
+		committed = {name: f.tell() for name, f in self._files.items()}
+		count, ends = self.count, dict(self._ends)
+		try:
+			for doc in documents:
+				self._append(doc)
+		except BaseException:
+			for name, f in self._files.items():
+				f.flush()
+				f.truncate(committed[name])
+			self.count, self._ends = count, ends
+			raise
+		self._commit()
+
+	def _append(self, doc):
+		blobs = {
+			"content": doc["content"].encode("utf-8"),
+			"externalId": (doc.get("externalId") or "").encode("utf-8"),
+			"metadata": json.dumps(doc.get("metadata", []), ensure_ascii=False).encode("utf-8")
+		}
+		for name, data in blobs.items():
+			self._files[name].write(data)
+			self._ends[name] += len(data)
+			self._files[name+".off"].write(np.int64(self._ends[name]).tobytes())
+		enrichments = doc.get("enrichments", [])
+		columns = {
+			"term": self.terms.encode(e["term"] for e in enrichments),
+			"polarity": np.asarray([POLARITY_CODES.get(e.get("opinion"), -1) for e in enrichments], dtype=np.int8),
+			"begin": np.asarray([e["offset"]["begin"] for e in enrichments], dtype=np.int32),
+			"end": np.asarray([e["offset"]["end"] for e in enrichments], dtype=np.int32)
+		}
+		for name, dtype in _COLUMNS:
+			self._files[name].write(columns[name].astype(dtype).tobytes())
+		self._ends["enrich"] += len(enrichments)
+		self._files["enrich.off"].write(np.int64(self._ends["enrich"]).tobytes())
+		self.count += 1
+
+	def _commit(self):
+		# meta.json is replaced once the files it describes are flushed
+		for f in self._files.values():
+			f.flush()
+		sizes = {os.path.basename(f.name): f.tell() for f in self._files.values()}
+		meta = os.path.join(self.path, "meta.json")
+		with open(meta + ".tmp", "w", encoding="utf-8") as fout:
+			json.dump({"count": self.count, "terms": self.terms.labels, "sizes": sizes}, fout)
+		os.replace(meta + ".tmp", meta)
+
+	def close(self):
+		if self._files:
+			self._commit()
+		for f in self._files.values():
+			f.close()
+		self._files = {}
+		self._lock.close()
+
+def _map(path, mmaps):
+	# mmap refuses empty files; the maps are appended to `mmaps` to be closed
+	if os.path.getsize(path) == 0:
+		return b""
+	with open(path, "rb") as fin:
+		mapped = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+	mmaps.append(mapped)
+	return mapped
+
+def _map_array(path, dtype, mmaps):
+	# Whole values only, a writer may be appending
+	length = os.path.getsize(path) // np.dtype(dtype).itemsize
+	if length == 0:
+		return np.zeros(0, dtype=dtype)
+	return np.frombuffer(_map(path, mmaps), dtype=dtype, count=length)
+
+def _map_blob(path, mmaps):
+	return memoryview(_map(path, mmaps))
+
+class ColumnarStore(object):
+	"""Read-only, memory-mapped view of a columnar store."""
+
+	def __init__(self, path):
+		"""
+		path: directory of the store
+		Raises ColumnarError if its files are shorter than its meta.json records.
+		"""
+		self.path = path
+		meta = _read_meta(path)
+		self.terms = Vocabulary(meta["terms"])
+		self.count = meta["count"]
+		for name, size in meta.get("sizes", {}).items():
+			if os.path.getsize(os.path.join(path, name)) < size:
+				raise ColumnarError("%s is shorter than committed (%d bytes)" % (os.path.join(path, name), size))
+		# Documents appended after the last commit are not visible
+		self._mmaps = []
+		self._offsets = {}
+		self._blobs = {}
+		try:
+			for name in _BLOBS:
+				self._offsets[name] = self._check(_map_array(os.path.join(path, "%s.off" % name), np.int64, self._mmaps), self.count + 1, name+".off")
+				self._blobs[name] = self._check(_map_blob(os.path.join(path, "%s.bin" % name), self._mmaps), int(self._offsets[name][-1]), name)
+			self._enrich_offsets = self._check(_map_array(os.path.join(path, "enrich.off"), np.int64, self._mmaps), self.count + 1, "enrich.off")
+			self._columns = {}
+			for name, dtype in _COLUMNS:
+				self._columns[name] = self._check(_map_array(_column_path(path, name, dtype), dtype, self._mmaps), int(self._enrich_offsets[-1]), name)
+		except BaseException:
+			self.close()
+			raise
+
+	def _check(self, values, length, name):
+		# The first `length` values, the file being at least that long
+		if len(values) < length:
+			raise ColumnarError("%s of %s has %d values, %d expected for %d documents" % (
+				name, self.path, len(values), length, self.count))
+		return values[:length]
+
+	def __len__(self):
+		return self.count
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def close(self):
+		"""
+		Unmap the files of the store, it can not be read anymore.
+
+		A map still used by arrays or bytes returned by the store (eg. EnrichmentArrays)
+		is unmapped once they are freed.
+		"""
+		self._offsets, self._blobs, self._columns, self._enrich_offsets = {}, {}, {}, None
+		for mapped in self._mmaps:
+			try:
+				mapped.close()
+			except BufferError:
+				pass
+		self._mmaps = []
+
+	def raw(self, name, i):
+		"""Zero-copy bytes of the blob `name` (content, externalId, metadata) of document i."""
+		offsets = self._offsets[name]
+		return self._blobs[name][offsets[i]:offsets[i+1]]
+
+	def content(self, i):
+		return str(self.raw("content", i), "utf-8")
+
+	def external_id(self, i):
+		return str(self.raw("externalId", i), "utf-8")
+
+	def metadata(self, i):
+		return json.loads(str(self.raw("metadata", i), "utf-8"))
+
+	def enrichments(self, start=0, stop=None):
+		"""
+		EnrichmentArrays of the documents in [start, stop).
+
+		The arrays are views on the memory-mapped columns, nothing is copied.
+		"""
+		stop = self.count if stop is None else stop
+		lo, hi = self._enrich_offsets[start], self._enrich_offsets[stop]
+		return EnrichmentArrays(
+			self._columns["term"][lo:hi],
+			self._columns["polarity"][lo:hi],
+			self._columns["begin"][lo:hi],
+			self._columns["end"][lo:hi],
+			np.asarray(self._enrich_offsets[start:stop+1]) - lo,
+			self.terms)
+
+	def documents(self, indices=None, metadata=True):
+		"""
+		Iterate over documents as dicts with `externalId`, `content` and `metadata`.
+
+		indices: the indices of the documents to read, all of them if None
+		metadata: if False, the metadata are not decoded
+		"""
+		for i in (range(self.count) if indices is None else indices):
+			doc = {"externalId": self.external_id(i), "content": self.content(i)}
+			if metadata:
+				doc["metadata"] = self.metadata(i)
+			yield doc
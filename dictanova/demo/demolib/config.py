@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+"""
+Configuration of the demo scripts: API credentials and base URL.
+
+Credentials are read, by order of priority, from:
+* the environment variables `DICTANOVA_CLIENT_ID` and `DICTANOVA_CLIENT_SECRET`
+* the file named by the environment variable `DICTANOVA_CREDENTIALS`
+* `~/.dictanova/credentials`
+* the file `credentials` of the directory `dictanova/demo`, whatever the current
+directory is
+
+A credentials file contains one line with the client id and secret separated by a
+semi colon. The base URL of the API can be overridden with `DICTANOVA_API_URL`, eg. to
+use a local proxy.
+
+The use cases run on the dataset named by `DICTANOVA_DATASET`, or on the demo
+dataset. `DICTANOVA_FIELDS` maps the metadata names used by the scripts (eg.
+`rating_satisfaction`) to the metadata codes of the dataset: a JSON object or the path
+of a JSON file. `DICTANOVA_PERIOD` (`2016-01-01/2016-12-31`) replaces the period of the
+use cases that query one.
+
+`DICTANOVA_CACHE` names a directory where the API responses are cached, shared by the
+processes and hosts using it (see responsecache.py), entries older than
+`DICTANOVA_CACHE_TTL` seconds being revalidated. `DICTANOVA_SERIES` names the
+directory where the closed buckets of the time series are frozen (see timeseries.py).
+`DICTANOVA_PAGE_SIZES` names the JSON file recording the page sizes tuned for the
+search requests (see pagination.py), they are not recorded if it is not set.
+"""
+
+import json, os
+
+API_URL = "https://api.dictanova.io/v1"
+
+# dictanova/demo/credentials
+DEMO_CREDENTIALS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "credentials")
+USER_CREDENTIALS = os.path.join("~", ".dictanova", "credentials")
+
+class ConfigError(Exception):
+	"""Raised when the configuration is missing or invalid."""
+
+def credentials_files(path=None):
+	"""Candidate credentials files, by order of priority."""
+	files = [path, os.environ.get("DICTANOVA_CREDENTIALS"), os.path.expanduser(USER_CREDENTIALS), DEMO_CREDENTIALS]
+	return [f for f in files if f]
+
+def read_credentials(path):
+	"""(client id, client secret) read from a credentials file."""
+	with open(path, "r") as fin:
+		parts = fin.readline().strip().split(";")
+	if len(parts) != 2 or not all(parts):
+		raise ConfigError("Credentials file '%s' must contain 'client_id;client_secret'" % path)
+	return tuple(parts)
+
+def credentials(path=None):
+	"""
+	API client id and secret.
+
+	path: a credentials file used before the default locations
+	Returns (client id, client secret).
+	"""
+	client_id = os.environ.get("DICTANOVA_CLIENT_ID")
+	client_secret = os.environ.get("DICTANOVA_CLIENT_SECRET")
+	if client_id and client_secret:
+		return client_id, client_secret
+	for f in credentials_files(path):
+		if os.path.exists(f):
+			return read_credentials(f)
+	raise ConfigError(
+		"No credentials: set DICTANOVA_CLIENT_ID and DICTANOVA_CLIENT_SECRET or create one of %s"
+		% ", ".join(credentials_files(path)))
+
+def api_url():
+	"""Base URL of the API, without trailing slash."""
+	return os.environ.get("DICTANOVA_API_URL", API_URL).rstrip("/")
+
+def dataset(default):
+	"""Id of the dataset of the use cases, `default` being the one of the demo."""
+	return os.environ.get("DICTANOVA_DATASET") or default
+
+def fields():
+	"""Mapping of the metadata names of the scripts to the codes of the dataset."""
+	value = os.environ.get("DICTANOVA_FIELDS")
+	if not value:
+		return {}
+	try:
+		if value.lstrip().startswith("{"):
+			return json.loads(value)
+		with open(value, "r", encoding="utf-8") as fin:
+			return json.load(fin)
+	except (IOError, ValueError) as e:
+		raise ConfigError("Invalid DICTANOVA_FIELDS: %s" % e)
+
+def metadata_code(name):
+	"""Metadata code of the dataset for the metadata `name` of the scripts."""
+	return fields().get(name, name)
+
+def field(name):
+	"""Field of a query for the metadata `name`, eg. `metadata.rating_nps`."""
+	return "metadata.%s" % metadata_code(name)
+
+def period(start, end):
+	"""
+	(from, to) of the period of the use cases.
+
+	start, end: dates of the demo period, as in the queries
+	"""
+	value = os.environ.get("DICTANOVA_PERIOD")
+	if not value:
+		return start, end
+	parts = value.split("/")
+	if len(parts) != 2 or not all(len(p) == 10 for p in parts):
+		raise ConfigError("Invalid DICTANOVA_PERIOD '%s', expected 'YYYY-MM-DD/YYYY-MM-DD'" % value)
+	return "%sT00:00:00Z" % parts[0], "%sT23:59:59Z" % parts[1]
+
+def cache_dir():
+	"""Directory of the shared response cache, None if responses are not cached."""
+	return os.environ.get("DICTANOVA_CACHE") or None
+
+def cache_ttl():
+	"""Seconds after which cached responses are revalidated, None if they never expire."""
+	value = os.environ.get("DICTANOVA_CACHE_TTL")
+	if not value:
+		return None
+	try:
+		return float(value)
+	except ValueError:
+		raise ConfigError("Invalid DICTANOVA_CACHE_TTL '%s', expected seconds" % value)
+
+def series_dir():
+	"""Directory of the time series store, None if series are fetched in full."""
+	return os.environ.get("DICTANOVA_SERIES") or None
+
+def page_sizes_path():
+	"""JSON file of the tuned page sizes, None if they are not recorded."""
+	path = os.environ.get("DICTANOVA_PAGE_SIZES")
+	return os.path.expanduser(path) if path else None
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+"""
+Local co-occurrence engine: which terms are associated with a given opinion.
+
+The co-occurrences are computed with a sparse product over the document x term
+incidence built from document enrichments, so that the terms associated with any
+opinion are answered locally instead of with one `/search/.../terms` request per
+opinion.
+"""
+
+import numpy as np
+from scipy import sparse
+
+from .enrichments import POLARITIES, POLARITY_CODES
+
+class CooccurrenceEngine(object):
+	"""Term x term co-occurrence counts computed from EnrichmentArrays."""
+
+	def __init__(self, enrichments, by_polarity=True):
+		"""
+		enrichments: EnrichmentArrays of the mirrored documents
+		by_polarity: if True, seeds can also be restricted to a polarity
+		"""
+		self.terms = enrichments.terms
+		self.by_polarity = by_polarity
+		n_docs, n_terms = len(enrichments), len(self.terms)
+		docs = enrichments.doc_index()
+		ones = np.ones(enrichments.size, dtype=np.int32)
+		# Number of occurrences of each term in each document
+		self.occurrences = sparse.csr_matrix(
+			(ones, (docs, enrichments.term)), shape=(n_docs, n_terms))
+		self.occurrences.sum_duplicates()
+		# term x term: occurrences of the column term in documents containing the row term
+		incidence = self._incidence(self.occurrences)
+		self.matrix = (incidence.T @ self.occurrences).tocsr()
+		self.doc_frequency = np.asarray(incidence.sum(axis=0)).ravel()
+		if by_polarity:
+			known = enrichments.polarity >= 0
+			columns = enrichments.term[known].astype(np.int64)*len(POLARITIES) + enrichments.polarity[known]
+			seeds = sparse.csr_matrix(
+				(ones[known], (docs[known], columns)), shape=(n_docs, n_terms*len(POLARITIES)))
+			seeds.sum_duplicates()
+			# (term, polarity) x term
+			seeds = self._incidence(seeds)
+			self.polarized = (seeds.T @ self.occurrences).tocsr()
+			self.polarized_doc_frequency = np.asarray(seeds.sum(axis=0)).ravel()
+
+	@staticmethod
+	def _incidence(m):
+		# Binary version of a count matrix
+		m = m.copy()
+		m.data[:] = 1
+		return m
+
+	def _row(self, term, polarity):
+		code = self.terms.encode([term], grow=False)[0]
+		if code < 0 or code >= self.matrix.shape[0]: # unknown when the engine was built
+			return None
+		if polarity is None:
+			return self.matrix.getrow(code)
+		if not self.by_polarity:
+			raise ValueError("Engine built without polarity, cannot filter on '%s'" % polarity)
+		return self.polarized.getrow(code*len(POLARITIES) + POLARITY_CODES[polarity])
+
+	def associated(self, term, polarity=None, top=10, include_self=False):
+		"""
+		Terms occurring in the documents that contain `term`, by decreasing occurrences.
+
+		term: the seed term id (eg. `prix_NOUN`)
+		polarity: if specified, only documents where the seed has this polarity are used
+		top: number of terms returned, all if None
+		include_self: if False, the seed term is removed from the result
+		Returns a list of (term id, occurrences).
+		"""
+		row = self._row(term, polarity)
+		if row is None:
+			return []
+		codes, counts = row.indices, row.data
+		if not include_self:
+			keep = codes != self.terms.code(term)
+			codes, counts = codes[keep], counts[keep]
+		order = np.argsort(-counts, kind="stable")
+		if top is not None:
+			order = order[:top]
+		return list(zip(self.terms.decode(codes[order]), counts[order].tolist()))
+
+	def documents(self, term, polarity=None):
+		"""Number of documents containing `term` (with `polarity` if specified)."""
+		code = self.terms.encode([term], grow=False)[0]
+		if code < 0 or code >= self.matrix.shape[0]: # unknown when the engine was built
+			return 0
+		if polarity is None:
+			return int(self.doc_frequency[code])
+		return int(self.polarized_doc_frequency[code*len(POLARITIES) + POLARITY_CODES[polarity]])
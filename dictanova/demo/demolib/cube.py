@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+
+"""
+Materialized opinion x time x polarity cube maintained incrementally.
+
+The cube holds, per (term, day, polarity, selected metadata) cell:
+* `count`: number of occurrences of the term
+* `volume`: number of documents, as the COUNT aggregations of the API
+* `numerator` and `denominator`: the metric (CSAT or NPS) of the rating of those
+documents is numerator / denominator (x100 for NPS)
+
+Cells are stored sparse as an int32 key matrix and one NumPy array per measure. Each
+document is also counted in the `ANY` polarity, so that the volume and the metric of
+an opinion whatever its polarity are read without double counting. Days are the base
+buckets: weeks straddle months, the cube rolls up days to weeks, months or years
+exactly. New documents of a ColumnarStore are added with `update_store`, only the ones
+appended since the previous update being read.
+
+When the documents are not mirrored locally, the cube is filled with the cells of
+aggregations (`update_values`, eg. retail UC3 and UC6): its base buckets are then the
+weeks or months of the aggregation, months rolling up to years.
+"""
+
+import datetime, json, os
+import numpy as np
+
+from .enrichments import POLARITIES
+from .interning import Vocabulary
+
+# Polarity codes of the cube: the ones of the enrichments, then no polarity and any
+CUBE_POLARITIES = POLARITIES + ["NONE", "ANY"]
+NONE, ANY = len(POLARITIES), len(POLARITIES) + 1
+
+MEASURES = [("count", np.int64), ("volume", np.int64), ("numerator", np.float64), ("denominator", np.int64)]
+
+# Granularities a base granularity rolls up to exactly
+ROLLUPS = {"DAY": ("WEEK", "MONTH", "YEAR"), "WEEK": (), "MONTH": ("YEAR",), "YEAR": ()}
+
+def bucket_label(day, granularity="DAY"):
+	"""Label of the bucket of a day (`2015-05-04`): `2015-05-04`, `2015-W19`, `2015-05` or `2015`."""
+	if granularity == "DAY":
+		return day
+	if granularity == "WEEK":
+		year, week, _ = datetime.date(int(day[:4]), int(day[5:7]), int(day[8:10])).isocalendar()
+		return "%d-W%d" % (year, week)
+	if granularity == "MONTH":
+		return day[:7]
+	if granularity == "YEAR":
+		return day[:4]
+	raise ValueError("Unknown granularity '%s'" % granularity)
+
+def _metadata(metadata):
+	# Search results list metadata as [{"code": ..., "value": ...}]
+	if isinstance(metadata, dict):
+		return metadata
+	return {m["code"]: m["value"] for m in metadata or []}
+
+class OpinionCube(object):
+	"""Cube of the enrichments of a dataset per term, day, polarity and metadata."""
+
+	def __init__(self, date="date_of_purchase", rating=None, metric="CSAT", by=(), terms=None):
+		"""
+		date: metadata code of the date of the documents
+		rating: metadata code of the rating of the metric, None for no metric
+		metric: CSAT (average rating) or NPS
+		by: metadata codes added as dimensions (eg. `("vendor",)`)
+		terms: Vocabulary of the term codes, eg. the one of a ColumnarStore
+		"""
+		if metric not in ("CSAT", "NPS"):
+			raise ValueError("Unknown metric '%s'" % metric)
+		self.date = date
+		self.rating = rating
+		self.metric = metric
+		self.by = tuple(by)
+		self.terms = terms if terms is not None else Vocabulary()
+		self.granularity = "DAY" # of the buckets
+		self.buckets = Vocabulary()
+		self.values = {name: Vocabulary() for name in self.by}
+		self.columns = ["term", "bucket", "polarity"] + list(self.by)
+		self.keys = np.zeros((0, len(self.columns)), dtype=np.int32)
+		self.measures = {name: np.zeros(0, dtype=dtype) for name, dtype in MEASURES}
+		self.synced = 0 # documents of the store already added
+
+	def __len__(self):
+		return len(self.keys)
+
+	def nbytes(self):
+		return self.keys.nbytes + sum(a.nbytes for a in self.measures.values())
+
+	def _base(self, granularity):
+		# Buckets of a cube all have the same granularity
+		if granularity not in ROLLUPS:
+			raise ValueError("Unknown granularity '%s'" % granularity)
+		if len(self.buckets) and granularity != self.granularity:
+			raise ValueError("Cube of %s buckets, cannot add %s buckets" % (self.granularity, granularity))
+		self.granularity = granularity
+
+	def _accumulate(self, keys, measures):
+		# Sum cells with the same key, existing and new ones
+		keys = np.concatenate([self.keys, keys.astype(np.int32)])
+		if not len(keys):
+			return
+		unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+		inverse = inverse.ravel()
+		for name, dtype in MEASURES:
+			weights = np.concatenate([self.measures[name], measures[name]])
+			self.measures[name] = np.bincount(inverse, weights=weights, minlength=len(unique)).astype(dtype)
+		self.keys = unique
+
+	def update(self, enrichments, metadata):
+		"""
+		Add documents to the cube.
+
+		enrichments: EnrichmentArrays of the documents
+		metadata: metadata of each document (dict, or list of code/value as in search results)
+		"""
+		self._base("DAY")
+		metadata = [_metadata(m) for m in metadata]
+		days = [str(m.get(self.date) or "")[:10] for m in metadata]
+		bucket = np.asarray([self.buckets.code(d) if d else -1 for d in days], dtype=np.int64)
+		by = [np.asarray([self.values[name].code(m.get(name)) for m in metadata], dtype=np.int64) for name in self.by]
+		numerator = np.zeros(len(metadata))
+		denominator = np.zeros(len(metadata), dtype=np.int64)
+		if self.rating is not None:
+			ratings = np.asarray([m.get(self.rating) if m.get(self.rating) not in (None, "") else np.nan
+				for m in metadata], dtype=np.float64)
+			rated = ~np.isnan(ratings)
+			denominator[rated] = 1
+			if self.metric == "CSAT":
+				numerator[rated] = ratings[rated]
+			else:
+				numerator[rated] = (ratings[rated] >= 9).astype(float) - (ratings[rated] <= 6)
+		# One row per enrichment and polarity, in its polarity and in ANY
+		doc = enrichments.doc_index().astype(np.int64)
+		if enrichments.terms is self.terms:
+			term = enrichments.term.astype(np.int64)
+		else:
+			term = self.terms.encode(enrichments.terms.decode(enrichments.term)).astype(np.int64)
+		polarity = enrichments.polarity.astype(np.int64)
+		polarity[polarity < 0] = NONE
+		doc = np.concatenate([doc, doc])
+		rows = np.column_stack([doc, np.concatenate([term, term]), bucket[doc],
+			np.concatenate([polarity, np.full(len(polarity), ANY)])] + [b[doc] for b in by])
+		rows = rows[rows[:, 2] >= 0]
+		if not len(rows):
+			return
+		# Documents are counted once per cell
+		unique, inverse = np.unique(rows, axis=0, return_inverse=True)
+		docs = unique[:, 0]
+		self._accumulate(unique[:, 1:], {
+			"count": np.bincount(inverse.ravel(), minlength=len(unique)),
+			"volume": np.ones(len(unique), dtype=np.int64),
+			"numerator": numerator[docs],
+			"denominator": denominator[docs]
+		})
+
+	def update_values(self, values, granularity="WEEK", kind="COUNT"):
+		"""
+		Add the cells of an aggregation.
+
+		values: `values` of an aggregation period with the dimensions (bucket, TERMS) or
+		(bucket, TERMS, TERMS_POLARITY)
+		granularity: group of the bucket dimension (DAY, WEEK, MONTH or YEAR)
+		kind: COUNT if the values are volumes, else the metric of the cube (CSAT or NPS)
+		of the `volume` documents of each cell
+		Cells without polarity are added to ANY. Cells with a polarity are not, a document
+		may have the term in several polarities.
+		"""
+		if kind not in ("COUNT", self.metric):
+			raise ValueError("Cannot add %s values to a %s cube" % (kind, self.metric))
+		self._base(granularity)
+		values = [v for v in values if v.get("value") is not None]
+		if not values:
+			return
+		value = np.asarray([v["value"] for v in values], dtype=np.float64)
+		volume = np.asarray([v.get("volume") if v.get("volume") is not None else v["value"] for v in values],
+			dtype=np.float64)
+		if kind == "COUNT":
+			volume = value
+		keys = np.column_stack([
+			self.terms.encode(v["dimensions"][1] for v in values),
+			self.buckets.encode(v["dimensions"][0] for v in values),
+			np.asarray([CUBE_POLARITIES.index(v["dimensions"][2]) if len(v["dimensions"]) > 2 else ANY
+				for v in values], dtype=np.int32)
+		] + [np.full(len(values), self.values[name].code(None), dtype=np.int32) for name in self.by])
+		rated = kind != "COUNT"
+		self._accumulate(keys, {
+			"count": volume.astype(np.int64),
+			"volume": volume.astype(np.int64),
+			"numerator": value * volume / (100. if self.metric == "NPS" else 1.) if rated else np.zeros(len(values)),
+			"denominator": volume.astype(np.int64) if rated else np.zeros(len(values), dtype=np.int64)
+		})
+
+	def update_store(self, store, chunk=10000):
+		"""
+		Add the documents appended to a ColumnarStore since the previous update.
+
+		chunk: number of documents read at once
+		Returns the number of documents added.
+		"""
+		start = self.synced
+		for lo in range(start, len(store), chunk):
+			hi = min(lo + chunk, len(store))
+			self.update(store.enrichments(lo, hi), [store.metadata(i) for i in range(lo, hi)])
+			self.synced = hi
+		return self.synced - start
+
+	def rollup(self, granularity="WEEK"):
+		"""
+		Cells of the cube per bucket of a granularity.
+
+		Returns (keys, measures, buckets): keys like `self.keys` with codes of buckets of
+		the granularity, the summed measures and the Vocabulary of the buckets.
+		Raises ValueError if the buckets of the cube do not roll up to the granularity.
+		"""
+		if granularity == self.granularity:
+			return self.keys, self.measures, self.buckets
+		if granularity not in ROLLUPS[self.granularity]:
+			raise ValueError("%s buckets cannot be rolled up to %s" % (self.granularity, granularity))
+		buckets = Vocabulary()
+		mapping = buckets.encode(bucket_label(day, granularity) for day in self.buckets.labels)
+		keys = self.keys.copy()
+		if not len(keys):
+			return keys, dict(self.measures), buckets
+		keys[:, 1] = mapping[keys[:, 1]]
+		unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+		measures = {}
+		for name, dtype in MEASURES:
+			measures[name] = np.bincount(inverse.ravel(), weights=self.measures[name], minlength=len(unique)).astype(dtype)
+		return unique, measures, buckets
+
+	def frame(self, granularity="WEEK", terms=None):
+		"""
+		Cells as a dataframe: `opinion` (term codes), bucket labels (column named after
+		the granularity), `polarity` labels, metadata, measures and `metric`.
+
+		terms: term ids to keep, all of them if None
+		"""
+		import pandas as pd
+		keys, measures, buckets = self.rollup(granularity)
+		mask = np.ones(len(keys), dtype=bool)
+		if terms is not None:
+			mask &= np.isin(keys[:, 0], self.terms.encode(terms, grow=False))
+		keys = keys[mask]
+		data = {
+			"opinion": keys[:, 0],
+			granularity.lower(): buckets.decode(keys[:, 1]),
+			"polarity": np.asarray(CUBE_POLARITIES, dtype=object)[keys[:, 2]]
+		}
+		for i, name in enumerate(self.by):
+			data[name] = self.values[name].decode(keys[:, 3+i])
+		for name, _ in MEASURES:
+			data[name] = measures[name][mask]
+		with np.errstate(divide="ignore", invalid="ignore"):
+			data["metric"] = data["numerator"] / data["denominator"] * (100. if self.metric == "NPS" else 1.)
+		return pd.DataFrame(data)
+
+	def pivot(self, measure="volume", granularity="WEEK", terms=None):
+		"""
+		(opinion, bucket) x polarity table of a measure (or `metric`), as the pivots of
+		the aggregations of UC3 and UC6.
+		"""
+		df = self.frame(granularity, terms)
+		index = ["opinion", granularity.lower()]
+		if measure == "metric":
+			# Summed over the metadata before the ratio
+			num = df.pivot_table(index=index, columns="polarity", values="numerator", aggfunc="sum")
+			den = df.pivot_table(index=index, columns="polarity", values="denominator", aggfunc="sum")
+			return num / den.where(den > 0) * (100. if self.metric == "NPS" else 1.)
+		return df.pivot_table(index=index, columns="polarity", values=measure, aggfunc="sum")
+
+	def save(self, path):
+		"""Persist the cube in a directory (`cube.npz` and `cube.json`)."""
+		os.makedirs(path, exist_ok=True)
+		tmp = os.path.join(path, "cube.tmp.npz")
+		np.savez(tmp, keys=self.keys, **self.measures)
+		os.replace(tmp, os.path.join(path, "cube.npz"))
+		with open(os.path.join(path, "cube.json.tmp"), "w", encoding="utf-8") as fout:
+			json.dump({
+				"date": self.date,
+				"rating": self.rating,
+				"metric": self.metric,
+				"by": list(self.by),
+				"granularity": self.granularity,
+				"synced": self.synced,
+				"terms": self.terms.labels,
+				"buckets": self.buckets.labels,
+				"values": {name: v.labels for name, v in self.values.items()}
+			}, fout, ensure_ascii=False)
+		os.replace(os.path.join(path, "cube.json.tmp"), os.path.join(path, "cube.json"))
+
+	@classmethod
+	def load(cls, path):
+		with open(os.path.join(path, "cube.json"), "r", encoding="utf-8") as fin:
+			meta = json.load(fin)
+		cube = cls(meta["date"], meta["rating"], meta["metric"], meta["by"], Vocabulary(meta["terms"]))
+		cube.synced = meta["synced"]
+		cube.granularity = meta.get("granularity", "DAY")
+		cube.buckets = Vocabulary(meta["buckets"])
+		cube.values = {name: Vocabulary(labels) for name, labels in meta["values"].items()}
+		with np.load(os.path.join(path, "cube.npz")) as arrays:
+			cube.keys = arrays["keys"]
+			cube.measures = {name: arrays[name] for name, _ in MEASURES}
+		return cube
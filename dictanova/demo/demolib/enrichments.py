@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compact array-backed representation of document enrichments.
+
+The `enrichments` of search results are lists of dicts with nested `offset` dicts.
+They are decoded once into a structure of arrays (term code, polarity code, begin,
+end) with per-document offsets so that filtering, sorting and statistics are
+vectorized.
+"""
+
+import numpy as np
+
+# Polarity codes, the index in this list is the code
+POLARITIES = ["POSITIVE", "NEGATIVE", "NEUTRAL"]
+POLARITY_CODES = {p: i for i,p in enumerate(POLARITIES)}
+
+class EnrichmentArrays(object):
+	"""Enrichments of a list of documents stored as flat NumPy arrays."""
+
+	def __init__(self, term, polarity, begin, end, doc_offsets, terms):
+		self.term = term # int32 term codes
+		self.polarity = polarity # int8 polarity codes, -1 if none
+		self.begin = begin # int32
+		self.end = end # int32
+		self.doc_offsets = doc_offsets # int64, enrichments of doc i are [offsets[i], offsets[i+1])
+		self.terms = terms # Vocabulary of the term codes
+
+	@classmethod
+	def from_documents(cls, documents, terms, strip=False):
+		"""
+		Decode the enrichments of documents.
+
+		documents: list of documents (items in search result)
+		terms: Vocabulary used to intern term ids
+		strip: if True, the `enrichments` key is removed from the documents
+		"""
+		counts = np.zeros(len(documents)+1, dtype=np.int64)
+		term, polarity, begin, end = [], [], [], []
+		for i, doc in enumerate(documents):
+			enrichments = doc.pop("enrichments", []) if strip else doc.get("enrichments", [])
+			counts[i+1] = len(enrichments)
+			for e in enrichments:
+				term.append(e["term"])
+				polarity.append(POLARITY_CODES.get(e.get("opinion"), -1))
+				begin.append(e["offset"]["begin"])
+				end.append(e["offset"]["end"])
+		return cls(
+			terms.encode(term),
+			np.asarray(polarity, dtype=np.int8),
+			np.asarray(begin, dtype=np.int32),
+			np.asarray(end, dtype=np.int32),
+			np.cumsum(counts),
+			terms)
+
+	def __len__(self):
+		return len(self.doc_offsets) - 1
+
+	@property
+	def size(self):
+		"""Total number of enrichments."""
+		return len(self.term)
+
+	def doc_index(self):
+		"""Index of the document of each enrichment."""
+		return np.repeat(np.arange(len(self), dtype=np.int32), np.diff(self.doc_offsets))
+
+	def select(self, term=None, polarity=None):
+		"""
+		Boolean mask of the enrichments matching a filter.
+
+		term: a term id, or a list of term ids, if None all terms match
+		polarity: a polarity ("NEGATIVE"...) or a list of polarities, if None all match
+		"""
+		mask = np.ones(self.size, dtype=bool)
+		if term is not None:
+			ids = [term] if isinstance(term, str) else term
+			mask &= np.isin(self.term, self.terms.encode(ids, grow=False))
+		if polarity is not None:
+			pols = [polarity] if isinstance(polarity, str) else polarity
+			mask &= np.isin(self.polarity, [POLARITY_CODES[p] for p in pols])
+		return mask
+
+	def sorted_order(self, mask=None):
+		"""Indices of the (masked) enrichments sorted by document then begin offset."""
+		idx = np.arange(self.size) if mask is None else np.flatnonzero(mask)
+		order = np.lexsort((self.begin[idx], self.doc_index()[idx]))
+		return idx[order]
+
+	def spans(self, i, mask=None):
+		"""
+		Enrichments of document `i` sorted by begin offset.
+
+		Returns the arrays (begin, end, polarity, term) of the selected enrichments.
+		"""
+		lo, hi = self.doc_offsets[i], self.doc_offsets[i+1]
+		idx = np.arange(lo, hi)
+		if mask is not None:
+			idx = idx[mask[lo:hi]]
+		idx = idx[np.argsort(self.begin[idx], kind="stable")]
+		return self.begin[idx], self.end[idx], self.polarity[idx], self.term[idx]
+
+	def term_counts(self, mask=None):
+		"""Number of occurrences per term code."""
+		codes = self.term if mask is None else self.term[mask]
+		return np.bincount(codes, minlength=len(self.terms))
+
+	def doc_counts(self, mask=None):
+		"""Number of (masked) enrichments per document."""
+		if mask is None:
+			return np.diff(self.doc_offsets)
+		return np.bincount(self.doc_index()[mask], minlength=len(self))
+
+	def nbytes(self):
+		return sum(a.nbytes for a in (self.term, self.polarity, self.begin, self.end, self.doc_offsets))
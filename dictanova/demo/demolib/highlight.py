@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+"""
+Highlighting of semantic enrichments in document content.
+
+Documents are highlighted as text, as html, or summarized as fixed-width
+keyword-in-context (KWIC) snippets around each occurrence. The content is cut at the
+sorted boundaries of the enrichments and written by slices: nested or overlapping
+enrichments are rendered as properly nested spans, and the html output is buffered so
+that thousands of documents can be exported quickly.
+"""
+
+import html
+import numpy as np
+
+from .enrichments import POLARITIES, POLARITY_CODES
+
+# Background color per polarity
+COLORMAP = {
+	"POSITIVE": "LightGreen",
+	"NEGATIVE": "LightCoral",
+	"NEUTRAL": "LightGray"
+}
+
+def document_spans(doc, only=None):
+	"""
+	Enrichments of a single document as arrays (begin, end, polarity code).
+
+	doc: a document (item in search result)
+	only: if specified, only the enrichments of this term id are kept
+	"""
+	enrichments = [e for e in doc.get("enrichments", []) if only is None or e["term"]==only]
+	begins = np.asarray([e["offset"]["begin"] for e in enrichments], dtype=np.int32)
+	ends = np.asarray([e["offset"]["end"] for e in enrichments], dtype=np.int32)
+	polarities = np.asarray([POLARITY_CODES.get(e.get("opinion"), -1) for e in enrichments], dtype=np.int8)
+	order = np.argsort(begins, kind="stable")
+	return begins[order], ends[order], polarities[order]
+
+def _escape(text):
+	return html.escape(text, quote=False).replace("\n", "<br />\n")
+
+def _merge_spans(begins, ends, n):
+	# Union of the (sorted by begin) spans, clipped to the content
+	merged = []
+	for b, e in zip(np.clip(begins, 0, n).tolist(), np.clip(ends, 0, n).tolist()):
+		if merged and b <= merged[-1][1]:
+			merged[-1][1] = max(merged[-1][1], e)
+		else:
+			merged.append([b, e])
+	return merged
+
+def text_highlight(content, begins, ends, marker="**"):
+	"""
+	Text of `content` where each enrichment is surrounded by `marker`.
+
+	content: the text of the document
+	begins, ends: arrays of the offsets of the enrichments, sorted by begin
+	marker: the string inserted before and after each enrichment
+	"""
+	parts = []
+	last = 0
+	for b, e in _merge_spans(begins, ends, len(content)):
+		parts.append(content[last:b])
+		parts.append(content[b:e])
+		last = e
+	parts.append(content[last:])
+	return marker.join(parts)
+
+def kwic(content, begins, ends, width=40):
+	"""
+	Fixed-width keyword-in-context snippets, one per enrichment.
+
+	content: the text of the document
+	begins, ends: arrays of the offsets of the enrichments
+	width: number of characters of context kept on each side
+	Returns a list of (left context, keyword, right context), the left context being
+	right-aligned and the right context left-aligned on `width` characters.
+	"""
+	snippets = []
+	for b, e in zip(np.asarray(begins).tolist(), np.asarray(ends).tolist()):
+		left = content[max(0, b-width):b].replace("\n", " ")
+		right = content[e:e+width].replace("\n", " ")
+		snippets.append((left.rjust(width), content[b:e].replace("\n", " "), right.ljust(width)))
+	return snippets
+
+def highlight_documents(documents, enrichments, term=None, polarity=None, mode="text", **options):
+	"""
+	Highlight a batch of documents with their precomputed enrichments.
+
+	documents: list of documents (items in search result), in the order of `enrichments`
+	enrichments: EnrichmentArrays of the documents
+	term: a term id or a list of term ids to highlight, all if None
+	polarity: a polarity or a list of polarities to highlight, all if None
+	mode: "text", "html" or "kwic"
+	options: passed to text_highlight, html_highlight or kwic
+	Yields the highlighted text or html of each document, or the list of its KWIC snippets.
+	"""
+	selected = enrichments.select(term=term, polarity=polarity)
+	for d, doc in enumerate(documents):
+		begins, ends, polarities, _ = enrichments.spans(d, selected)
+		if mode == "text":
+			yield text_highlight(doc["content"], begins, ends, **options)
+		elif mode == "html":
+			yield html_highlight(doc["content"], begins, ends, polarities, **options)
+		elif mode == "kwic":
+			yield kwic(doc["content"], begins, ends, **options)
+		else:
+			raise ValueError("Unknown highlight mode '%s'" % mode)
+
+def kwic_lines(documents, enrichments, term=None, polarity=None, width=40, separator=" | "):
+	"""
+	KWIC snippets of a batch of documents formatted as aligned lines.
+
+	documents: list of documents (items in search result), in the order of `enrichments`
+	enrichments: EnrichmentArrays of the documents
+	term, polarity: filter of the enrichments, see highlight_documents
+	width: number of characters of context kept on each side
+	separator: string between the contexts and the keyword
+	Yields (document index, line).
+	"""
+	snippets = highlight_documents(documents, enrichments, term, polarity, mode="kwic", width=width)
+	for d, doc_snippets in enumerate(snippets):
+		for left, keyword, right in doc_snippets:
+			yield d, separator.join((left, keyword, right))
+
+def html_highlight(content, begins, ends, polarities, colormap=COLORMAP):
+	"""
+	Html of `content` where each enrichment is wrapped in a colored span.
+
+	content: the text of the document
+	begins, ends, polarities: arrays describing the enrichments
+	colormap: background color per polarity
+	"""
+	n = len(content)
+	if len(begins) == 0:
+		return _escape(content)
+	begins = np.clip(np.asarray(begins), 0, n)
+	ends = np.clip(np.asarray(ends), 0, n)
+	# Outer spans first: by begin, then longest
+	order = np.lexsort((-ends, begins))
+	begins, ends = begins[order].tolist(), ends[order].tolist()
+	polarities = np.asarray(polarities)[order].tolist()
+	bounds = np.unique(np.concatenate(([0, n], begins, ends))).tolist()
+	parts = []
+	active = []
+	following = 0
+	for start, stop in zip(bounds[:-1], bounds[1:]):
+		# Sweep: add the enrichments beginning here, drop the ones that ended
+		current = [j for j in active if ends[j] > start]
+		while following < len(begins) and begins[following] <= start:
+			if ends[following] > start:
+				current.append(following)
+			following += 1
+		if current != active:
+			# Close the open spans and reopen the active ones to keep them nested
+			parts.append("</span>" * len(active))
+			for j in current:
+				color = colormap.get(POLARITIES[polarities[j]] if polarities[j] >= 0 else None, "LightGray")
+				parts.append("<span style=\"background-color: %s\">" % color)
+			active = current
+		parts.append(_escape(content[start:stop]))
+	parts.append("</span>" * len(active))
+	return "".join(parts)
+
+def write_html(fout, documents, only=None, meta=None, enrichments=None, colormap=COLORMAP, buffer_size=1<<16):
+	"""
+	Write an html page highlighting the enrichments of documents.
+
+	fout: a file opened for writing text
+	documents: iterable of documents (items in search result)
+	only: if specified, the highlight is limited to the opinion id in parameter
+	meta: a list of metadata to display, if None no metadata is displayed
+	enrichments: EnrichmentArrays of the documents, read from each document if None
+	colormap: background color per polarity
+	buffer_size: number of characters buffered before writing to `fout`
+	"""
+	buf = []
+	size = 0
+	def emit(text):
+		nonlocal size
+		buf.append(text)
+		size += len(text)
+		if size >= buffer_size:
+			fout.write("".join(buf))
+			del buf[:]
+			size = 0
+	# header
+	emit("<!DOCTYPE html>\n")
+	emit("<html lang=\"en\">\n")
+	emit("<head>\n<meta charset=\"utf-8\">\n<title>json2html</title>\n</head>\n")
+	emit("<body style=\"font-family : geomanist; padding:30px; \">\n")
+	emit("<ul style=\"list-style:none;\">\n")
+	selected = None
+	if enrichments is not None and only is not None:
+		selected = enrichments.select(term=only)
+	# Each document
+	for d, doc in enumerate(documents):
+		if enrichments is None:
+			begins, ends, polarities = document_spans(doc, only)
+		else:
+			begins, ends, polarities, _ = enrichments.spans(d, selected)
+		emit("<li style=\"margin-bottom:20px; border:1px solid gray; padding:10px;\">\n")
+		emit("<h3>%s</h3>\n" % html.escape(doc["externalId"]))
+		if not meta is None:
+			emit("<ul style=\"list-style:none\">\n")
+			for m in doc["metadata"]:
+				if m["code"] in meta:
+					emit("<li style=\"display: inline; font-size: 75%%; font-color: grey\">%s=%s</li>\n" % (m["code"], html.escape(str(m["value"]))))
+			emit("</ul><br />\n")
+		emit("<p>\n")
+		emit(html_highlight(doc["content"], begins, ends, polarities, colormap))
+		emit("</p></li>\n")
+	# footer
+	emit("</ul>\n</body>\n</html>\n")
+	fout.write("".join(buf))
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+"""
+Integer interning of term ids and dimension values.
+
+Opinion ids (`prix_NOUN`), vendors, brands or week labels (`2015-W18`) are mapped
+to stable int32 codes per dataset. Result frames store those codes instead of
+Python strings and labels are decoded only when results are displayed.
+"""
+
+import json
+import numpy as np
+
+class Vocabulary(object):
+	"""Bidirectional mapping between labels and stable int32 codes."""
+
+	def __init__(self, labels=None):
+		self._codes = {}
+		self._labels = []
+		for label in (labels or []):
+			self.code(label)
+
+	def __len__(self):
+		return len(self._labels)
+
+	def __contains__(self, label):
+		return label in self._codes
+
+	@property
+	def labels(self):
+		return list(self._labels)
+
+	def code(self, label):
+		"""Return the code of `label`, assigning the next free code if unknown."""
+		code = self._codes.get(label)
+		if code is None:
+			code = len(self._labels)
+			self._codes[label] = code
+			self._labels.append(label)
+		return code
+
+	def encode(self, labels, grow=True):
+		"""
+		Encode a sequence of labels as an int32 array.
+
+		labels: iterable of labels
+		grow: if False, unknown labels are encoded as -1 instead of being added
+		"""
+		if grow:
+			codes = [self.code(label) for label in labels]
+		else:
+			codes = [self._codes.get(label, -1) for label in labels]
+		return np.asarray(codes, dtype=np.int32)
+
+	def label(self, code):
+		return self._labels[code]
+
+	def decode(self, codes):
+		"""Decode an array of codes into an object array of labels (-1 gives None)."""
+		codes = np.asarray(codes, dtype=np.int64)
+		lookup = np.empty(len(self._labels)+1, dtype=object)
+		lookup[:-1] = self._labels
+		lookup[-1] = None
+		return lookup[codes]
+
+	def categorical(self, codes):
+		"""Wrap codes in a pandas Categorical sharing this vocabulary as categories."""
+		import pandas as pd
+		return pd.Categorical.from_codes(np.asarray(codes), categories=self._labels)
+
+class InternTable(object):
+	"""Set of vocabularies of one dataset, one per namespace (opinion, vendor, week...)."""
+
+	def __init__(self, dataset):
+		self.dataset = dataset
+		self._vocabularies = {}
+
+	def __getitem__(self, namespace):
+		if namespace not in self._vocabularies:
+			self._vocabularies[namespace] = Vocabulary()
+		return self._vocabularies[namespace]
+
+	def __contains__(self, namespace):
+		return namespace in self._vocabularies
+
+	def save(self, path):
+		"""Persist the vocabularies so that codes stay stable across runs."""
+		with open(path, "w", encoding="utf-8") as fout:
+			json.dump({
+				"dataset": self.dataset,
+				"vocabularies": {ns: v.labels for ns,v in self._vocabularies.items()}
+			}, fout)
+
+	@classmethod
+	def load(cls, path):
+		with open(path, "r", encoding="utf-8") as fin:
+			data = json.load(fin)
+		table = cls(data["dataset"])
+		for ns, labels in data["vocabularies"].items():
+			table._vocabularies[ns] = Vocabulary(labels)
+		return table
+
+# One table per dataset for the whole process
+_tables = {}
+
+def intern_table(dataset):
+	"""Return the process-wide intern table of `dataset`."""
+	if dataset not in _tables:
+		_tables[dataset] = InternTable(dataset)
+	return _tables[dataset]
+
+def values_frame(values, columns, table):
+	"""
+	Build a dataframe from the `values` of an aggregation period with interned dimensions.
+
+	values: list of values of a period (`r.json()["periods"][0]["values"]`)
+	columns: name of each dimension, used both as column name and vocabulary namespace
+	table: the InternTable of the dataset
+	"""
+	import pandas as pd
+	data = {}
+	for i, column in enumerate(columns):
+		data[column] = table[column].encode(v["dimensions"][i] for v in values)
+	for key in ("value", "volume"):
+		data[key] = np.asarray([v.get(key) for v in values], dtype=np.float64)
+	return pd.DataFrame(data)
+
+def decode_frame(df, columns, table):
+	"""
+	Return a copy of `df` where the interned columns (or index levels) are decoded.
+
+	df: dataframe with interned columns
+	columns: name of the columns or index levels to decode
+	table: the InternTable of the dataset
+	"""
+	df = df.copy()
+	for column in columns:
+		if column in df.columns:
+			df[column] = table[column].decode(df[column].values)
+		elif column in (df.index.names or []):
+			if df.index.nlevels == 1:
+				df.index = df.index.map(table[column].label)
+			else:
+				level = df.index.names.index(column)
+				df.index = df.index.set_levels(
+					df.index.levels[level].map(table[column].label), level=level)
+	return df
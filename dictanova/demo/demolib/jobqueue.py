@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+"""
+Durable queue of (dataset x use case x period) jobs drained by workers.
+
+The queue is a SQLite database that workers of the same or of several hosts open (a
+file on a filesystem with working locks). A worker leases a job for a duration and
+renews the lease with heartbeats while the job runs: the job of a worker that died is
+leased again once its lease expired. A worker whose heartbeat finds the lease lost (eg.
+it was stalled past the expiry) leaves the job to its new owner and ignores its result. A failed job is retried after a delay until it
+reached the maximal number of attempts. Jobs are identified by (dataset, demo, use
+case, period), queuing the same jobs again is a no-op unless `reset`.
+
+Workers run the jobs as the scheduler does (see scheduler.run_job); with a shared
+response cache (`DICTANOVA_CACHE`, see responsecache.py) the fetches of a worker are
+reused by the others.
+"""
+
+import collections, json, os, socket, sqlite3, time, traceback
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from .scheduler import Job, JobResult, _report, describe_job, run_job
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+	id INTEGER PRIMARY KEY,
+	dataset TEXT NOT NULL,
+	demo TEXT NOT NULL,
+	use_case TEXT NOT NULL,
+	period TEXT NOT NULL,
+	fields TEXT NOT NULL,
+	state TEXT NOT NULL,
+	attempts INTEGER NOT NULL DEFAULT 0,
+	available REAL NOT NULL DEFAULT 0,
+	owner TEXT,
+	expires REAL,
+	error TEXT,
+	UNIQUE (dataset, demo, use_case, period)
+)
+"""
+
+# States of a job
+PENDING, LEASED, DONE, FAILED = "pending", "leased", "done", "failed"
+
+Lease = collections.namedtuple("Lease", ["id", "job", "attempt"])
+
+def worker_name():
+	"""Owner name of the leases of the current process."""
+	return "%s:%d" % (socket.gethostname(), os.getpid())
+
+class JobQueue(object):
+	"""SQLite queue of jobs with leases, safe to share between processes and hosts."""
+
+	def __init__(self, path, max_attempts=3, retry_delay=60.):
+		"""
+		path: SQLite database of the queue, created if needed
+		max_attempts: number of times a job is run before being failed
+		retry_delay: seconds before a failed job is leased again
+		"""
+		self.path = os.path.abspath(path)
+		self.max_attempts = max_attempts
+		self.retry_delay = retry_delay
+		with self._connect() as db:
+			db.execute(SCHEMA)
+
+	def _connect(self):
+		# A connection per operation: queues are shared by threads and processes
+		db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+		db.row_factory = sqlite3.Row
+		return _Transaction(db)
+
+	def put(self, jobs, reset=False):
+		"""
+		Queue jobs, returns the number of jobs added.
+
+		reset: if True, the jobs already done or failed are queued again
+		"""
+		added = 0
+		with self._connect() as db:
+			for job in jobs:
+				row = (job.dataset, job.demo, job.use_case, job.period or "")
+				cursor = db.execute(
+					"INSERT OR IGNORE INTO jobs (dataset, demo, use_case, period, fields, state) VALUES (?, ?, ?, ?, ?, ?)",
+					row + (json.dumps(job.fields, sort_keys=True), PENDING))
+				added += cursor.rowcount
+				if reset and not cursor.rowcount:
+					db.execute(
+						"UPDATE jobs SET state = ?, attempts = 0, available = 0, owner = NULL, error = NULL "
+						"WHERE dataset = ? AND demo = ? AND use_case = ? AND period = ? AND state IN (?, ?)",
+						(PENDING,) + row + (DONE, FAILED))
+		return added
+
+	def lease(self, owner, duration=600.):
+		"""
+		Lease the next available job.
+
+		owner: name of the worker, see worker_name()
+		duration: seconds before the lease expires without heartbeat
+		Returns a Lease, or None if no job is available.
+		"""
+		now = time.time()
+		with self._connect() as db:
+			while True:
+				row = db.execute(
+					"SELECT * FROM jobs WHERE (state = ? AND available <= ?) OR (state = ? AND expires < ?) "
+					"ORDER BY id LIMIT 1", (PENDING, now, LEASED, now)).fetchone()
+				if row is None:
+					return None
+				if row["state"] == LEASED and row["attempts"] >= self.max_attempts:
+					# The worker died on the last attempt
+					db.execute("UPDATE jobs SET state = ?, owner = NULL, error = ? WHERE id = ?",
+						(FAILED, "lease of %s expired" % row["owner"], row["id"]))
+					continue
+				db.execute("UPDATE jobs SET state = ?, owner = ?, expires = ?, attempts = attempts + 1 WHERE id = ?",
+					(LEASED, owner, now + duration, row["id"]))
+				job = Job(row["dataset"], row["demo"], row["use_case"], json.loads(row["fields"]), row["period"] or None)
+				return Lease(row["id"], job, row["attempts"] + 1)
+
+	def heartbeat(self, lease, owner, duration=600.):
+		"""Extend a lease, returns False if it was lost (expired and leased by another worker)."""
+		with self._connect() as db:
+			cursor = db.execute("UPDATE jobs SET expires = ? WHERE id = ? AND owner = ? AND state = ?",
+				(time.time() + duration, lease.id, owner, LEASED))
+			return cursor.rowcount == 1
+
+	def complete(self, lease, owner, error=None):
+		"""
+		End a leased job, failed if `error` is not None.
+
+		Returns the new state of the job, None if the lease was lost.
+		"""
+		if error is None:
+			state, available = DONE, 0
+		elif lease.attempt < self.max_attempts:
+			state, available = PENDING, time.time() + self.retry_delay
+		else:
+			state, available = FAILED, 0
+		with self._connect() as db:
+			cursor = db.execute(
+				"UPDATE jobs SET state = ?, available = ?, owner = NULL, expires = NULL, error = ? "
+				"WHERE id = ? AND owner = ? AND state = ?",
+				(state, available, error, lease.id, owner, LEASED))
+			return state if cursor.rowcount == 1 else None
+
+	def counts(self):
+		"""Dict state -> number of jobs."""
+		with self._connect() as db:
+			return dict((row[0], row[1]) for row in db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+
+	def unfinished(self):
+		"""Number of jobs pending or leased."""
+		counts = self.counts()
+		return counts.get(PENDING, 0) + counts.get(LEASED, 0)
+
+	def failures(self):
+		"""List of (Job, error) of the failed jobs."""
+		with self._connect() as db:
+			rows = db.execute("SELECT * FROM jobs WHERE state = ? ORDER BY id", (FAILED,)).fetchall()
+		return [(Job(r["dataset"], r["demo"], r["use_case"], json.loads(r["fields"]), r["period"] or None), r["error"])
+			for r in rows]
+
+class _Transaction(object):
+	# Connection used as an immediate transaction, committed unless an exception is raised
+
+	def __init__(self, db):
+		self.db = db
+
+	def __enter__(self):
+		self.db.execute("BEGIN IMMEDIATE")
+		return self.db
+
+	def __exit__(self, kind, value, tb):
+		try:
+			self.db.execute("ROLLBACK" if kind else "COMMIT")
+		finally:
+			self.db.close()
+
+class Worker(object):
+	"""Drains a JobQueue with a pool of processes, cooperatively with the other workers."""
+
+	def __init__(self, queue, output=".", processes=1, lease=600., heartbeat=60., poll=10., progress=_report):
+		"""
+		queue: JobQueue
+		output: root directory of the outputs, one sub-directory per dataset
+		processes: number of jobs run at the same time by this worker
+		lease: seconds a job is leased for without heartbeat
+		heartbeat: seconds between the renewals of the leases of the running jobs
+		poll: seconds between two checks of the queue when no job is available
+		progress: function called with (JobResult, number of jobs done, None)
+		"""
+		self.queue = queue
+		self.output = os.path.abspath(output)
+		self.processes = processes
+		self.lease = lease
+		self.heartbeat = heartbeat
+		self.poll = poll
+		self.progress = progress
+		self.owner = worker_name()
+		# Jobs whose lease was lost while they ran
+		self.lost = []
+
+	def run(self):
+		"""
+		Run jobs until the queue has no pending or leased job, returns the JobResult of this worker.
+
+		The jobs whose lease was lost are neither completed nor returned, see `lost`.
+		"""
+		results = []
+		with ProcessPoolExecutor(max_workers=self.processes) as pool:
+			running = {}
+			# Futures of lost jobs, still using a process of the pool
+			abandoned = set()
+			while True:
+				abandoned = set(f for f in abandoned if not f.done())
+				while len(running) + len(abandoned) < self.processes:
+					lease = self.queue.lease(self.owner, self.lease)
+					if lease is None:
+						break
+					running[pool.submit(run_job, lease.job, self.output)] = lease
+				if not running:
+					if not self.queue.unfinished():
+						break
+					# Jobs leased by other workers, retried later or whose lease may expire
+					time.sleep(self.poll)
+					continue
+				done, _ = wait(list(running) + list(abandoned), timeout=self.heartbeat, return_when=FIRST_COMPLETED)
+				for future in done:
+					if future in abandoned:
+						continue
+					lease = running.pop(future)
+					try:
+						result = future.result()
+					except Exception:
+						# The worker process died
+						result = JobResult(lease.job, 0., traceback.format_exc())
+					self.queue.complete(lease, self.owner, result.error)
+					results.append(result)
+					if self.progress is not None:
+						self.progress(result, len(results), None)
+				for future, lease in list(running.items()):
+					if not self.queue.heartbeat(lease, self.owner, self.lease):
+						# Leased again by another worker, which completes it
+						del running[future]
+						if not future.cancel():
+							abandoned.add(future)
+						self.lost.append(lease.job)
+						print("%s: lease lost, left to another worker" % describe_job(lease.job))
+		return results
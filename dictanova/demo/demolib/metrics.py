@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+"""
+Satisfaction metrics derived locally from rating distributions.
+
+One COUNT aggregation with an additional DISTINCT dimension on the rating field gives
+the distribution of the ratings per group of the other dimensions. CSAT (average
+rating), NPS, promoters / passives / detractors, top-2-box and averages are all derived
+from it with vectorized code: a dashboard needs one request per slice (filter and
+dimensions) instead of one per metric, and the request is memoized and cached as any.
+"""
+
+import numpy as np
+
+# Built with the queries, readable without NumPy (eg. in the FETCHES of the scripts)
+from .query import distribution_query
+
+# Default NPS groups, of a 0-10 rating
+PROMOTER, DETRACTOR = 9, 6
+
+class Distribution(object):
+	"""Distribution of a rating per group of dimension values."""
+
+	def __init__(self, groups, ratings, counts):
+		"""
+		groups: list of tuples of the dimension values of each group
+		ratings: sorted float array of the rating values
+		counts: array groups x ratings of the number of documents
+		"""
+		self.groups = groups
+		self.ratings = ratings
+		self.counts = counts
+
+	@classmethod
+	def from_values(cls, values, key="value"):
+		"""
+		Distribution of the `values` of a period of a distribution_query.
+
+		key: `value` for a COUNT query, `volume` for a CSAT or NPS one
+		"""
+		groups, index = [], {}
+		rows, ratings = [], []
+		for v in values:
+			group = tuple(v["dimensions"][:-1])
+			if group not in index:
+				index[group] = len(groups)
+				groups.append(group)
+			rows.append(index[group])
+			ratings.append(float(v["dimensions"][-1]))
+		scale, columns = np.unique(np.asarray(ratings, dtype=np.float64), return_inverse=True)
+		counts = np.zeros((len(groups), len(scale)), dtype=np.float64)
+		np.add.at(counts, (np.asarray(rows, dtype=np.int64), columns.ravel()), [v[key] or 0 for v in values])
+		return cls(groups, scale, counts)
+
+	@classmethod
+	def from_response(cls, payload, key="value"):
+		"""Distribution of the response (JSON payload) of a distribution_query, see from_values."""
+		return cls.from_values(payload["periods"][0]["values"], key)
+
+	def __len__(self):
+		return len(self.groups)
+
+	def volume(self):
+		"""Number of rated documents per group."""
+		return self.counts.sum(axis=1)
+
+	def _ratio(self, numerator):
+		with np.errstate(divide="ignore", invalid="ignore"):
+			return numerator / self.volume()
+
+	def average(self):
+		"""Average rating per group, the CSAT of the demos."""
+		return self._ratio(self.counts @ self.ratings)
+
+	def nps_groups(self, promoter=PROMOTER, detractor=DETRACTOR):
+		"""
+		(promoters, passives, detractors) volumes per group.
+
+		promoter, detractor: lowest rating of the promoters and highest rating of the
+		detractors, the ones of a 0-10 scale by default
+		"""
+		promoters = self.counts[:, self.ratings >= promoter].sum(axis=1)
+		detractors = self.counts[:, self.ratings <= detractor].sum(axis=1)
+		return promoters, self.volume() - promoters - detractors, detractors
+
+	def nps(self, promoter=PROMOTER, detractor=DETRACTOR):
+		"""NPS per group: % of promoters - % of detractors, see nps_groups."""
+		promoters, _, detractors = self.nps_groups(promoter, detractor)
+		return 100. * self._ratio(promoters - detractors)
+
+	def top_box(self, n=2, best=None):
+		"""
+		% of the ratings in the `n` best values of the scale per group.
+
+		best: best rating of the scale, the highest rating observed if None
+		"""
+		if best is None:
+			best = self.ratings.max() if len(self.ratings) else 0.
+		return 100. * self._ratio(self.counts[:, self.ratings > best - n].sum(axis=1))
+
+	def reindex(self, ratings):
+		"""Distribution over a scale containing the ratings of this one, eg. their union."""
+		ratings = np.asarray(ratings, dtype=np.float64)
+		counts = np.zeros((len(self.groups), len(ratings)), dtype=np.float64)
+		counts[:, np.searchsorted(ratings, self.ratings)] = self.counts
+		return Distribution(self.groups, ratings, counts)
+
+	def select(self, low=None, high=None):
+		"""Distribution of the ratings between `low` and `high` (included), eg. without the unsatisfied."""
+		mask = np.ones(len(self.ratings), dtype=bool)
+		if low is not None:
+			mask &= self.ratings >= low
+		if high is not None:
+			mask &= self.ratings <= high
+		return Distribution(self.groups, self.ratings[mask], self.counts[:, mask])
+
+	def without(self, other):
+		"""
+		Distribution of the documents of this one-group distribution (eg. the whole
+		perimeter) minus the ones of each group of `other` (eg. of each opinion).
+		"""
+		if len(self.groups) != 1:
+			raise ValueError("Only a distribution of one group can be split")
+		scale = np.union1d(self.ratings, other.ratings)
+		counts = self.reindex(scale).counts - other.reindex(scale).counts
+		return Distribution(other.groups, scale, counts)
+
+	def rating_counts(self, i=0):
+		"""Dict rating -> number of documents of the group `i`."""
+		return {int(r) if r.is_integer() else float(r): float(c) for r, c in zip(self.ratings, self.counts[i])}
+
+	def frame(self, names=None, nps=True, promoter=PROMOTER, detractor=DETRACTOR):
+		"""
+		Metrics per group as a dataframe: the group columns, `volume`, `average`, `top2box`,
+		the volume of each rating and, if `nps`, `nps`, `promoters`, `passives` and
+		`detractors`.
+
+		names: names of the group columns, `dim0`, `dim1`... if None
+		promoter, detractor: NPS groups, see nps_groups
+		"""
+		import pandas as pd
+		width = len(self.groups[0]) if self.groups else 0
+		names = names or ["dim%d" % i for i in range(width)]
+		data = {name: [g[i] for g in self.groups] for i, name in enumerate(names)}
+		data.update({"volume": self.volume(), "average": self.average(), "top2box": self.top_box()})
+		if nps:
+			data["promoters"], data["passives"], data["detractors"] = self.nps_groups(promoter, detractor)
+			data["nps"] = self.nps(promoter, detractor)
+		for r, column in zip(self.ratings, self.counts.T):
+			data[int(r) if r.is_integer() else r] = column
+		return pd.DataFrame(data)
+
+def distribution(api, url, rating, dimensions=(), query=None, periods=None, auth=None):
+	"""
+	Fetch a distribution_query with a DictanovaClient, returns a Distribution.
+
+	Raises requests.HTTPError if the request failed.
+	"""
+	r = api.post(url, json=distribution_query(rating, dimensions, query, periods), auth=auth)
+	r.raise_for_status()
+	return Distribution.from_response(r.json())
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+"""
+Pagination of the search requests with a page size tuned from the observed pages.
+
+Small pages cost round trips, large pages raise the latency of each call and the risk
+of timeouts. The PageSizeTuner keeps, per endpoint and dataset, the throughput (items
+per second) observed for each page size and moves the size towards the best one:
+* sizes are `minimum` x 2^k up to `maximum`: the offset of the next item is a multiple
+of a smaller size, the size only doubles on a page boundary of the doubled size
+* a size is halved when the halved size was faster, else doubled while the doubled
+size is not observed yet or is faster
+* pages slower than `max_latency` seconds or larger than `max_bytes` halve the size
+* partial (last) pages and responses not fetched by the call (memo, cache, flagged
+`from_cache` by the client) are not observed
+
+The chosen sizes and throughputs are recorded in the JSON file `DICTANOVA_PAGE_SIZES`,
+if set, so that the next run starts from them. Pages
+of a limited pagination (eg. the top 100 opinions) are not larger than needed, so
+that they are answered by a memoized larger page when possible (see client.py).
+"""
+
+import json, os, re, socket, threading
+from urllib.parse import urlsplit
+
+# Smoothing of the throughput of a size across pages and runs
+ALPHA = 0.3
+
+def endpoint_of(url):
+	"""(endpoint, dataset) of a search URL, the endpoint without the dataset id nor parameters."""
+	path = urlsplit(url).path
+	m = re.search(r"/datasets/([^/]+)", path)
+	if m is None:
+		return path, "_"
+	return path[:m.start(1)] + "*" + path[m.end(1):], m.group(1)
+
+class PageSizeTuner(object):
+	"""Page sizes per endpoint and dataset, tuned to maximize the items per second."""
+
+	def __init__(self, path=None, minimum=25, maximum=1000, initial=50, max_latency=10., max_bytes=8*1024*1024):
+		"""
+		path: JSON file of the recorded sizes, None to not record them
+		minimum, maximum: bounds of the page sizes
+		initial: size of the endpoints without recorded size, rounded to the ladder of sizes
+		max_latency: seconds of a page above which the size is halved
+		max_bytes: size in bytes of a page above which the size is halved
+		"""
+		self.path = path
+		self.sizes = [minimum]
+		while self.sizes[-1] * 2 <= maximum:
+			self.sizes.append(self.sizes[-1] * 2)
+		self.initial = max([s for s in self.sizes if s <= initial] or [minimum])
+		self.max_latency = max_latency
+		self.max_bytes = max_bytes
+		self._lock = threading.Lock()
+		self._state = {} # "endpoint dataset" -> {"size": size, "rates": {size: items per second}}
+		if path is not None:
+			try:
+				with open(path, "r", encoding="utf-8") as fin:
+					self._state = json.load(fin)
+			except (IOError, ValueError):
+				pass
+
+	def _entry(self, url):
+		key = "%s %s" % endpoint_of(url)
+		entry = self._state.setdefault(key, {"size": self.initial, "rates": {}})
+		if entry["size"] not in self.sizes:
+			# Bounds changed since the size was recorded
+			entry["size"] = self.initial
+		return entry
+
+	def size(self, url, offset=0, remaining=None):
+		"""
+		Page size of the next page of a request.
+
+		offset: number of items already fetched, a multiple of the returned size
+		remaining: number of items still needed, None if all of them
+		"""
+		with self._lock:
+			size = self._entry(url)["size"]
+		while size > self.sizes[0] and (offset % size or (remaining is not None and size // 2 >= remaining)):
+			size //= 2
+		return size
+
+	def observe(self, url, size, items, seconds, nbytes):
+		"""Record a page of `items` items of `nbytes` bytes fetched in `seconds` seconds."""
+		if seconds <= 0 or items < size:
+			return
+		with self._lock:
+			entry = self._entry(url)
+			rates = entry["rates"]
+			rate = items / seconds
+			previous = rates.get(str(size))
+			rates[str(size)] = rate if previous is None else (1 - ALPHA) * previous + ALPHA * rate
+			i = self.sizes.index(size)
+			if seconds > self.max_latency or nbytes > self.max_bytes:
+				i = max(i - 1, 0)
+			elif i > 0 and rates.get(str(self.sizes[i-1]), 0.) > rates[str(size)]:
+				i -= 1
+			elif i + 1 < len(self.sizes) and rates.get(str(self.sizes[i+1]), float("inf")) > rates[str(size)]:
+				i += 1
+			entry["size"] = self.sizes[i]
+
+	def save(self):
+		"""Record the sizes in the JSON file, if any."""
+		if self.path is None:
+			return
+		with self._lock:
+			state = json.dumps(self._state, ensure_ascii=False, sort_keys=True, indent=1)
+		os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+		tmp = "%s.%s-%d-%d.tmp" % (self.path, socket.gethostname(), os.getpid(), threading.get_ident())
+		with open(tmp, "w", encoding="utf-8") as fout:
+			fout.write(state)
+		os.replace(tmp, self.path)
+
+def paginate(api, url, json=None, data=None, params=None, auth=None, limit=None, tuner=None):
+	"""
+	Items of a paginated search request, fetched with pages of a tuned size.
+
+	api: DictanovaClient of the pages, each being memoized and cached
+	limit: maximal number of items, all of them if None
+	tuner: PageSizeTuner of the sizes, the one of the process if None
+	Raises requests.HTTPError if a page failed.
+	"""
+	tuner = tuner or page_size_tuner()
+	items = []
+	while limit is None or len(items) < limit:
+		size = tuner.size(url, len(items), None if limit is None else limit - len(items))
+		page = dict(params or {}, page=len(items) // size + 1, pageSize=size)
+		r = api.post(url, json=json, data=data, params=page, auth=auth)
+		r.raise_for_status()
+		payload = r.json()
+		batch = payload.get("items", [])
+		# The elapsed time of a memoized or cached response is not the one of this call
+		if not getattr(r, "from_cache", False):
+			tuner.observe(url, size, len(batch), r.elapsed.total_seconds(), len(r.content))
+		items += batch
+		if len(batch) < size or ("total" in payload and len(items) >= payload["total"]):
+			break
+	tuner.save()
+	return items if limit is None else items[:limit]
+
+_tuner = None
+_tuner_lock = threading.Lock()
+
+def page_size_tuner():
+	"""PageSizeTuner of the current process, recording the sizes in the configured file."""
+	global _tuner
+	from .config import page_sizes_path
+	with _tuner_lock:
+		if _tuner is None:
+			_tuner = PageSizeTuner(page_sizes_path())
+		return _tuner
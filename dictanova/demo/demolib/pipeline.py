@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+"""
+DAG runner of the use cases and of the data they depend on.
+
+Each node of a Pipeline has a name, a function and the names of the nodes it depends
+on. Fetch nodes are API requests identified by their canonical key: a fetch declared
+twice, under the same or another name, is computed once, and a fetch of a page that
+is contained in another declared page waits for it and is answered from the client
+memo. Nodes run in a thread pool as soon as their dependencies are done, so that
+independent branches run concurrently; `exclusive` nodes (eg. scripts changing the
+current directory or using pyplot) never run at the same time.
+"""
+
+import collections, threading, time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from .client import client as default_client, page_of, request_key
+
+Node = collections.namedtuple("Node", ["name", "func", "deps", "exclusive"])
+
+class PipelineError(Exception):
+	"""Raised when nodes failed, `errors` maps their names to the exceptions."""
+
+	def __init__(self, errors, results):
+		super(PipelineError, self).__init__("; ".join("%s: %r" % item for item in sorted(errors.items())))
+		self.errors = errors
+		self.results = results
+
+class Pipeline(object):
+	"""DAG of fetches and tasks."""
+
+	def __init__(self, client=None):
+		"""
+		client: DictanovaClient of the fetches, the one of the process if None
+		"""
+		self.client = client or default_client()
+		self.nodes = collections.OrderedDict()
+		self.aliases = {}
+		self._fetches = {} # request key -> node name
+		self._pages = [] # (page key, (first, end), node name)
+
+	def resolve(self, name):
+		"""Name of the node computing `name`, which may be an alias of a duplicated fetch."""
+		while name in self.aliases:
+			name = self.aliases[name]
+		return name
+
+	def task(self, name, func, deps=(), exclusive=False):
+		"""
+		Add a task.
+
+		func: function called with a dict dependency name -> result
+		deps: names of the nodes this task depends on
+		exclusive: if True, the task never runs at the same time as another exclusive task
+		"""
+		if name in self.nodes or name in self.aliases:
+			raise ValueError("Node '%s' already declared" % name)
+		self.nodes[name] = Node(name, func, tuple(deps), exclusive)
+		return name
+
+	def fetch(self, name, url, json=None, data=None, params=None, auth=None, method="POST", shard=None):
+		"""
+		Add an API request, deduplicated with the identical ones already declared.
+
+		shard: MONTH or WEEK to fetch an aggregation as sub-queries, see sharding.py
+		Returns the name of the node computing it.
+		"""
+		key = request_key(method, self.client.url(url), params, json, data)
+		if key in self._fetches:
+			if name != self._fetches[key]:
+				self.aliases[name] = self._fetches[key]
+			return self._fetches[key]
+		deps = []
+		page = page_of(method, self.client.url(url), params, json, data)
+		if page is not None:
+			for group, (first, last), other in self._pages:
+				if group == page[0] and first <= page[1][0] and page[1][1] <= last:
+					# Answered from the memoized page of the other node
+					deps.append(other)
+					break
+			else:
+				self._pages.append(page + (name,))
+		api = self.client
+		def func(inputs):
+			return api.request(method, url, params, json, data, auth, shard)
+		self._fetches[key] = name
+		return self.task(name, func, deps)
+
+	def _required(self, targets):
+		todo = [self.resolve(t) for t in (self.nodes if targets is None else targets)]
+		required = set()
+		while todo:
+			name = self.resolve(todo.pop())
+			if name not in self.nodes:
+				raise KeyError("Unknown node '%s'" % name)
+			if name not in required:
+				required.add(name)
+				todo.extend(self.nodes[name].deps)
+		return required
+
+	def run(self, targets=None, max_workers=4, progress=None):
+		"""
+		Run the nodes needed by `targets` (all the nodes if None).
+
+		max_workers: number of nodes running concurrently
+		progress: function called with (name, status, elapsed seconds) when a node ends,
+		status being "done", "failed" or "skipped"
+		Returns a dict node name (and alias) -> result. Raises a PipelineError if nodes
+		failed, the dependents of a failed node are skipped.
+		"""
+		required = self._required(targets)
+		results, errors = {}, {}
+		waiting = {name: set(self.resolve(d) for d in self.nodes[name].deps) for name in required}
+		exclusive = threading.Lock()
+		started = {}
+
+		def execute(node, inputs):
+			if node.exclusive:
+				with exclusive:
+					return node.func(inputs)
+			return node.func(inputs)
+
+		def report(name, status):
+			if progress is not None:
+				progress(name, status, time.time() - started.get(name, time.time()))
+
+		with ThreadPoolExecutor(max_workers=max_workers) as pool:
+			running = {}
+			while waiting or running:
+				# Skip the nodes depending on a failure, submit the ready ones
+				for name in [n for n, deps in waiting.items() if deps & set(errors)]:
+					del waiting[name]
+					errors[name] = RuntimeError("skipped, a dependency failed")
+					report(name, "skipped")
+				for name in [n for n, deps in waiting.items() if deps <= set(results)]:
+					node = self.nodes[name]
+					del waiting[name]
+					started[name] = time.time()
+					inputs = dict((d, results[self.resolve(d)]) for d in node.deps)
+					running[pool.submit(execute, node, inputs)] = name
+				if not running:
+					break
+				done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+				for future in done:
+					name = running.pop(future)
+					try:
+						results[name] = future.result()
+						report(name, "done")
+					except Exception as e:
+						errors[name] = e
+						report(name, "failed")
+		for alias in self.aliases:
+			if self.resolve(alias) in results:
+				results[alias] = results[self.resolve(alias)]
+		if errors:
+			raise PipelineError(errors, results)
+		return results
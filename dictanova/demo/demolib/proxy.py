@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+"""
+Local read-through caching proxy of the API shared by the processes of a host.
+
+Scripts and workers point their base URL at the proxy (`DICTANOVA_API_URL`, eg.
+`http://127.0.0.1:8081/v1`) and the proxy forwards their requests to the API with a
+long-lived DictanovaClient:
+* responses are memoized in memory (bounded) and kept in a persistent ResponseCache,
+revalidated once expired (see responsecache.py)
+* concurrent identical requests of all the processes are sent once (single flight)
+* upstream connections are kept alive in a pool shared by the requests
+* each client is throttled by a token bucket, for all its requests
+
+Requests without bearer token are rejected (`401`) and requests failing upstream are
+answered with `502 Bad Gateway`. Token requests are forwarded as they are and never
+cached; the proxy remembers the credentials a token was issued for (the latest tokens
+only, see `max_tokens`).
+Responses are memoized and cached per credentials (a hash of the client id and secret,
+or of the token if the proxy did not see it issued): a client only reads the responses
+fetched with its own credentials, shared by all the processes using them. Conditional
+requests of the clients are answered with `304 Not Modified` when the
+response has not changed (see standin.py). Short-lived processes thus share one warm
+client.
+"""
+
+import collections, gzip, hashlib, json, threading, time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .client import DictanovaClient
+from .config import API_URL
+from .standin import etag, not_modified
+
+class RateLimiter(object):
+	"""Token bucket per client: `rate` requests per second, bursts of `burst` requests."""
+
+	def __init__(self, rate=None, burst=None):
+		"""
+		rate: requests per second of a client, None for no limit
+		burst: requests of a client at once, max(1, rate) if None
+		"""
+		self.rate = rate
+		self.burst = burst or max(1., rate or 0.)
+		self._buckets = {} # client -> (tokens, timestamp)
+		self._lock = threading.Lock()
+
+	def delay(self, client, now=None):
+		"""Take a token of a client, returns the seconds to wait before using it."""
+		if self.rate is None:
+			return 0.
+		now = time.monotonic() if now is None else now
+		with self._lock:
+			tokens, last = self._buckets.get(client, (self.burst, now))
+			tokens = min(self.burst, tokens + (now - last) * self.rate) - 1
+			self._buckets[client] = (tokens, now)
+		return max(0., -tokens / self.rate)
+
+	def acquire(self, client):
+		"""Wait for a token of a client."""
+		delay = self.delay(client)
+		if delay > 0:
+			time.sleep(delay)
+
+class _Bearer(requests.auth.AuthBase):
+	# Authorization header of the client, forwarded to the API
+
+	def __init__(self, authorization):
+		self.authorization = authorization
+
+	def __call__(self, r):
+		r.headers["Authorization"] = self.authorization
+		return r
+
+def _digest(*values):
+	return hashlib.blake2b(";".join(values).encode("utf-8"), digest_size=16).hexdigest()
+
+class _Handler(BaseHTTPRequestHandler):
+
+	protocol_version = "HTTP/1.1"
+
+	def do_GET(self):
+		self._answer("GET")
+
+	def do_POST(self):
+		self._answer("POST")
+
+	def _body(self):
+		body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+		if self.headers.get("Content-Encoding") == "gzip":
+			body = gzip.decompress(body)
+		return body
+
+	def _reply(self, status, content=b"", headers=None, source="miss"):
+		# Counted before the response is sent, the client may read the counts once answered
+		with self.server.lock:
+			self.server.answers[source] += 1
+		self.send_response(status)
+		for name, value in (headers or {}).items():
+			self.send_header(name, value)
+		self.send_header("X-Cache", source.upper())
+		self.send_header("Content-Length", str(len(content)))
+		self.end_headers()
+		if content:
+			self.wfile.write(content)
+
+	def _bad_gateway(self, e):
+		error = json.dumps({"error": "API request failed: %s" % e}).encode("utf-8")
+		self._reply(502, error, {"Content-Type": "application/json"}, "error")
+
+	def _answer(self, method):
+		server, body = self.server, self._body()
+		upstream = urlsplit(server.upstream)
+		url = "%s://%s%s" % (upstream.scheme, upstream.netloc, self.path)
+		authorization = self.headers.get("Authorization")
+		if urlsplit(self.path).path.endswith("/token"):
+			try:
+				r = server.api.session.request(method, url, data=body,
+					headers={"Content-Type": self.headers.get("Content-Type", "application/json")})
+			except Exception as e:
+				return self._bad_gateway(e)
+			if r.ok:
+				server.issued(body, r)
+			return self._reply(r.status_code, r.content, {"Content-Type": r.headers.get("Content-Type", "application/json")}, "pass")
+		if not authorization:
+			error = json.dumps({"error": "Bearer token required"}).encode("utf-8")
+			return self._reply(401, error, {"Content-Type": "application/json"}, "denied")
+		scope = server.scope(authorization)
+		server.limiter.acquire(scope)
+		try:
+			json_body, data = (json.loads(body.decode("utf-8")) if body else None), None
+		except ValueError:
+			json_body, data = None, body
+		response = server.api.memoized(method, url, json=json_body, data=data, scope=scope)
+		source = "hit"
+		if response is None:
+			try:
+				response = server.api.request(method, url, json=json_body, data=data,
+					auth=_Bearer(authorization), scope=scope)
+			except Exception as e:
+				# Unreachable API, or any error of the client (cache, decoding...)
+				return self._bad_gateway(e)
+			source = "miss"
+		headers = {"Content-Type": response.headers.get("Content-Type", "application/json")}
+		if response.ok:
+			headers["ETag"] = etag(response)
+			if "Last-Modified" in response.headers:
+				headers["Last-Modified"] = response.headers["Last-Modified"]
+			if not_modified(self.headers, headers["ETag"], headers.get("Last-Modified")):
+				return self._reply(304, headers=headers, source=source)
+		self._reply(response.status_code, response.content, headers, source)
+
+	def log_message(self, format, *args):
+		if self.server.verbose:
+			BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class CachingProxy(ThreadingMixIn, HTTPServer):
+	"""HTTP proxy of the API answering from a shared DictanovaClient."""
+
+	daemon_threads = True
+	request_queue_size = 128
+
+	def __init__(self, cache=None, address=("127.0.0.1", 8081), upstream=API_URL, rate=None, burst=None,
+			connections=16, max_memo=10000, max_tokens=10000, verbose=False):
+		"""
+		cache: ResponseCache of the responses, None to keep them in memory only
+		address: (host, port) of the proxy, port 0 for any free port
+		upstream: base URL of the API
+		rate, burst: requests per second and burst of each client, None for no limit
+		connections: size of the pool of connections to the API
+		max_memo: number of responses kept in memory
+		max_tokens: number of issued tokens remembered, the oldest are forgotten (their
+		responses are then scoped by token)
+		verbose: log the requests on stderr
+		"""
+		HTTPServer.__init__(self, address, _Handler)
+		self.upstream = upstream
+		# Clients chunk and shard their queries themselves, they are forwarded as they are
+		self.api = DictanovaClient(base_url=upstream, cache=cache, chunk_size=0, max_memo=max_memo)
+		adapter = HTTPAdapter(pool_connections=connections, pool_maxsize=connections)
+		self.api.session.mount("http://", adapter)
+		self.api.session.mount("https://", adapter)
+		self.limiter = RateLimiter(rate, burst)
+		self.verbose = verbose
+		self.lock = threading.Lock()
+		self.answers = collections.Counter() # hit, miss, pass, denied or error -> number of responses
+		self.max_tokens = max_tokens
+		self._tokens = {} # access token -> (hash of the credentials, expiry timestamp or None), oldest first
+
+	def issued(self, body, response):
+		"""Remember the credentials of a token request for the token issued."""
+		try:
+			credentials = json.loads(body.decode("utf-8"))
+			token = response.json()
+			scope = _digest(str(credentials["clientId"]), str(credentials["clientSecret"]))
+			expires = time.time() + float(token["expires_in"]) if "expires_in" in token else None
+			with self.lock:
+				self._tokens[token["access_token"]] = (scope, expires)
+				self._prune()
+		except (ValueError, KeyError, TypeError, AttributeError):
+			pass
+
+	def _prune(self):
+		# Forget the expired tokens, then the oldest ones above max_tokens
+		now = time.time()
+		for token in [t for t, (_, expires) in self._tokens.items() if expires is not None and expires < now]:
+			del self._tokens[token]
+		while len(self._tokens) > self.max_tokens:
+			del self._tokens[next(iter(self._tokens))]
+
+	def scope(self, authorization):
+		"""Partition of the responses of a client, see client.request_key."""
+		token = authorization.split(" ", 1)[-1]
+		with self.lock:
+			scope, expires = self._tokens.get(token, (None, None))
+			if scope is not None and expires is not None and expires < time.time():
+				del self._tokens[token]
+				scope = None
+		return scope or _digest("token", token)
+
+	def url(self):
+		"""Base URL of the proxy, to use as `DICTANOVA_API_URL`."""
+		host, port = self.server_address[:2]
+		return "http://%s:%d%s" % (host, port, urlsplit(self.upstream).path)
+
+	def start(self):
+		"""Serve in a daemon thread, returns the thread."""
+		thread = threading.Thread(target=self.serve_forever, name="proxy", daemon=True)
+		thread.start()
+		return thread
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+"""
+Immutable builder of the queries of the API with a canonical serialization.
+
+Criteria, compounds (AND / OR), periods, dimensions and aggregations are immutable
+values: refining a query returns a new one, so that a query used as a key is never
+changed in place. Equivalent queries have the same canonical form:
+* nested AND (or OR) are flattened, their criteria deduplicated and sorted
+* IN values are deduplicated and sorted, an IN of one value is an EQ
+* period bounds are ISO dates with seconds (`2016-01-01T00:00:00Z`), a date ending a
+period is included
+* the JSON is serialized with sorted keys and without spaces
+
+`canonical()` is the UTF-8 byte form and `digest()` its stable hash. Hand-built dicts
+are read with `parse()`; the client keys its memo and cache on the canonical form of
+the JSON bodies (see client.request_key), so equivalent queries of different scripts
+share their responses.
+"""
+
+import hashlib, json
+
+def _dumps(obj):
+	return json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+def _date(value, time="00:00:00"):
+	# `2016-01-01` (at `time`) or `2016-01-01T00:00:00Z`
+	return "%sT%sZ" % (value, time) if len(value) == 10 else value
+
+class _Value(object):
+	"""Immutable value identified by its canonical form."""
+
+	__slots__ = ()
+
+	def to_json(self):
+		raise NotImplementedError()
+
+	def canonical(self):
+		"""Canonical UTF-8 bytes of the query."""
+		return _dumps(self.to_json()).encode("utf-8")
+
+	def digest(self):
+		"""Stable hash of the canonical form."""
+		return hashlib.blake2b(self.canonical(), digest_size=16).hexdigest()
+
+	def dumps(self, indent=None):
+		"""JSON of the query, eg. to print it."""
+		return json.dumps(self.to_json(), indent=indent, sort_keys=True, ensure_ascii=False)
+
+	def __eq__(self, other):
+		return isinstance(other, _Value) and self.canonical() == other.canonical()
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __hash__(self):
+		return hash(self.canonical())
+
+	def __setattr__(self, name, value):
+		raise AttributeError("%s is immutable" % type(self).__name__)
+
+	def __repr__(self):
+		return "%s(%s)" % (type(self).__name__, self.canonical().decode("utf-8"))
+
+def _set(obj, **attributes):
+	for name, value in attributes.items():
+		object.__setattr__(obj, name, value)
+
+class _Filter(_Value):
+	"""Criterion or compound of a filter, combined with `&` and `|`."""
+
+	__slots__ = ()
+
+	def __and__(self, other):
+		return Compound("AND", [self, other])
+
+	def __or__(self, other):
+		return Compound("OR", [self, other])
+
+class Criterion(_Filter):
+	"""Criterion on a field: `field operator value`, `opinion` being the polarity of a TERMS criterion."""
+
+	__slots__ = ("field", "operator", "value", "opinion", "extra")
+
+	def __init__(self, field, operator, value, opinion=None, extra=None):
+		if operator == "IN":
+			value = tuple(sorted(set(value), key=_dumps))
+			if len(value) == 1:
+				operator, value = "EQ", value[0]
+		_set(self, field=field, operator=operator, value=value, opinion=opinion, extra=dict(extra or {}))
+
+	def to_json(self):
+		value = list(self.value) if isinstance(self.value, tuple) else self.value
+		obj = dict(self.extra, field=self.field, operator=self.operator, value=value)
+		if self.opinion is not None:
+			obj["opinion"] = self.opinion
+		return obj
+
+class Compound(_Filter):
+	"""AND or OR of criteria."""
+
+	__slots__ = ("operator", "criteria")
+
+	def __new__(cls, operator, criteria):
+		flat = []
+		for c in criteria:
+			flat += list(c.criteria) if isinstance(c, Compound) and c.operator == operator else [c]
+		unique = sorted(set(flat), key=lambda c: c.canonical())
+		if len(unique) == 1:
+			return unique[0]
+		obj = super(Compound, cls).__new__(cls)
+		_set(obj, operator=operator, criteria=tuple(unique))
+		return obj
+
+	def __init__(self, operator, criteria):
+		pass
+
+	def to_json(self):
+		return {"operator": self.operator, "criteria": [c.to_json() for c in self.criteria]}
+
+class Period(_Value):
+	"""Period of an aggregation on a date field."""
+
+	__slots__ = ("field", "start", "end")
+
+	def __init__(self, field, start, end):
+		_set(self, field=field, start=_date(start), end=_date(end, "23:59:59"))
+
+	def to_json(self):
+		return {"field": self.field, "from": self.start, "to": self.end}
+
+class Dimension(_Value):
+	"""Dimension of an aggregation: a field grouped by DISTINCT, WEEK, MONTH..."""
+
+	__slots__ = ("field", "group", "limit")
+
+	def __init__(self, field, group="DISTINCT", limit=None):
+		_set(self, field=field, group=group, limit=limit)
+
+	def to_json(self):
+		obj = {"field": self.field, "group": self.group}
+		if self.limit is not None:
+			obj["limit"] = self.limit
+		return obj
+
+class Aggregation(_Value):
+	"""Aggregation query (COUNT, CSAT, NPS...), refined with where(), over() and by()."""
+
+	__slots__ = ("type", "field", "query", "periods", "dimensions", "extra")
+
+	def __init__(self, type, field, query=None, periods=(), dimensions=(), extra=None):
+		_set(self, type=type, field=field, query=query, periods=tuple(periods),
+			dimensions=tuple(dimensions), extra=dict(extra or {}))
+
+	def _replace(self, **changes):
+		values = dict((name, getattr(self, name)) for name in self.__slots__)
+		values.update(changes)
+		return Aggregation(**values)
+
+	def where(self, criterion):
+		"""Same aggregation with `criterion` added (AND) to its filter."""
+		return self._replace(query=criterion if self.query is None else self.query & criterion)
+
+	def over(self, *periods):
+		"""Same aggregation with its periods replaced."""
+		return self._replace(periods=periods)
+
+	def by(self, *dimensions):
+		"""Same aggregation with dimensions appended."""
+		return self._replace(dimensions=self.dimensions + dimensions)
+
+	def to_json(self):
+		obj = dict(self.extra, type=self.type, field=self.field)
+		if self.query is not None:
+			obj["query"] = self.query.to_json()
+		if self.periods:
+			obj["periods"] = [p.to_json() for p in self.periods]
+		if self.dimensions:
+			obj["dimensions"] = [d.to_json() for d in self.dimensions]
+		return obj
+
+def eq(field, value):
+	return Criterion(field, "EQ", value)
+
+def isin(field, values):
+	return Criterion(field, "IN", values)
+
+def between(field, start, end):
+	"""Criteria of the dates of a field between `start` and `end` included."""
+	return Criterion(field, "GTE", _date(start)) & Criterion(field, "LTE", _date(end, "23:59:59"))
+
+def term(id, opinion=None):
+	"""Documents with an opinion (term id), of a polarity if `opinion` is given."""
+	return Criterion("TERMS", "EQ", id, opinion)
+
+def terms(ids, opinion=None):
+	"""Documents with one of the opinions."""
+	return Criterion("TERMS", "IN", ids, opinion)
+
+def and_(*criteria):
+	return Compound("AND", criteria)
+
+def or_(*criteria):
+	return Compound("OR", criteria)
+
+def distribution_query(rating, dimensions=(), query=None, periods=None, metric="COUNT"):
+	"""
+	Query of the distribution of a rating per group of dimensions (see metrics.py).
+
+	rating: field of the rating (eg. `field("rating_nps")`)
+	dimensions: dimensions of the groups, without the rating
+	query, periods: filter and periods of the aggregation, if any
+	metric: COUNT, or CSAT / NPS for the `total` of the periods to be that metric over
+	the whole period, the numbers of documents being then the `volume` of the values
+	"""
+	q = {
+		"type": metric,
+		"field": rating,
+		"dimensions": list(dimensions) + [{"field": rating, "group": "DISTINCT"}]
+	}
+	if query is not None:
+		q["query"] = query
+	if periods is not None:
+		q["periods"] = periods
+	return q
+
+_CRITERION_KEYS = ("field", "operator", "value", "opinion")
+_AGGREGATION_KEYS = ("type", "field", "query", "periods", "dimensions")
+
+def parse(obj):
+	"""
+	Query value of a hand-built query (aggregation, compound or criterion dict).
+
+	Raises ValueError if `obj` is not a query.
+	"""
+	if not isinstance(obj, dict):
+		raise ValueError("Not a query: %r" % (obj,))
+	if "type" in obj:
+		dimensions = obj.get("dimensions") or []
+		if any(set(d) - {"field", "group", "limit"} for d in dimensions):
+			raise ValueError("Unknown dimension keys in %r" % (dimensions,))
+		if any(set(p) != {"field", "from", "to"} for p in obj.get("periods") or []):
+			raise ValueError("Unknown period keys in %r" % (obj["periods"],))
+		return Aggregation(obj["type"], obj.get("field"),
+			parse(obj["query"]) if obj.get("query") is not None else None,
+			[Period(p["field"], p["from"], p["to"]) for p in obj.get("periods") or []],
+			[Dimension(d["field"], d.get("group", "DISTINCT"), d.get("limit")) for d in dimensions],
+			{k: v for k, v in obj.items() if k not in _AGGREGATION_KEYS})
+	if obj.get("operator") in ("AND", "OR") and "criteria" in obj:
+		if set(obj) != {"operator", "criteria"}:
+			raise ValueError("Unknown compound keys in %r" % (obj,))
+		return Compound(obj["operator"], [parse(c) for c in obj["criteria"]])
+	if "field" in obj and "operator" in obj:
+		if obj["operator"] == "IN" and not isinstance(obj.get("value"), list):
+			raise ValueError("IN value must be a list: %r" % (obj,))
+		return Criterion(obj["field"], obj["operator"], obj.get("value"), obj.get("opinion"),
+			{k: v for k, v in obj.items() if k not in _CRITERION_KEYS})
+	raise ValueError("Not a query: %r" % (obj,))
+
+def as_json(query):
+	"""JSON body of a query value, other bodies being returned as they are."""
+	return query.to_json() if isinstance(query, _Value) else query
+
+def canonical_json(body):
+	"""
+	Canonical JSON string of a request body: the canonical form of a query (value or
+	dict), or the JSON with sorted keys of other bodies.
+	"""
+	if isinstance(body, _Value):
+		return body.canonical().decode("utf-8")
+	try:
+		return parse(body).canonical().decode("utf-8")
+	except (ValueError, KeyError, TypeError):
+		return _dumps(body)
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+
+"""
+Parallel rendering of charts and word clouds.
+
+The scripts describe each chart as a ChartSpec (kind, data, output path, options) and
+render_charts() renders them in worker processes with the headless Agg backend, or in
+the current process with its backend, left unchanged (eg. for `--show`). A single chart
+is rendered in the current process: starting a worker costs more than rendering it.
+Workers are started with forkserver (spawn where not available), never forked from a
+process that may hold threads (connection pools, proxy) or a GUI backend; as with
+spawn, they import the main script again, whose work stays under `__main__`.
+Options only hold plain values (color names, titles, keyword arguments) so that specs
+can be sent to the worker processes.
+
+Each renderer closes the figures it creates, and workers are recycled after a number
+of charts or when their resident memory exceeds a limit, so that long batches keep a
+bounded memory (see https://github.com/matplotlib/matplotlib/issues/9856/).
+
+Charts are only rendered again when their data or options changed since the file was
+produced, see rendercache.
+"""
+
+import collections, math, os, traceback
+import multiprocessing
+from multiprocessing import connection
+
+ChartSpec = collections.namedtuple("ChartSpec", ["kind", "data", "path", "options"])
+ChartSpec.__new__.__defaults__ = ({},)
+
+class RenderError(Exception):
+	"""Raised when charts could not be rendered, `paths` holds None for the failed ones."""
+
+	def __init__(self, message, paths=None):
+		super(RenderError, self).__init__(message)
+		self.paths = paths
+
+def _colormap(names):
+	from matplotlib import colors
+	return colors.ListedColormap(names)
+
+def _wordcloud(freq, options):
+	# Instances and layouts are kept warm by the service of the process
+	from .wordclouds import service
+	return service().to_array(freq, options.get("color", "darkblue"), **options.get("wordcloud", {}))
+
+def render_wordcloud(data, path, options):
+	"""Word cloud of a dict of frequencies."""
+	import matplotlib.pyplot as plt
+	fig, ax = plt.subplots()
+	try:
+		ax.imshow(_wordcloud(data, options))
+		if "title" in options:
+			ax.set_title(options["title"])
+		ax.axis("off")
+		fig.savefig(path, bbox_inches="tight")
+	finally:
+		plt.close(fig)
+
+def render_wordcloud_grid(data, path, options):
+	"""Grid of word clouds, data being a list of (title, dict of frequencies)."""
+	import matplotlib.pyplot as plt
+	row = math.ceil(math.sqrt(len(data)))
+	col = math.floor(math.sqrt(len(data)))
+	fig, axis = plt.subplots(row, col, squeeze=False)
+	try:
+		fig.tight_layout()
+		from .wordclouds import service
+		images = service().batch((freq, options) for title, freq in data)
+		for i, ((title, freq), image) in enumerate(zip(data, images)):
+			ax = axis[i//col][i%col]
+			ax.imshow(image)
+			ax.set_title(title)
+			ax.axis("off")
+		for i in range(len(data), row*col):
+			axis[i//col][i%col].axis("off")
+		fig.savefig(path, **options.get("savefig", {}))
+	finally:
+		plt.close(fig)
+
+def render_plot(data, path, options):
+	"""
+	Pandas plot of a Series or DataFrame.
+
+	options: `method` of DataFrame.plot (line, barh...), `plot` keyword arguments,
+	`colors` list of color names, `legend` labels and `savefig` keyword arguments
+	"""
+	import matplotlib.pyplot as plt
+	kwargs = dict(options.get("plot", {}))
+	if "colors" in options:
+		kwargs["colormap"] = _colormap(options["colors"])
+	if not kwargs.get("subplots"):
+		# pandas creates its own figure for subplots
+		kwargs["ax"] = plt.figure().gca()
+	ax = getattr(data.plot, options.get("method", "line"))(**kwargs)
+	fig = ax.flat[0].figure if hasattr(ax, "flat") else ax.figure
+	try:
+		if "legend" in options:
+			ax.legend(labels=options["legend"])
+		fig.savefig(path, **options.get("savefig", {"bbox_inches": "tight"}))
+	finally:
+		plt.close(fig)
+
+def render_polarized_barh(data, path, options):
+	"""Positive and negative bar charts side by side, data being (positive, negative) Series."""
+	import matplotlib.pyplot as plt
+	positive, negative = data
+	fig, axis = plt.subplots(1, 2)
+	try:
+		axis[1].yaxis.tick_right()
+		positive.plot.barh(ax=axis[1], title="Positive", colormap=_colormap(["seagreen"]))
+		(negative*-1).plot.barh( # negative just to make it nice, no meaning
+			ax=axis[0], title="Negative", colormap=_colormap(["orangered"]))
+		t = fig.suptitle(options.get("title", ""))
+		axis[0].set_ylabel("")
+		axis[1].set_ylabel("")
+		xartists = [t] + axis[0].yaxis.get_majorticklabels() + axis[1].yaxis.get_majorticklabels()
+		fig.savefig(
+			path,
+			bbox_extra_artists=xartists, # help computation of right margins
+			bbox_inches='tight'
+		)
+	finally:
+		plt.close(fig)
+
+# Renderer per kind of chart
+RENDERERS = {
+	"wordcloud": render_wordcloud,
+	"wordcloud_grid": render_wordcloud_grid,
+	"plot": render_plot,
+	"polarized_barh": render_polarized_barh
+}
+
+def _init_worker():
+	import matplotlib
+	matplotlib.use("Agg", force=True)
+
+def _render(spec):
+	import matplotlib.pyplot as plt
+	opened = set(plt.get_fignums())
+	try:
+		RENDERERS[spec.kind](spec.data, spec.path, spec.options)
+	finally:
+		# Figures left open by a failing renderer, not the ones of the caller
+		for num in set(plt.get_fignums()) - opened:
+			plt.close(num)
+	return spec.path
+
+def _rss_mb():
+	"""Resident memory of the current process in MB."""
+	try:
+		with open("/proc/self/statm", "r") as fin:
+			return int(fin.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+	except (IOError, OSError, ValueError):
+		# Peak resident memory where /proc is not available
+		import resource
+		return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+def _worker(conn, max_tasks, max_rss_mb):
+	_init_worker()
+	done = 0
+	while True:
+		task = conn.recv()
+		if task is None:
+			break
+		try:
+			path, error = _render(task), None
+		except Exception:
+			path, error = None, traceback.format_exc()
+		done += 1
+		# Recycle this worker, the pool starts a fresh one
+		recycle = bool((max_tasks and done >= max_tasks) or (max_rss_mb and _rss_mb() > max_rss_mb))
+		conn.send((path, error, recycle))
+		if recycle:
+			break
+	conn.close()
+
+# Not fork: the worker would inherit the locks of the threads of the caller
+_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+class RenderPool(object):
+	"""Pool of recycled renderer processes."""
+
+	def __init__(self, processes=None, max_tasks_per_child=50, max_rss_mb=1024, retries=1):
+		"""
+		processes: number of worker processes, the number of cores if None
+		max_tasks_per_child: charts rendered by a worker before it is replaced, None for no limit
+		max_rss_mb: resident memory (MB) above which a worker is replaced, None for no limit
+		retries: number of times a chart is retried when its worker died while rendering it
+		"""
+		self.processes = processes or os.cpu_count() or 1
+		self.max_tasks_per_child = max_tasks_per_child
+		self.max_rss_mb = max_rss_mb
+		self.retries = retries
+
+	def map(self, specs):
+		"""Render the specs, returns the paths of the produced files in the order of the specs."""
+		specs = list(specs)
+		ctx = multiprocessing.get_context(_START_METHOD)
+		pending = collections.deque(range(len(specs)))
+		remaining = len(specs)
+		paths = [None] * len(specs)
+		errors = {}
+		attempts = {}
+		# One pipe per worker: a worker that dies cannot block the others, and the pool
+		# knows which chart each worker is rendering
+		workers = [] # [process, connection, index of the chart being rendered or None]
+
+		def dispatch(worker):
+			worker[2] = pending.popleft() if pending else None
+			if worker[2] is not None:
+				worker[1].send(specs[worker[2]])
+
+		def spawn():
+			parent, child = ctx.Pipe()
+			p = ctx.Process(target=_worker, args=(child, self.max_tasks_per_child, self.max_rss_mb))
+			p.daemon = True
+			p.start()
+			child.close()
+			worker = [p, parent, None]
+			workers.append(worker)
+			dispatch(worker)
+
+		def retire(worker):
+			workers.remove(worker)
+			worker[1].close()
+			worker[0].join()
+
+		try:
+			for _ in range(min(self.processes, len(specs))):
+				spawn()
+			while remaining:
+				ready = connection.wait([w[1] for w in workers])
+				for worker in [w for w in workers if w[1] in ready]:
+					p, conn, idx = worker
+					try:
+						path, error, recycle = conn.recv()
+					except EOFError:
+						# The worker died while rendering this chart
+						retire(worker)
+						attempts[idx] = attempts.get(idx, 0) + 1
+						if attempts[idx] > self.retries:
+							remaining -= 1
+							errors[idx] = "worker %d died (exit code %s)" % (p.pid, p.exitcode)
+						else:
+							pending.appendleft(idx)
+					else:
+						remaining -= 1
+						paths[idx] = path
+						if error is not None:
+							errors[idx] = error
+						if not recycle:
+							dispatch(worker)
+							continue
+						retire(worker)
+					# Idle workers and replacements take the remaining charts
+					for w in workers:
+						if w[2] is None:
+							dispatch(w)
+					while pending and len(workers) < self.processes:
+						spawn()
+		finally:
+			for p, conn, _ in workers:
+				try:
+					conn.send(None)
+				except (OSError, ValueError):
+					pass
+			for p, conn, _ in workers:
+				p.join(timeout=5)
+				if p.is_alive():
+					p.terminate()
+				conn.close()
+		if errors:
+			raise RenderError("\n".join(
+				"%s: %s" % (specs[idx].path, error) for idx, error in sorted(errors.items())), paths)
+		return paths
+
+def _render_all(specs, processes, max_tasks_per_child, max_rss_mb):
+	if processes == 1 or len(specs) <= 1:
+		# Switching the backend would close the figures of the caller
+		return [_render(spec) for spec in specs]
+	pool = RenderPool(processes, max_tasks_per_child, max_rss_mb)
+	return pool.map(specs)
+
+def render_charts(specs, processes=None, max_tasks_per_child=50, max_rss_mb=1024, cache=True):
+	"""
+	Render charts in recycled worker processes.
+
+	specs: list of ChartSpec
+	processes: number of worker processes, the number of cores if None, 1 renders in
+	the current process without changing its backend (as a single chart to render is)
+	max_tasks_per_child: charts rendered by a worker before it is replaced
+	max_rss_mb: resident memory (MB) above which a worker is replaced
+	cache: if True, charts whose file was already rendered from the same data and
+	options are skipped (see rendercache)
+	Returns the paths of the produced files, in the order of the specs.
+	"""
+	specs = list(specs)
+	if not cache:
+		return _render_all(specs, processes, max_tasks_per_child, max_rss_mb)
+	from .rendercache import RenderManifest, spec_digest
+	manifests = {}
+	digests = []
+	stale = []
+	for spec in specs:
+		directory = os.path.dirname(os.path.abspath(spec.path))
+		if directory not in manifests:
+			manifests[directory] = RenderManifest(directory)
+		manifest = manifests[directory]
+		digest = spec_digest(spec)
+		digests.append(digest)
+		if manifest.is_fresh(spec, digest):
+			manifest.skip(spec)
+		else:
+			stale.append(len(digests)-1)
+	paths = [spec.path for spec in specs]
+	rendered = []
+	try:
+		rendered = _render_all([specs[i] for i in stale], processes, max_tasks_per_child, max_rss_mb)
+	except RenderError as e:
+		rendered = e.paths or []
+		raise
+	finally:
+		# Charts rendered before a failure are kept in the manifest
+		for i, path in zip(stale, rendered):
+			if path is not None:
+				manifests[os.path.dirname(os.path.abspath(path))].record(specs[i], digests[i])
+		for manifest in manifests.values():
+			manifest.save()
+	return paths
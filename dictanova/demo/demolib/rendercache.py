@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+"""
+Content-hash cache of rendered charts.
+
+The digest of a ChartSpec covers its kind, its data and its options (colors, titles,
+keyword arguments) but not its output path. A manifest `render-manifest.json` in each
+output directory records the digest of every file produced there; a chart whose file
+exists with the same digest is not rendered again. The manifest also lists the charts
+rebuilt and skipped by the last run.
+
+Several processes may render in the same directory (eg. the workers of a batch): a
+manifest is saved under an exclusive lock (flock of `render-manifest.json.lock`), its
+charts merged into the ones saved by the others meanwhile.
+"""
+
+import fcntl, hashlib, json, os, time
+import numpy as np
+
+MANIFEST = "render-manifest.json"
+
+# Bump to invalidate all the cached charts when the renderers change
+VERSION = 1
+
+def _feed(h, obj):
+	# Type-tagged, order-stable serialization of the data and options of a spec
+	if obj is None or isinstance(obj, (bool, int, float, str)):
+		h.update(("%s:%r;" % (type(obj).__name__, obj)).encode("utf-8"))
+	elif isinstance(obj, np.generic):
+		_feed(h, obj.item())
+	elif isinstance(obj, np.ndarray):
+		if obj.dtype == object:
+			_feed(h, obj.tolist())
+		else:
+			h.update(("ndarray:%s:%s;" % (obj.dtype.str, obj.shape)).encode("utf-8"))
+			h.update(np.ascontiguousarray(obj).tobytes())
+	elif isinstance(obj, dict):
+		h.update(b"dict{")
+		for key in sorted(obj, key=repr):
+			_feed(h, key)
+			_feed(h, obj[key])
+		h.update(b"}")
+	elif isinstance(obj, (list, tuple)):
+		h.update(("%s[" % type(obj).__name__).encode("utf-8"))
+		for item in obj:
+			_feed(h, item)
+		h.update(b"]")
+	elif type(obj).__module__.split(".")[0] == "pandas":
+		import pandas as pd
+		if isinstance(obj, pd.Series):
+			h.update(b"Series")
+			_feed(h, obj.name)
+		elif isinstance(obj, pd.DataFrame):
+			h.update(b"DataFrame")
+			_feed(h, [str(c) for c in obj.columns])
+		else:
+			raise TypeError("Cannot hash pandas object of type %s" % type(obj).__name__)
+		_feed(h, [str(i) for i in obj.index])
+		_feed(h, [str(d) for d in np.atleast_1d(obj.dtypes)])
+		_feed(h, pd.util.hash_pandas_object(obj, index=False).values)
+	else:
+		raise TypeError("Cannot hash chart data of type %s" % type(obj).__name__)
+
+def spec_digest(spec):
+	"""Hex digest of the kind, data and options of a ChartSpec."""
+	h = hashlib.blake2b(digest_size=16)
+	_feed(h, [VERSION, spec.kind])
+	_feed(h, spec.data)
+	_feed(h, spec.options)
+	return h.hexdigest()
+
+class RenderManifest(object):
+	"""Digests of the charts rendered in an output directory."""
+
+	def __init__(self, directory):
+		self.path = os.path.join(directory, MANIFEST)
+		self.charts = self._read() # file name -> {"digest", "kind", "rendered_at"}
+		self.rebuilt = []
+		self.skipped = []
+
+	def _read(self):
+		if not os.path.exists(self.path):
+			return {}
+		try:
+			with open(self.path, "r", encoding="utf-8") as fin:
+				return json.load(fin).get("charts", {})
+		except (IOError, ValueError):
+			# Corrupted manifest, everything is rendered again
+			return {}
+
+	def is_fresh(self, spec, digest):
+		"""True if the file of `spec` exists and was rendered from the same content."""
+		entry = self.charts.get(os.path.basename(spec.path))
+		return entry is not None and entry["digest"] == digest and os.path.exists(spec.path)
+
+	def record(self, spec, digest):
+		name = os.path.basename(spec.path)
+		self.charts[name] = {"digest": digest, "kind": spec.kind, "rendered_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+		self.rebuilt.append(name)
+
+	def skip(self, spec):
+		self.skipped.append(os.path.basename(spec.path))
+
+	def save(self):
+		"""Merge the charts rendered since loaded into the saved manifest."""
+		with open(self.path + ".lock", "a") as lock:
+			fcntl.flock(lock, fcntl.LOCK_EX)
+			# Charts recorded by other processes since this manifest was read are kept
+			charts = self._read()
+			charts.update((name, self.charts[name]) for name in self.rebuilt)
+			self.charts = charts
+			# Written to a temporary file first so that an interrupted run keeps the old manifest
+			tmp = "%s.%d.tmp" % (self.path, os.getpid())
+			with open(tmp, "w", encoding="utf-8") as fout:
+				json.dump({
+					"charts": self.charts,
+					"rebuilt": sorted(self.rebuilt),
+					"skipped": sorted(self.skipped)
+				}, fout, indent=2, sort_keys=True)
+			os.replace(tmp, self.path)
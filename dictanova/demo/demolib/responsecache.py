@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+"""
+Response cache of the API shared by processes and hosts.
+
+Responses are stored as one JSON file per request key (see client.request_key) in a
+directory, eg. on a shared filesystem: any process using the same directory reuses
+the fetches of the others. Files are written to a temporary name then renamed, so
+that readers never see a partial response and concurrent writers of the same request
+simply replace each other.
+
+Entries older than the time to live of the cache (`DICTANOVA_CACHE_TTL`, never if
+None) are expired: they are not answered anymore but their validators (`ETag`,
+`Last-Modified`) are sent with the next request (If-None-Match, If-Modified-Since).
+On `304 Not Modified`, the client refreshes the entry without downloading the body
+again.
+"""
+
+import hashlib, json, os, socket, threading, time
+
+import requests
+
+class ResponseCache(object):
+	"""Directory of cached responses, safe to share between threads and processes."""
+
+	def __init__(self, directory, ttl=None):
+		"""
+		directory: directory of the cache, created if needed
+		ttl: seconds after which an entry is revalidated, None to never expire entries
+		"""
+		self.directory = os.path.abspath(directory)
+		self.ttl = ttl
+		os.makedirs(self.directory, exist_ok=True)
+
+	def path(self, key):
+		"""File of the response of a request key, in a sub-directory per digest prefix."""
+		digest = hashlib.blake2b(key.encode("utf-8"), digest_size=20).hexdigest()
+		return os.path.join(self.directory, digest[:2], "%s.json" % digest)
+
+	def load(self, key):
+		"""(cached requests.Response, timestamp of storage) of a request key, or None."""
+		try:
+			with open(self.path(key), "r", encoding="utf-8") as fin:
+				entry = json.load(fin)
+		except (IOError, ValueError):
+			# Missing, or unreadable entries are fetched again
+			return None
+		if entry.get("key") != key:
+			return None
+		response = requests.Response()
+		response.status_code = entry["status_code"]
+		response.url = entry["url"]
+		response.headers.update(entry["headers"])
+		response._content = entry["content"].encode("utf-8")
+		response.encoding = "utf-8"
+		return response, entry.get("stored", 0.)
+
+	def fresh(self, stored, now=None):
+		"""True if an entry stored at `stored` has not expired."""
+		return self.ttl is None or stored + self.ttl > (time.time() if now is None else now)
+
+	def get(self, key):
+		"""Cached requests.Response of a request key if it has not expired, or None."""
+		entry = self.load(key)
+		if entry is None or not self.fresh(entry[1]):
+			return None
+		return entry[0]
+
+	def expired(self, key):
+		"""Expired requests.Response of a request key, to be revalidated, or None."""
+		entry = self.load(key)
+		if entry is None or self.fresh(entry[1]):
+			return None
+		return entry[0]
+
+	def put(self, key, response):
+		"""Cache the response of a request key."""
+		path = self.path(key)
+		entry = {
+			"key": key,
+			"url": response.url,
+			"status_code": response.status_code,
+			"headers": dict(response.headers),
+			"content": response.content.decode("utf-8"),
+			"stored": time.time()
+		}
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		tmp = "%s.%s-%d-%d.tmp" % (path, socket.gethostname(), os.getpid(), threading.get_ident())
+		with open(tmp, "w", encoding="utf-8") as fout:
+			json.dump(entry, fout, ensure_ascii=False)
+		os.replace(tmp, path)
+
+# Headers of a 304 response updating the ones of the cached response
+REVALIDATED_HEADERS = ("Cache-Control", "Date", "ETag", "Expires", "Last-Modified")
+
+def conditional_headers(response):
+	"""Headers of a conditional request revalidating a cached response, if it has validators."""
+	headers = {}
+	if response is None:
+		return headers
+	if "ETag" in response.headers:
+		headers["If-None-Match"] = response.headers["ETag"]
+	if "Last-Modified" in response.headers:
+		headers["If-Modified-Since"] = response.headers["Last-Modified"]
+	return headers
+
+def revalidated(response, not_modified):
+	"""Cached response refreshed by the headers of a `304 Not Modified` response."""
+	for name in REVALIDATED_HEADERS:
+		if name in not_modified.headers:
+			response.headers[name] = not_modified.headers[name]
+	return response
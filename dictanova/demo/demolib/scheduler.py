@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+"""
+Scheduler of (dataset x use case) jobs over a pool of processes.
+
+Each job runs a use case script on one dataset, with the metadata field mapping of that
+dataset and optionally over a period (see config), in its own output directory
+`<output>/<dataset>[/<period>]/<demo>/` where the output of the script is logged to
+`<use case>.log`. The number of jobs running at
+the same time is bounded globally (the processes of the pool) and per dataset, so that
+a single dataset does not receive all the load. When a job kills its worker process,
+the pool is replaced and the jobs it was running are retried.
+
+A jobs file is a JSON list of datasets:
+
+    [{"id": "5b55b264dbcd8100019f0495", "demo": "retail", "use_cases": ["uc1", "uc3"],
+      "fields": {"rating_satisfaction": "csat"}, "periods": ["2015-01-01/2015-12-31"]}]
+
+where `use_cases` (all of them by default), `fields` and `periods` (one job per period
+and use case) are optional. The same jobs can be queued for workers, see jobqueue.py.
+"""
+
+import collections, contextlib, json, os, time, traceback
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from .usecases import DEMOS, run_script, sort_key, use_cases
+
+Job = collections.namedtuple("Job", ["dataset", "demo", "use_case", "fields", "period"])
+# No period: the one of the use case
+Job.__new__.__defaults__ = (None,)
+
+JobResult = collections.namedtuple("JobResult", ["job", "elapsed", "error"])
+
+def load_jobs(path):
+	"""List of Job described by a jobs file."""
+	with open(path, "r", encoding="utf-8") as fin:
+		datasets = json.load(fin)
+	jobs = []
+	for d in datasets:
+		if d["demo"] not in DEMOS:
+			raise ValueError("Unknown demo '%s' for dataset %s" % (d["demo"], d["id"]))
+		available = use_cases(d["demo"])
+		for uc in d.get("use_cases") or sorted(available, key=sort_key):
+			if uc not in available:
+				raise ValueError("Unknown use case '%s' for dataset %s" % (uc, d["id"]))
+			for period in d.get("periods") or [None]:
+				jobs.append(Job(d["id"], d["demo"], uc, d.get("fields", {}), period))
+	return jobs
+
+def job_directory(output, job):
+	if job.period:
+		return os.path.join(output, job.dataset, job.period.replace("/", "_"), job.demo)
+	return os.path.join(output, job.dataset, job.demo)
+
+def run_job(job, output):
+	"""
+	Run a job in the current process, returns a JobResult.
+
+	The environment of the process is restored once the job ended: the next job of a
+	pooled worker does not see the dataset, period or variables of this one.
+	"""
+	start = time.time()
+	directory = job_directory(output, job)
+	os.makedirs(directory, exist_ok=True)
+	environ = dict(os.environ)
+	os.environ["DICTANOVA_DATASET"] = job.dataset
+	os.environ["DICTANOVA_FIELDS"] = json.dumps(job.fields)
+	if job.period:
+		os.environ["DICTANOVA_PERIOD"] = job.period
+	else:
+		os.environ.pop("DICTANOVA_PERIOD", None)
+	try:
+		with open(os.path.join(directory, "%s.log" % job.use_case), "w", encoding="utf-8") as log:
+			with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+				run_script(use_cases(job.demo)[job.use_case], directory)
+		error = None
+	except BaseException:
+		# SystemExit of a script included, the worker process keeps running
+		error = traceback.format_exc()
+	finally:
+		os.environ.clear()
+		os.environ.update(environ)
+	return JobResult(job, time.time() - start, error)
+
+def describe_job(job):
+	return " ".join([job.dataset] + ([job.period] if job.period else []) + [job.demo, job.use_case])
+
+def _report(result, done, total):
+	status = "failed" if result.error else "done"
+	count = "%d/%d" % (done, total) if total else "%d" % done
+	print("[%s] %s %s (%.1fs)" % (count, describe_job(result.job), status, result.elapsed))
+
+class Scheduler(object):
+	"""Run jobs in a pool of processes with global and per dataset limits."""
+
+	def __init__(self, output=".", processes=None, per_dataset=2, progress=_report, retries=1):
+		"""
+		output: root directory of the outputs, one sub-directory per dataset
+		processes: maximal number of jobs running at the same time, the number of cores if None
+		per_dataset: maximal number of jobs of the same dataset running at the same time
+		progress: function called with (JobResult, number of jobs done, number of jobs)
+		retries: number of times a job is run again when a worker process died while it
+		was running (the job that killed it is not known, all the jobs running are retried)
+		"""
+		self.output = os.path.abspath(output)
+		self.processes = processes or os.cpu_count() or 1
+		self.per_dataset = per_dataset
+		self.progress = progress
+		self.retries = retries
+
+	def run(self, jobs):
+		"""Run the jobs, returns the list of JobResult in the order of completion."""
+		jobs = list(jobs)
+		pending = collections.deque((job, 0) for job in jobs) # (job, number of retries)
+		active = collections.Counter() # dataset -> running jobs
+		results = []
+		pool = ProcessPoolExecutor(max_workers=self.processes)
+		try:
+			running = {}
+			while pending or running:
+				# Submit the first jobs whose dataset is below its limit
+				skipped = collections.deque()
+				while pending and len(running) < self.processes:
+					job, retries = pending.popleft()
+					if self.per_dataset and active[job.dataset] >= self.per_dataset:
+						skipped.append((job, retries))
+						continue
+					active[job.dataset] += 1
+					running[pool.submit(run_job, job, self.output)] = (job, retries)
+				pending.extendleft(reversed(skipped))
+				done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+				broken = False
+				for future in done:
+					job, retries = running.pop(future)
+					active[job.dataset] -= 1
+					try:
+						result = future.result()
+					except BrokenProcessPool:
+						# A worker process died, the pool fails all its jobs
+						broken = True
+						if retries < self.retries:
+							pending.appendleft((job, retries + 1))
+							continue
+						result = JobResult(job, 0., traceback.format_exc())
+					except Exception:
+						result = JobResult(job, 0., traceback.format_exc())
+					results.append(result)
+					if self.progress is not None:
+						self.progress(result, len(results), len(jobs))
+				if broken:
+					# The pool accepts no more jobs, its running jobs are failed by now
+					pool.shutdown(wait=True)
+					pool = ProcessPoolExecutor(max_workers=self.processes)
+		finally:
+			pool.shutdown(wait=True)
+		return results
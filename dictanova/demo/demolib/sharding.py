@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+"""
+Period sharding of the aggregation queries.
+
+An aggregation over a long period (eg. a year grouped by MONTH x TERMS) is split into
+one query per month or week of its period, the sub-queries are fetched concurrently
+and their `values` merged back into the response of the whole period:
+* COUNT values and totals are summed, a document belonging to a single sub-period
+* CSAT and NPS are re-derived from the distribution of the rating: the sub-queries are
+COUNT queries with an additional DISTINCT dimension on the rating field, and the total
+is computed from one more distribution query per sub-period
+
+A dimension with a `limit` keeps the top values of each group of the preceding
+dimensions, which is only the same per sub-period when a preceding dimension groups the
+period field by buckets never crossing a shard boundary (MONTH for month shards, WEEK
+for week shards). Other limited queries are not sharded (ShardingError). Limits rank
+by volume in the sub-queries of CSAT and NPS.
+"""
+
+import calendar, collections, copy, datetime, json
+from concurrent.futures import ThreadPoolExecutor
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# Shard unit -> time groups whose buckets are within a shard
+NESTED_GROUPS = {
+	"MONTH": ("DAY", "MONTH"),
+	"WEEK": ("DAY", "WEEK")
+}
+
+class ShardingError(ValueError):
+	"""Raised when a query cannot be sharded exactly."""
+
+def shard_ranges(start, end, unit="MONTH"):
+	"""
+	Split a period into sub-periods.
+
+	start, end: ISO dates of the period, as in the queries (`2015-01-01T00:00:00Z`)
+	unit: MONTH or WEEK (from monday)
+	Returns the list of (from, to) of the sub-periods, the first and last ones clipped.
+	"""
+	if unit not in NESTED_GROUPS:
+		raise ShardingError("Unknown shard unit '%s'" % unit)
+	first = datetime.datetime.strptime(start, DATE_FORMAT)
+	last = datetime.datetime.strptime(end, DATE_FORMAT)
+	ranges = []
+	current = first
+	while current <= last:
+		if unit == "MONTH":
+			days = calendar.monthrange(current.year, current.month)[1] - current.day + 1
+		else:
+			days = 7 - current.weekday()
+		following = datetime.datetime.combine(current.date() + datetime.timedelta(days=days), datetime.time())
+		stop = min(last, following - datetime.timedelta(seconds=1))
+		ranges.append((current.strftime(DATE_FORMAT), stop.strftime(DATE_FORMAT)))
+		current = following
+	return ranges
+
+def _check(query, unit):
+	if len(query.get("periods") or []) != 1:
+		raise ShardingError("Only queries with one period can be sharded")
+	time_field = query["periods"][0]["field"]
+	for dimension in query.get("dimensions", []):
+		if dimension.get("field") == time_field and dimension.get("group") in NESTED_GROUPS[unit]:
+			# The following dimensions are computed within a shard
+			return
+		if "limit" in dimension:
+			raise ShardingError("The limit of '%s' applies to the whole period" % dimension["field"])
+
+def shard_queries(query, unit="MONTH"):
+	"""
+	Sub-queries of an aggregation query over the sub-periods of its period.
+
+	Returns a list of (values query, total query or None) per sub-period.
+	"""
+	_check(query, unit)
+	period = query["periods"][0]
+	shards = []
+	for start, stop in shard_ranges(period["from"], period["to"], unit):
+		sub = copy.deepcopy(query)
+		sub["periods"][0].update({"from": start, "to": stop})
+		if query["type"] == "COUNT":
+			shards.append((sub, None))
+			continue
+		if query["type"] not in ("CSAT", "NPS"):
+			raise ShardingError("Aggregations of type '%s' cannot be merged" % query["type"])
+		# Distribution of the rating per group and over the sub-period
+		rating = {"field": query["field"], "group": "DISTINCT"}
+		sub["type"] = "COUNT"
+		sub["dimensions"] = sub.get("dimensions", []) + [rating]
+		total = copy.deepcopy(sub)
+		total["dimensions"] = [rating]
+		shards.append((sub, total))
+	return shards
+
+def _metrics(kind, values):
+	# [(group, CSAT or NPS, volume)] of the values of distribution queries, the
+	# metrics being defined once in metrics.Distribution
+	from .metrics import Distribution
+	distribution = Distribution.from_values(values)
+	metric = distribution.average() if kind == "CSAT" else distribution.nps()
+	return [(list(group), float(value) if volume else None, int(volume))
+		for group, value, volume in zip(distribution.groups, metric, distribution.volume())]
+
+def merge(query, payloads):
+	"""
+	Merge the responses of the sub-queries of shard_queries.
+
+	payloads: list of (values payload, total payload or None) per sub-period
+	Returns the payload of the query over its whole period.
+	"""
+	merged = copy.deepcopy(payloads[0][0])
+	period = merged["periods"][0]
+	for key in ("from", "to"):
+		if key in period:
+			period[key] = query["periods"][0][key]
+	if query["type"] == "COUNT":
+		values = collections.OrderedDict()
+		total = 0
+		for payload, _ in payloads:
+			p = payload["periods"][0]
+			total += p["total"]["value"]
+			for v in p["values"]:
+				key = json.dumps(v["dimensions"])
+				if key not in values:
+					values[key] = dict(v, value=0)
+				values[key]["value"] += v["value"]
+				if "volume" in v:
+					values[key]["volume"] = values[key].get("volume", 0) + v["volume"]
+		period["values"] = list(values.values())
+		period["total"] = dict(period["total"], value=total)
+		return merged
+	values, overall = [], []
+	for payload, total_payload in payloads:
+		values += payload["periods"][0]["values"]
+		overall += total_payload["periods"][0]["values"]
+	period["values"] = [{"dimensions": group, "value": value, "volume": volume}
+		for group, value, volume in _metrics(query["type"], values)]
+	total = _metrics(query["type"], overall)
+	value, volume = total[0][1:] if total else (None, 0)
+	period["total"] = {"value": value, "volume": volume}
+	return merged
+
+def sharded_post(api, url, query, unit="MONTH", auth=None, max_workers=4):
+	"""
+	POST an aggregation query as concurrent sub-queries over its sub-periods.
+
+	api: DictanovaClient of the sub-queries, each being memoized and cached
+	Returns a requests.Response holding the merged payload, or the first failed
+	response of a sub-query.
+	"""
+	from .client import json_response
+	queries = [q for shard in shard_queries(query, unit) for q in shard if q is not None]
+	with ThreadPoolExecutor(max_workers=max_workers) as pool:
+		responses = list(pool.map(lambda q: api.post(url, json=q, auth=auth), queries))
+	for response in responses:
+		if not response.ok:
+			return response
+	payloads = [r.json() for r in responses]
+	if query["type"] != "COUNT":
+		payloads = list(zip(payloads[0::2], payloads[1::2]))
+	else:
+		payloads = [(p, None) for p in payloads]
+	return json_response(merge(query, payloads), responses[0].url)
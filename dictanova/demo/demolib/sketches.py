@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+"""
+Heavy-hitter sketches to maintain top terms over document streams in bounded memory.
+
+* SpaceSaving keeps at most `capacity` counters and reports for each of them an
+overestimated count together with its maximal error
+* CountMinSketch estimates the count of any term with an error of at most
+`e/width * total` with probability `1 - exp(-depth)`
+
+Both are mergeable: sketches filled by several shards or processes can be combined.
+Hashes are computed with blake2b so that they are identical across processes.
+
+The sketches are a library helper: no use case script uses them yet.
+"""
+
+import hashlib, heapq, math
+import numpy as np
+
+from .enrichments import POLARITIES
+
+def _hash64(key, seed):
+	digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8, key=str(seed).encode()).digest()
+	return int.from_bytes(digest, "little")
+
+class CountMinSketch(object):
+	"""Count-Min sketch of term frequencies."""
+
+	def __init__(self, width=2048, depth=4, seed=0):
+		self.width = width
+		self.depth = depth
+		self.seed = seed
+		self.table = np.zeros((depth, width), dtype=np.int64)
+		self.total = 0
+
+	def _indices(self, key):
+		# Double hashing to derive one index per row
+		h = _hash64(key, self.seed)
+		h1, h2 = h & 0xffffffff, (h >> 32) | 1
+		return [(h1 + i*h2) % self.width for i in range(self.depth)]
+
+	def update(self, key, count=1):
+		self.table[np.arange(self.depth), self._indices(key)] += count
+		self.total += count
+
+	def estimate(self, key):
+		"""Overestimated count of `key`."""
+		return int(self.table[np.arange(self.depth), self._indices(key)].min())
+
+	@property
+	def epsilon(self):
+		return math.e / self.width
+
+	@property
+	def delta(self):
+		return math.exp(-self.depth)
+
+	def error_bound(self):
+		"""Maximal overestimation of `estimate`, with probability 1 - delta."""
+		return self.epsilon * self.total
+
+	def merge(self, other):
+		if (self.width, self.depth, self.seed) != (other.width, other.depth, other.seed):
+			raise ValueError("Cannot merge Count-Min sketches with different parameters")
+		self.table += other.table
+		self.total += other.total
+		return self
+
+class SpaceSaving(object):
+	"""Space-Saving summary of the most frequent terms."""
+
+	def __init__(self, capacity=100):
+		self.capacity = capacity
+		self.counters = {} # key -> [count, error]
+		self.total = 0
+		self._heap = [] # lazy min-heap of (count, key), may contain stale entries
+
+	def __len__(self):
+		return len(self.counters)
+
+	def _push(self, key):
+		heapq.heappush(self._heap, (self.counters[key][0], key))
+		if len(self._heap) > 4*self.capacity:
+			self._heap = [(c, k) for k,(c, e) in self.counters.items()]
+			heapq.heapify(self._heap)
+
+	def _pop_min(self):
+		while True:
+			count, key = heapq.heappop(self._heap)
+			if key in self.counters and self.counters[key][0] == count:
+				return key
+
+	def min_count(self):
+		"""Count of the smallest counter, the bound on the count of any untracked key."""
+		if len(self.counters) < self.capacity:
+			return 0
+		return min(c for c,e in self.counters.values())
+
+	def update(self, key, count=1):
+		self.total += count
+		if key in self.counters:
+			self.counters[key][0] += count
+		elif len(self.counters) < self.capacity:
+			self.counters[key] = [count, 0]
+		else:
+			evicted = self._pop_min()
+			floor = self.counters.pop(evicted)[0]
+			self.counters[key] = [floor + count, floor]
+		self._push(key)
+
+	def top(self, n=None):
+		"""List of (key, count, error) by decreasing count, the true count is in [count-error, count]."""
+		items = sorted(self.counters.items(), key=lambda kv: (-kv[1][0], kv[0]))
+		return [(k, c, e) for k,(c, e) in items[:n]]
+
+	def merge(self, other):
+		"""Merge another summary, keys missing on one side are bounded by its min count."""
+		floor_self, floor_other = self.min_count(), other.min_count()
+		merged = {}
+		for key in set(self.counters) | set(other.counters):
+			c1, e1 = self.counters.get(key, (floor_self, floor_self))
+			c2, e2 = other.counters.get(key, (floor_other, floor_other))
+			merged[key] = [c1 + c2, e1 + e2]
+		kept = sorted(merged.items(), key=lambda kv: -kv[1][0])[:self.capacity]
+		self.counters = dict(kept)
+		self.total += other.total
+		self._heap = [(c, k) for k,(c, e) in self.counters.items()]
+		heapq.heapify(self._heap)
+		return self
+
+class StreamingTopTerms(object):
+	"""Top terms per polarity and time bucket maintained over a stream of documents."""
+
+	def __init__(self, capacity=100, width=2048, depth=4, seed=0):
+		self.capacity = capacity
+		self.width, self.depth, self.seed = width, depth, seed
+		self.sketches = {} # (polarity, bucket) -> (SpaceSaving, CountMinSketch)
+
+	def _sketch(self, polarity, bucket):
+		key = (polarity, bucket)
+		if key not in self.sketches:
+			self.sketches[key] = (
+				SpaceSaving(self.capacity),
+				CountMinSketch(self.width, self.depth, self.seed))
+		return self.sketches[key]
+
+	def update(self, term, polarity, bucket=None, count=1):
+		ss, cms = self._sketch(polarity, bucket)
+		ss.update(term, count)
+		cms.update(term, count)
+
+	def update_documents(self, documents, bucket=None):
+		"""
+		Count the enrichments of a batch of documents.
+
+		documents: iterable of documents (items in search result)
+		bucket: function returning the time bucket of a document (eg. its week), or None
+		"""
+		for doc in documents:
+			b = None if bucket is None else bucket(doc)
+			for e in doc.get("enrichments", []):
+				self.update(e["term"], e.get("opinion"), b)
+
+	def update_enrichments(self, enrichments, buckets=None):
+		"""
+		Count EnrichmentArrays.
+
+		enrichments: EnrichmentArrays of the documents
+		buckets: sequence with the time bucket of each document, or None
+		"""
+		docs = enrichments.doc_index()
+		labels = enrichments.terms.decode(enrichments.term)
+		for i in range(enrichments.size):
+			polarity = POLARITIES[enrichments.polarity[i]] if enrichments.polarity[i] >= 0 else None
+			self.update(labels[i], polarity, None if buckets is None else buckets[docs[i]])
+
+	def merge(self, other):
+		"""Merge the sketches of another shard or process."""
+		for key, (ss, cms) in other.sketches.items():
+			mine_ss, mine_cms = self._sketch(*key)
+			mine_ss.merge(ss)
+			mine_cms.merge(cms)
+		return self
+
+	def top(self, polarity, bucket=None, n=10):
+		"""
+		Top terms of a polarity, like `/terms?opinions=NEGATIVE`.
+
+		polarity: POSITIVE, NEGATIVE or NEUTRAL
+		bucket: a time bucket, if None all buckets are merged
+		n: number of terms returned
+		Returns a list of dict with `id`, `occurrences` (an overestimate) and `error`.
+		"""
+		keys = [k for k in self.sketches if k[0] == polarity and (bucket is None or k[1] == bucket)]
+		if not keys:
+			return []
+		ss = SpaceSaving(self.capacity)
+		cms = CountMinSketch(self.width, self.depth, self.seed)
+		for key in keys:
+			ss.merge(self.sketches[key][0])
+			cms.merge(self.sketches[key][1])
+		items = []
+		for term, count, error in ss.top(n):
+			# Both sketches overestimate, the smallest estimate is the tightest
+			estimate = min(count, cms.estimate(term))
+			lower = max(count - error, estimate - cms.error_bound(), 0)
+			items.append({
+				"id": term,
+				"occurrences": estimate,
+				"error": estimate - lower
+			})
+		return sorted(items, key=lambda item: -item["occurrences"])
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+"""
+Local stand-in of the API replaying the responses of a response cache.
+
+The server answers the requests of the scripts (`DICTANOVA_API_URL` set to its URL,
+eg. `http://127.0.0.1:8080/v1`) with the responses recorded in a ResponseCache
+directory for the same requests of the API, without credentials nor network: use
+cases run offline and the behaviour of the client can be tested locally. Unknown
+requests are answered with `404`.
+
+Responses carry the validators `ETag` (recorded, or a hash of the body) and
+`Last-Modified` (recorded, or the time of the recording), and conditional requests
+(`If-None-Match`, `If-Modified-Since`) are answered with `304 Not Modified` when the
+response has not changed, as the revalidation of the client expects.
+"""
+
+import collections, gzip, hashlib, json, threading
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit
+
+from .client import request_key
+from .config import API_URL
+
+def recorded_keys(method, url, body):
+	"""
+	Request keys a DictanovaClient may have recorded a request under, from its raw body.
+
+	An empty body was sent with `data=""` (eg. the search requests of all the documents)
+	or without body, other bodies are JSON or raw data (see client.request_key).
+	"""
+	if not body:
+		return [request_key(method, url, data=""), request_key(method, url)]
+	try:
+		return [request_key(method, url, json=json.loads(body.decode("utf-8")))]
+	except ValueError:
+		return [request_key(method, url, data=body)]
+
+def etag(response):
+	"""Recorded ETag of a response, or a strong ETag of its body."""
+	return response.headers.get("ETag") or '"%s"' % hashlib.blake2b(response.content, digest_size=16).hexdigest()
+
+def _weak(tag):
+	# Weak comparison of entity tags
+	return tag[2:] if tag.startswith("W/") else tag
+
+def not_modified(headers, tag, last_modified):
+	"""True if the conditional headers of a request match the validators of a response."""
+	if headers.get("If-None-Match"):
+		# If-Modified-Since is ignored when If-None-Match is given
+		tags = [t.strip() for t in headers["If-None-Match"].split(",")]
+		return "*" in tags or _weak(tag) in [_weak(t) for t in tags]
+	if headers.get("If-Modified-Since"):
+		try:
+			return parsedate_to_datetime(headers["If-Modified-Since"]) >= parsedate_to_datetime(last_modified)
+		except (TypeError, ValueError):
+			return False
+	return False
+
+class _Handler(BaseHTTPRequestHandler):
+
+	protocol_version = "HTTP/1.1"
+
+	def do_GET(self):
+		self._answer("GET")
+
+	def do_POST(self):
+		self._answer("POST")
+
+	def _body(self):
+		body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+		if self.headers.get("Content-Encoding") == "gzip":
+			body = gzip.decompress(body)
+		return body
+
+	def _reply(self, status, content=b"", headers=None):
+		# Counted before the response is sent, the client may read the counts once answered
+		with self.server.lock:
+			self.server.answers[status] += 1
+		self.send_response(status)
+		for name, value in (headers or {}).items():
+			self.send_header(name, value)
+		self.send_header("Content-Length", str(len(content)))
+		self.end_headers()
+		if content:
+			self.wfile.write(content)
+
+	def _answer(self, method):
+		body = self._body()
+		if method == "POST" and urlsplit(self.path).path.endswith("/token"):
+			# Any credentials are accepted
+			token = json.dumps({"access_token": "standin", "token_type": "Bearer"}).encode("utf-8")
+			return self._reply(200, token, {"Content-Type": "application/json"})
+		api = urlsplit(self.server.api_url)
+		url = "%s://%s%s" % (api.scheme, api.netloc, self.path)
+		entry = None
+		for key in recorded_keys(method, url, body):
+			entry = self.server.cache.load(key)
+			if entry is not None:
+				break
+		if entry is None:
+			error = json.dumps({"error": "No recorded response for %s %s" % (method, url)}).encode("utf-8")
+			return self._reply(404, error, {"Content-Type": "application/json"})
+		response, stored = entry
+		validators = {
+			"ETag": etag(response),
+			"Last-Modified": response.headers.get("Last-Modified") or formatdate(stored, usegmt=True)
+		}
+		if not_modified(self.headers, validators["ETag"], validators["Last-Modified"]):
+			return self._reply(304, headers=validators)
+		validators["Content-Type"] = response.headers.get("Content-Type", "application/json")
+		self._reply(response.status_code, response.content, validators)
+
+	def log_message(self, format, *args):
+		if self.server.verbose:
+			BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class StandinServer(ThreadingMixIn, HTTPServer):
+	"""HTTP server answering the requests of the API from a ResponseCache."""
+
+	daemon_threads = True
+
+	def __init__(self, cache, address=("127.0.0.1", 8080), api_url=API_URL, verbose=False):
+		"""
+		cache: ResponseCache of the recorded responses
+		address: (host, port) of the server, port 0 for any free port
+		api_url: base URL of the API of the recorded requests
+		verbose: log the requests on stderr
+		"""
+		HTTPServer.__init__(self, address, _Handler)
+		self.cache = cache
+		self.api_url = api_url
+		self.verbose = verbose
+		self.lock = threading.Lock()
+		self.answers = collections.Counter() # status -> number of responses
+
+	def url(self):
+		"""Base URL of the stand-in API, to use as `DICTANOVA_API_URL`."""
+		host, port = self.server_address[:2]
+		return "http://%s:%d%s" % (host, port, urlsplit(self.api_url).path)
+
+	def start(self):
+		"""Serve in a daemon thread, returns the thread."""
+		thread = threading.Thread(target=self.serve_forever, name="standin", daemon=True)
+		thread.start()
+		return thread
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+"""
+Incremental store of the time series of the aggregation queries.
+
+A series query is sharded per month or week (see sharding.py) and the response of each
+bucket is stored by (dataset, query signature, bucket), the signature being the query
+without the bounds of its period. A bucket ended for more than `settle` seconds (late
+data being still indexed before) is closed: once fetched, it is frozen and never
+fetched again. The next runs only fetch the open and the new buckets, bypassing the
+response cache, and stitch the series of the whole period together. The store is a
+directory (`DICTANOVA_SERIES`), eg. shared by the workers.
+"""
+
+import calendar, copy, datetime, hashlib, json, os, re, socket, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+from .client import json_response, request_key
+from .query import as_json, parse
+from .sharding import DATE_FORMAT, merge, shard_queries
+
+def signature(url, query):
+	"""Signature of a series query, independent of the bounds of its period."""
+	# Canonical form first, the bounds are needed to read the periods
+	try:
+		query = parse(as_json(query)).to_json()
+	except (ValueError, KeyError, TypeError):
+		query = copy.deepcopy(as_json(query))
+	for period in query.get("periods", []):
+		period.pop("from", None)
+		period.pop("to", None)
+	return hashlib.blake2b(request_key("POST", url, json=query).encode("utf-8"), digest_size=16).hexdigest()
+
+def dataset_of(url):
+	"""Id of the dataset of an API URL."""
+	m = re.search(r"/datasets/([^/?]+)", url)
+	return m.group(1) if m else "_"
+
+class SeriesStore(object):
+	"""Directory of frozen buckets of series, safe to share between threads and processes."""
+
+	def __init__(self, directory, settle=86400.):
+		"""
+		directory: directory of the store, created if needed
+		settle: seconds after the end of a bucket before it is closed
+		"""
+		self.directory = os.path.abspath(directory)
+		self.settle = settle
+		os.makedirs(self.directory, exist_ok=True)
+		self._lock = threading.Lock()
+		self.reused = 0 # buckets read from the store
+		self.fetched = 0 # buckets fetched from the API
+
+	def path(self, dataset, sig, start, stop):
+		bucket = "%s_%s.json" % (start[:10], stop[:10])
+		return os.path.join(self.directory, dataset, sig, bucket)
+
+	def closed(self, stop, now=None):
+		"""True if a bucket ending at `stop` (ISO date) cannot change anymore."""
+		end = calendar.timegm(datetime.datetime.strptime(stop, DATE_FORMAT).timetuple())
+		return end + self.settle < (time.time() if now is None else now)
+
+	def get(self, dataset, sig, start, stop):
+		"""Payloads of a frozen bucket, or None."""
+		try:
+			with open(self.path(dataset, sig, start, stop), "r", encoding="utf-8") as fin:
+				entry = json.load(fin)
+		except (IOError, ValueError):
+			return None
+		if (entry.get("from"), entry.get("to")) != (start, stop):
+			return None
+		return entry["payloads"]
+
+	def freeze(self, dataset, sig, start, stop, payloads):
+		"""Store the payloads of a closed bucket."""
+		path = self.path(dataset, sig, start, stop)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		tmp = "%s.%s-%d-%d.tmp" % (path, socket.gethostname(), os.getpid(), threading.get_ident())
+		with open(tmp, "w", encoding="utf-8") as fout:
+			json.dump({"from": start, "to": stop, "payloads": payloads}, fout, ensure_ascii=False)
+		os.replace(tmp, path)
+
+	def post(self, api, url, query, unit="MONTH", auth=None, now=None, max_workers=4):
+		"""
+		POST a series query, fetching only the buckets not frozen yet.
+
+		api: DictanovaClient of the buckets
+		unit: MONTH or WEEK, the buckets of the store
+		now: timestamp deciding which buckets are closed, the current time if None
+		Returns a requests.Response holding the payload of the whole series, or the
+		first failed response of a bucket.
+		"""
+		dataset, sig = dataset_of(url), signature(api.url(url), query)
+		shards = shard_queries(query, unit)
+		payloads, missing = [None] * len(shards), []
+		for i, shard in enumerate(shards):
+			period = shard[0]["periods"][0]
+			payloads[i] = self.get(dataset, sig, period["from"], period["to"])
+			if payloads[i] is None:
+				missing.append(i)
+		with self._lock:
+			self.reused += len(shards) - len(missing)
+
+		def fetch(i):
+			period = shards[i][0]["periods"][0]
+			closed = self.closed(period["to"], now)
+			# Open buckets are always fetched from the API, not from the memo nor the cache
+			# of the client
+			return [None if q is None else api.post(url, json=q, auth=auth, cached=closed) for q in shards[i]]
+
+		with ThreadPoolExecutor(max_workers=max_workers) as pool:
+			fetched = list(pool.map(fetch, missing))
+		for i, responses in zip(missing, fetched):
+			for response in responses:
+				if response is not None and not response.ok:
+					return response
+			payloads[i] = [None if r is None else r.json() for r in responses]
+			with self._lock:
+				self.fetched += 1
+			period = shards[i][0]["periods"][0]
+			if self.closed(period["to"], now):
+				self.freeze(dataset, sig, period["from"], period["to"], payloads[i])
+		return json_response(merge(query, payloads), api.url(url))
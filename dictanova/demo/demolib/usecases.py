@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""
+Catalog of the use case scripts and of the API requests they make.
+
+Each script declares, in a module-level FETCHES list, the requests it makes whatever the
+responses of the others, as the keyword arguments of DictanovaClient.post (`url`,
+`json` or `data`, `params`, `shard`), and posts these same dicts. fetches() reads them
+by running the script without its main part. pipeline() builds a Pipeline where the
+fetches of the selected use cases run concurrently, identical or contained ones being
+computed once, before the scripts: these change the current directory and use pyplot,
+so they run one at a time and only the prefetch is concurrent. Only the standard
+library is imported at module level, and the scripts import pandas, NumPy and the
+helpers using them in their main part: reading FETCHES does not load them.
+
+The scripts save their figures without showing them; run_script() displays the figures
+left open with `show`.
+"""
+
+import os, re, sys
+
+DEMO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Short name -> directory of the scripts
+DEMOS = {
+	"product": "product-reviews",
+	"retail": "retail-feedbacks"
+}
+
+def use_cases(demo):
+	"""Dict use case name (uc1...) -> path of the script."""
+	directory = os.path.join(DEMO_DIR, DEMOS[demo])
+	scripts = {}
+	for name in os.listdir(directory):
+		m = re.match(r"demo-%s-(uc\d+)\.py$" % re.escape(DEMOS[demo]), name)
+		if m:
+			scripts[m.group(1)] = os.path.join(directory, name)
+	return scripts
+
+def sort_key(uc):
+	return int(uc[2:])
+
+def describe(path):
+	"""Summary of a use case: the module docstring, without parsing the script."""
+	with open(path, "r", encoding="utf-8") as fin:
+		m = re.search(r'"""(.*?)"""', fin.read(), re.S)
+	lines = [l.strip() for l in (m.group(1) if m else "").strip().splitlines()]
+	return " ".join(l for l in lines if l and not l.startswith("This script implements"))
+
+def run_script(path, output=".", show=False):
+	"""
+	Run a use case script as __main__, its files being written in `output`.
+
+	show: if True, the figures left open by the script are displayed once it ended,
+	else it runs with the headless Agg backend whatever MPLBACKEND
+	"""
+	import runpy, warnings
+	os.makedirs(output, exist_ok=True)
+	cwd, argv, backend = os.getcwd(), sys.argv, os.environ.get("MPLBACKEND")
+	if not show:
+		os.environ["MPLBACKEND"] = "Agg"
+		if "matplotlib" in sys.modules:
+			# Backend already chosen, eg. by a previous use case
+			sys.modules["matplotlib"].use("Agg")
+	os.chdir(output)
+	sys.argv = [path]
+	try:
+		with warnings.catch_warnings():
+			if not show:
+				warnings.filterwarnings("ignore", message=".*non-interactive.*")
+			runpy.run_path(path, run_name="__main__")
+		if "matplotlib.pyplot" in sys.modules:
+			plt = sys.modules["matplotlib.pyplot"]
+			if show:
+				plt.show()
+			plt.close("all")
+	finally:
+		os.chdir(cwd)
+		sys.argv = argv
+		if backend is None:
+			os.environ.pop("MPLBACKEND", None)
+		else:
+			os.environ["MPLBACKEND"] = backend
+
+def fetches(path):
+	"""
+	FETCHES of a use case script, with the configuration of the environment (dataset,
+	fields, period). The script is run under another name than __main__ and raises its
+	errors, eg. ImportError.
+	"""
+	import runpy
+	return list(runpy.run_path(path, run_name="usecase").get("FETCHES", []))
+
+def pipeline(selected, output=".", show=False, auth=None):
+	"""
+	Pipeline running use cases after prefetching their data.
+
+	selected: list of (demo, use case)
+	output: directory of the produced files
+	auth: DictanovaAPIAuth of the fetches, from the configuration if None
+	The node of a use case is named "demo/uc", its fetches "demo/uc/fetchN"; scripts are
+	exclusive nodes.
+	"""
+	from .client import auth_from_config
+	from .pipeline import Pipeline
+	auth = auth or auth_from_config()
+	p = Pipeline()
+	for demo, uc in selected:
+		path = use_cases(demo)[uc]
+		try:
+			declared = fetches(path)
+		except Exception:
+			# Nothing to prefetch, the script fails and is reported when it runs
+			declared = []
+		deps = [p.fetch("%s/%s/fetch%d" % (demo, uc, i+1), auth=auth, **fetch) for i, fetch in enumerate(declared)]
+		def run(inputs, path=path):
+			run_script(path, output, show)
+		p.task("%s/%s" % (demo, uc), run, deps, exclusive=True)
+	return p
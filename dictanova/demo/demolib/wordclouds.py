@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""
+Word cloud rendering service.
+
+WordCloud instances are kept per configuration (color, font, size...) instead of being
+built for each cloud, and the layout computed for a set of words is remembered: when
+the same words come back with frequencies that only changed marginally (eg. the same
+report on the next day), the previous placement is reused and only the image is drawn
+again, skipping the costly search of a position for each word.
+"""
+
+import collections, json
+
+# Default configuration of the clouds, as in the scripts
+DEFAULTS = {
+	"prefer_horizontal": 1,
+	"background_color": "white"
+}
+
+def _normalize(freq, max_words):
+	# Top words scaled so that the most frequent one is 1, like WordCloud does
+	items = sorted(freq.items(), key=lambda kv: -kv[1])[:max_words]
+	if not items or items[0][1] <= 0:
+		raise ValueError("We need at least 1 word with a positive frequency to plot a word cloud")
+	top = float(items[0][1])
+	return dict((word, f / top) for word, f in items)
+
+class WordCloudService(object):
+	"""Configured WordCloud instances and layouts reused across clouds."""
+
+	def __init__(self, tolerance=0.05, max_layouts=256):
+		"""
+		tolerance: maximal change of the normalized frequency of any word for a layout to
+		be reused, 0 to always compute a new layout
+		max_layouts: number of layouts remembered, the least recently used are forgotten
+		"""
+		self.tolerance = tolerance
+		self.max_layouts = max_layouts
+		self._instances = {}
+		self._layouts = collections.OrderedDict() # (config, words) -> (frequencies, layout)
+		self.reused = 0
+		self.computed = 0
+
+	@staticmethod
+	def _config(color, kwargs):
+		return json.dumps([color, kwargs], sort_keys=True, default=repr)
+
+	def instance(self, color="darkblue", **kwargs):
+		"""WordCloud with this configuration, built once."""
+		key = self._config(color, kwargs)
+		if key not in self._instances:
+			from wordcloud import WordCloud
+			from matplotlib import colors
+			options = dict(DEFAULTS)
+			options.update(kwargs)
+			self._instances[key] = WordCloud(colormap=colors.ListedColormap([color]), **options)
+		return self._instances[key]
+
+	def _similar(self, previous, frequencies):
+		return all(abs(previous[w] - f) <= self.tolerance for w, f in frequencies.items())
+
+	def fit(self, freq, color="darkblue", **kwargs):
+		"""
+		Fit the word cloud of a dict of frequencies.
+
+		freq: dict word -> frequency
+		color: color of the words
+		kwargs: WordCloud keyword arguments (font_path, width, height...)
+		Returns the shared WordCloud instance of this configuration, to be drawn
+		(to_array, to_image) before the next call.
+		"""
+		wc = self.instance(color, **kwargs)
+		frequencies = _normalize(freq, wc.max_words)
+		key = (self._config(color, kwargs), tuple(sorted(frequencies)))
+		cached = self._layouts.get(key)
+		if cached is not None and self.tolerance > 0 and self._similar(cached[0], frequencies):
+			# Same words with close frequencies: keep sizes and positions
+			self._layouts.move_to_end(key)
+			wc.words_ = frequencies
+			wc.layout_ = [((word, frequencies[word]), size, position, orientation, c)
+				for (word, _), size, position, orientation, c in cached[1]]
+			self.reused += 1
+			return wc
+		wc.fit_words(freq)
+		self._layouts[key] = (frequencies, wc.layout_)
+		self._layouts.move_to_end(key)
+		while len(self._layouts) > self.max_layouts:
+			self._layouts.popitem(last=False)
+		self.computed += 1
+		return wc
+
+	def to_array(self, freq, color="darkblue", **kwargs):
+		"""Image of the word cloud of `freq` as a NumPy array, see fit."""
+		return self.fit(freq, color, **kwargs).to_array()
+
+	def batch(self, clouds):
+		"""
+		Render many word clouds in one call.
+
+		clouds: iterable of (freq, options), options being a dict with `color` and
+		`wordcloud` keyword arguments as in render ChartSpec options
+		Returns the list of images as NumPy arrays.
+		"""
+		return [self.to_array(freq, options.get("color", "darkblue"), **options.get("wordcloud", {}))
+			for freq, options in clouds]
+
+_service = None
+
+def service():
+	"""WordCloudService of the current process."""
+	global _service
+	if _service is None:
+		_service = WordCloudService()
+	return _service
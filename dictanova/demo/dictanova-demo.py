@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+"""
+Command line entry point of the demo use cases.
+
+    python dictanova-demo.py list
+    python dictanova-demo.py run retail uc3
+    python dictanova-demo.py run product uc1 uc4 --output out/ --show
+    python dictanova-demo.py run all
+    python dictanova-demo.py run retail uc1 --dataset <id> --fields fields.json
+    python dictanova-demo.py run retail uc3 uc6 --series ~/.dictanova/series
+    python dictanova-demo.py batch jobs.json --processes 8 --per-dataset 2 --output out/
+    python dictanova-demo.py enqueue jobs.json --queue /shared/jobs.sqlite
+    python dictanova-demo.py worker --queue /shared/jobs.sqlite --cache /shared/cache --output out/
+    python dictanova-demo.py serve --cache /shared/cache --port 8080
+    python dictanova-demo.py proxy --cache ~/.dictanova/cache --port 8081 --rate 5
+
+Only the standard library is imported until a use case actually runs, so that listing
+the use cases is immediate. The requests declared by the selected use cases are
+prefetched concurrently, each one once, then the scripts run one at a time (see
+demolib/usecases.py). Use cases run headless (matplotlib Agg backend) unless `--show` is given, their files are written in
+the output directory, and credentials are read from the environment or the
+configuration (see demolib/config.py) whatever the current directory is. `batch` runs
+the use cases of many datasets in a pool of processes (see demolib/scheduler.py);
+`enqueue` queues the same jobs in a durable queue that `worker`s of one or several hosts
+drain together, sharing their fetches through a response cache (see demolib/jobqueue.py).
+`serve` replays the responses of a cache as a local stand-in of the API (see
+demolib/standin.py) and `proxy` runs a local caching proxy of the API shared by the
+processes of a host (see demolib/proxy.py).
+"""
+
+import argparse, os, sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from demolib.usecases import DEMOS, describe, sort_key, use_cases
+
+def cmd_list(args):
+	for demo in sorted(DEMOS):
+		if args.demo and demo != args.demo:
+			continue
+		scripts = use_cases(demo)
+		for uc in sorted(scripts, key=sort_key):
+			print("%-8s %-5s %s" % (demo, uc, describe(scripts[uc])))
+
+def cmd_run(args):
+	selected = []
+	for demo in (sorted(DEMOS) if args.demo == "all" else [args.demo]):
+		scripts = use_cases(demo)
+		names = sorted(scripts, key=sort_key) if args.use_cases in ([], ["all"]) else args.use_cases
+		unknown = [uc for uc in names if uc not in scripts]
+		if unknown:
+			sys.exit("Unknown use case(s) for %s: %s (available: %s)" % (
+				demo, ", ".join(unknown), ", ".join(sorted(scripts, key=sort_key))))
+		selected += [(demo, uc) for uc in names]
+	if args.credentials:
+		os.environ["DICTANOVA_CREDENTIALS"] = os.path.abspath(args.credentials)
+	if args.api_url:
+		os.environ["DICTANOVA_API_URL"] = args.api_url
+	if args.dataset:
+		os.environ["DICTANOVA_DATASET"] = args.dataset
+	if args.fields:
+		os.environ["DICTANOVA_FIELDS"] = os.path.abspath(args.fields)
+	if args.series:
+		os.environ["DICTANOVA_SERIES"] = os.path.abspath(args.series)
+	from demolib.usecases import pipeline
+	from demolib.pipeline import PipelineError
+	def progress(name, status, elapsed):
+		print("######## %s %s (%.1fs)" % (name, status, elapsed))
+	p = pipeline(selected, os.path.abspath(args.output), args.show)
+	try:
+		p.run(max_workers=args.jobs, progress=progress)
+	except PipelineError as e:
+		sys.exit("Failed: %s" % e)
+	print("%d API calls (%d revalidated), %d answered from the memo, %d shared with identical requests in flight" % (
+		p.client.calls, p.client.revalidated, p.client.hits, p.client.shared))
+
+def cmd_batch(args):
+	if args.credentials:
+		os.environ["DICTANOVA_CREDENTIALS"] = os.path.abspath(args.credentials)
+	from demolib.scheduler import Scheduler, describe_job, load_jobs
+	jobs = load_jobs(args.jobs)
+	results = Scheduler(args.output, args.processes, args.per_dataset).run(jobs)
+	failed = [r for r in results if r.error]
+	for r in failed:
+		print("%s failed:\n%s" % (describe_job(r.job), r.error))
+	print("%d jobs, %d failed" % (len(results), len(failed)))
+	if failed:
+		sys.exit(1)
+
+def cmd_enqueue(args):
+	from demolib.jobqueue import JobQueue
+	from demolib.scheduler import load_jobs
+	queue = JobQueue(args.queue)
+	jobs = load_jobs(args.jobs)
+	added = queue.put(jobs, reset=args.reset)
+	print("%d jobs queued, %d already in the queue" % (added, len(jobs) - added))
+	print(", ".join("%d %s" % (n, state) for state, n in sorted(queue.counts().items())))
+
+def cmd_worker(args):
+	if args.credentials:
+		os.environ["DICTANOVA_CREDENTIALS"] = os.path.abspath(args.credentials)
+	if args.cache:
+		os.environ["DICTANOVA_CACHE"] = os.path.abspath(args.cache)
+	if args.cache_ttl is not None:
+		os.environ["DICTANOVA_CACHE_TTL"] = str(args.cache_ttl)
+	from demolib.jobqueue import JobQueue, Worker
+	from demolib.scheduler import describe_job
+	queue = JobQueue(args.queue, max_attempts=args.attempts)
+	worker = Worker(queue, args.output, args.processes, lease=args.lease)
+	results = worker.run()
+	# Only the failures of this worker: the others report theirs
+	failed = [r for r in results if r.error]
+	for r in failed:
+		print("%s failed:\n%s" % (describe_job(r.job), r.error))
+	print("%d jobs run by this worker, %d failed, %d lost" % (len(results), len(failed), len(worker.lost)))
+	if failed:
+		sys.exit(1)
+
+def cmd_serve(args):
+	from demolib.responsecache import ResponseCache
+	from demolib.standin import StandinServer
+	server = StandinServer(ResponseCache(args.cache), (args.host, args.port), args.api_url, args.verbose)
+	print("Serving the responses of %s, run the use cases with DICTANOVA_API_URL=%s" % (args.cache, server.url()))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+
+def cmd_proxy(args):
+	from demolib.proxy import CachingProxy
+	from demolib.responsecache import ResponseCache
+	cache = ResponseCache(args.cache, args.cache_ttl) if args.cache else None
+	server = CachingProxy(cache, (args.host, args.port), args.upstream, args.rate, args.burst,
+		args.connections, verbose=args.verbose)
+	print("Proxy of %s, run the use cases with DICTANOVA_API_URL=%s" % (args.upstream, server.url()))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		print(", ".join("%d %s" % (n, source) for source, n in sorted(server.answers.items())))
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="dictanova-demo", description="Run the Dictanova API demo use cases.")
+	commands = parser.add_subparsers(dest="command")
+	commands.required = True
+	p = commands.add_parser("list", help="list the use cases")
+	p.add_argument("demo", nargs="?", choices=sorted(DEMOS))
+	p.set_defaults(func=cmd_list)
+	p = commands.add_parser("run", help="run use cases")
+	p.add_argument("demo", choices=sorted(DEMOS) + ["all"])
+	p.add_argument("use_cases", nargs="*", metavar="uc", help="use cases (uc1, uc2...), all of them if none")
+	p.add_argument("--output", default=".", help="directory of the produced files")
+	p.add_argument("--show", action="store_true", help="display the figures instead of running headless")
+	p.add_argument("--credentials", help="credentials file (client_id;client_secret)")
+	p.add_argument("--api-url", help="base URL of the API")
+	p.add_argument("--jobs", type=int, default=4, help="number of fetches running concurrently")
+	p.add_argument("--dataset", help="id of the dataset, the one of the demo by default")
+	p.add_argument("--fields", help="JSON file mapping the metadata of the scripts to the ones of the dataset")
+	p.add_argument("--series", help="directory of the time series store, only open buckets are fetched again")
+	p.set_defaults(func=cmd_run)
+	p = commands.add_parser("batch", help="run the use cases of many datasets in parallel")
+	p.add_argument("jobs", help="JSON file listing the datasets, see demolib/scheduler.py")
+	p.add_argument("--output", default=".", help="root directory of the produced files")
+	p.add_argument("--processes", type=int, help="number of jobs running at the same time")
+	p.add_argument("--per-dataset", type=int, default=2, help="number of jobs of a dataset running at the same time")
+	p.add_argument("--credentials", help="credentials file (client_id;client_secret)")
+	p.set_defaults(func=cmd_batch)
+	p = commands.add_parser("enqueue", help="queue the use cases of many datasets for workers")
+	p.add_argument("jobs", help="JSON file listing the datasets, see demolib/scheduler.py")
+	p.add_argument("--queue", required=True, help="SQLite file of the queue, shared by the workers")
+	p.add_argument("--reset", action="store_true", help="queue again the jobs already done or failed")
+	p.set_defaults(func=cmd_enqueue)
+	p = commands.add_parser("worker", help="run queued jobs until the queue is drained")
+	p.add_argument("--queue", required=True, help="SQLite file of the queue, shared by the workers")
+	p.add_argument("--output", default=".", help="root directory of the produced files")
+	p.add_argument("--processes", type=int, default=1, help="number of jobs running at the same time")
+	p.add_argument("--lease", type=float, default=600., help="seconds a job is leased for without heartbeat")
+	p.add_argument("--attempts", type=int, default=3, help="number of attempts of a job before it fails")
+	p.add_argument("--cache", help="directory of the response cache shared by the workers")
+	p.add_argument("--cache-ttl", type=float, help="seconds after which cached responses are revalidated")
+	p.add_argument("--credentials", help="credentials file (client_id;client_secret)")
+	p.set_defaults(func=cmd_worker)
+	p = commands.add_parser("serve", help="serve the responses of a cache as a local stand-in of the API")
+	p.add_argument("--cache", required=True, help="directory of the response cache")
+	p.add_argument("--host", default="127.0.0.1", help="address of the server")
+	p.add_argument("--port", type=int, default=8080, help="port of the server")
+	p.add_argument("--api-url", default="https://api.dictanova.io/v1", help="base URL of the API of the recorded requests")
+	p.add_argument("--verbose", action="store_true", help="log the requests")
+	p.set_defaults(func=cmd_serve)
+	p = commands.add_parser("proxy", help="run a local caching proxy of the API shared by the processes of the host")
+	p.add_argument("--cache", help="directory of the persistent response cache")
+	p.add_argument("--cache-ttl", type=float, help="seconds after which cached responses are revalidated")
+	p.add_argument("--host", default="127.0.0.1", help="address of the proxy")
+	p.add_argument("--port", type=int, default=8081, help="port of the proxy")
+	p.add_argument("--upstream", default="https://api.dictanova.io/v1", help="base URL of the API")
+	p.add_argument("--rate", type=float, help="requests per second of each client, no limit by default")
+	p.add_argument("--burst", type=float, help="requests of a client at once, the rate by default")
+	p.add_argument("--connections", type=int, default=16, help="size of the pool of connections to the API")
+	p.add_argument("--verbose", action="store_true", help="log the requests")
+	p.set_defaults(func=cmd_proxy)
+	args = parser.parse_args(argv)
+	args.func(args)
+
+if __name__ == "__main__":
+	main()
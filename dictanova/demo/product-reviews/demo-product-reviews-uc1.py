@@ -5,83 +5,72 @@ This script implements the first use case:
 Top negative opinions of reviews from 2016 that do not recommand a product from subcategory "Couches Bébé".
 """
 
-import pandas as pd
-import requests, json
-import numpy as np
-import sys
+import json
+import sys, os
 
-class DictanovaAPIAuth(requests.auth.AuthBase):
-	"""Attaches Dictanova Bearer Authentication to the given Request object."""
-	
-	def __init__(self, id, secret):
-		self.apiclient_id = id
-		self.apiclient_secret = secret
-		self._token = None
-	
-	def __eq__(self, other):
-		return all([
-			self.apiclient_id == getattr(other, 'apiclient_id', None),
-			self.apiclient_secret == getattr(other, 'apiclient_secret', None)
-		])
-	
-	def __ne__(self, other):
-		return not self == other
-	
-	def __call__(self, r):
-		r.headers['Authorization'] = self.get_token()
-		return r
-	
-	def get_token(self):
-		# Get authentication token
-		if self._token is None:
-			payload = {
-				"clientId": self.apiclient_id,
-				"clientSecret": self.apiclient_secret
-			}
-			r = requests.post("https://api.dictanova.io/v1/token", json=payload)
-			self._token = r.json()
-		# Always use the one in cache
-		return "Bearer %s" % self._token["access_token"]
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from demolib.config import credentials, dataset, field, period
+from demolib.client import DictanovaAPIAuth, client
 
-if __name__ == "__main__":
-	# Prepare Auth handler with API client id and secret
-	# https://docs.dictanova.io/docs/authentication-and-security
-	clientId, clientSecret = open("../credentials", "r").readline().strip().split(";")
-	dictanova_auth = DictanovaAPIAuth(clientId, clientSecret)
-	
-	####################################################################### TOP OPINION
-	# Query for top opinions
-	query = {
+# Dataset and metadata fields, can be changed for another dataset (see demolib/config.py)
+dataset_id = dataset("5b2286583a35940001399b1a")
+period_from, period_to = period("2016-01-01T00:00:00Z", "2016-12-31T00:00:00Z")
+
+# Top negative opinions of the detractors
+TOP_NEGATIVE_OPINIONS = {
+	"url": "https://api.dictanova.io/v1/search/datasets/%s/terms?opinions=NEGATIVE" % dataset_id,
+	"json": {
 		"operator": "AND",
 		"criteria": [{
 			# Between 1/1/2016 and 31/12/2016
-			"field": "metadata.depot_date",
+			"field": field("depot_date"),
 			"operator": "GTE",
-			"value": "2016-01-01T00:00:00Z"
+			"value": period_from
 		}, {
-			"field": "metadata.depot_date",
+			"field": field("depot_date"),
 			"operator": "LTE",
-			"value": "2016-12-31T00:00:00Z"
+			"value": period_to
 		}, {
 			# Only subcategory "Couches Bébé"
-			"field": "metadata.subcategory",
+			"field": field("subcategory"),
 			"operator": "EQ",
 			"value": "Couches Bébé"
 		}, {
 			# Do not recommand
-			"field": "metadata.recommande",
+			"field": field("recommande"),
 			"operator": "EQ",
 			"value": "Ne recommande pas"
 		}]
 	}
+}
+
+# Requests not depending on other responses, prefetched by dictanova-demo.py run
+# (see demolib/usecases.py)
+FETCHES = [TOP_NEGATIVE_OPINIONS]
+
+if __name__ == "__main__":
+	# Heavy imports only when the use case runs, not when its FETCHES are read
+	import pandas as pd
+	import numpy as np
+	from demolib.interning import intern_table
+	from demolib.enrichments import EnrichmentArrays
+	from demolib.highlight import highlight_documents
+	
+	# Prepare Auth handler with API client id and secret
+	# https://docs.dictanova.io/docs/authentication-and-security
+	clientId, clientSecret = credentials()
+	dictanova_auth = DictanovaAPIAuth(clientId, clientSecret)
+	# Responses are memoized and shared with the use cases run in the same process
+	api = client()
+
+	####################################################################### TOP OPINION
+	# Query for top opinions
+	query = TOP_NEGATIVE_OPINIONS["json"]
 	print("Query:")
 	print(json.dumps(query, indent=4, sort_keys=False))
-	
+
 	# Request
-	r = requests.post(
-		"https://api.dictanova.io/v1/search/datasets/5b2286583a35940001399b1a/terms?opinions=NEGATIVE",
-		json=query,
-		auth=dictanova_auth)
+	r = api.post(auth=dictanova_auth, **TOP_NEGATIVE_OPINIONS)
 	print(r)
 	
 	# Pretty print results
@@ -104,7 +93,7 @@ if __name__ == "__main__":
 	wordcloud = wc.fit_words(wc_freq)
 	plt.imshow(wordcloud)
 	plt.axis("off")
-	plt.show()
+	plt.savefig("uc1-top-negative-opinions.png", bbox_inches='tight')
 	
 	####################################################################### SEARCH
 	# Search for most common opinion
@@ -114,21 +103,21 @@ if __name__ == "__main__":
 		"operator": "AND",
 		"criteria": [{
 			# Between 1/1/2016 and 31/12/2016
-			"field": "metadata.depot_date",
+			"field": field("depot_date"),
 			"operator": "GTE",
-			"value": "2016-01-01T00:00:00Z"
+			"value": period_from
 		}, {
-			"field": "metadata.depot_date",
+			"field": field("depot_date"),
 			"operator": "LTE",
-			"value": "2016-12-31T00:00:00Z"
+			"value": period_to
 		}, {
 			# Only subcategory "Couches Bébé"
-			"field": "metadata.subcategory",
+			"field": field("subcategory"),
 			"operator": "EQ",
 			"value": "Couches Bébé"
 		}, {
 			# Do not recommand
-			"field": "metadata.recommande",
+			"field": field("recommande"),
 			"operator": "EQ",
 			"value": "Ne recommande pas"
 		}, {
@@ -141,8 +130,8 @@ if __name__ == "__main__":
 	}
 	
 	# Request
-	r = requests.post(
-		"https://api.dictanova.io/v1/search/datasets/5b2286583a35940001399b1a/documents",
+	r = api.post(
+		"https://api.dictanova.io/v1/search/datasets/%s/documents" % dataset_id,
 		json=query,
 		auth=dictanova_auth)
 	print(r)
@@ -150,19 +139,15 @@ if __name__ == "__main__":
 	# Pretty print results
 	print("%d reviews from detractors of 2016 in subcategory 'Couches Bébé' negative about '%s'" %\
 		(r.json()["total"], most_common_opinion["label"]))
-	for i,doc in enumerate(r.json()["items"]):
-		# identify occurrences
-		highlights = [o for o in doc["enrichments"] if (o["term"]==most_common_opinion["id"] and o["opinion"]=="NEGATIVE")]
-		highlights = sorted(highlights, key=lambda h: h["offset"]["begin"])
-		splitted = []
-		last=0
-		for highlight in highlights:
-			splitted.append( doc["content"][last:highlight["offset"]["begin"]] )
-			splitted.append( doc["content"][highlight["offset"]["begin"]:highlight["offset"]["end"]] )
-			last=highlight["offset"]["end"]
-		splitted.append(doc["content"][last:])
+	documents = r.json()["items"]
+	enrichments = EnrichmentArrays.from_documents(
+		documents, intern_table(dataset_id)["opinion"], strip=True)
+	# highlight occurrences
+	highlighted = highlight_documents(documents, enrichments,
+		term=most_common_opinion["id"], polarity="NEGATIVE", mode="text", marker="**")
+	for i,text in enumerate(highlighted):
 		print("###### Review %d/%d" % (i+1, r.json()["total"]))
-		print("**".join(splitted))
+		print(text)
 		print()
 	
 	
\ No newline at end of file
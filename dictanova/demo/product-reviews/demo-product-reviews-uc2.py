@@ -5,92 +5,79 @@ This script implements the second use case:
 Measure the impact of the price on the score per product subcategory.
 """
 
-import pandas as pd
-import requests, json
-import numpy as np
-import sys
+import json
+import sys, os
 
-class DictanovaAPIAuth(requests.auth.AuthBase):
-	"""Attaches Dictanova Bearer Authentication to the given Request object."""
-	
-	def __init__(self, id, secret):
-		self.apiclient_id = id
-		self.apiclient_secret = secret
-		self._token = None
-	
-	def __eq__(self, other):
-		return all([
-			self.apiclient_id == getattr(other, 'apiclient_id', None),
-			self.apiclient_secret == getattr(other, 'apiclient_secret', None)
-		])
-	
-	def __ne__(self, other):
-		return not self == other
-	
-	def __call__(self, r):
-		r.headers['Authorization'] = self.get_token()
-		return r
-	
-	def get_token(self):
-		# Get authentication token
-		if self._token is None:
-			payload = {
-				"clientId": self.apiclient_id,
-				"clientSecret": self.apiclient_secret
-			}
-			r = requests.post("https://api.dictanova.io/v1/token", json=payload)
-			self._token = r.json()
-		# Always use the one in cache
-		return "Bearer %s" % self._token["access_token"]
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from demolib.config import credentials, dataset, field
+from demolib.client import DictanovaAPIAuth, client
 
-if __name__ == "__main__":
-	# Prepare Auth handler with API client id and secret
-	# https://docs.dictanova.io/docs/authentication-and-security
-	clientId, clientSecret = open("../credentials", "r").readline().strip().split(";")
-	dictanova_auth = DictanovaAPIAuth(clientId, clientSecret)
-	
-	####################################################################### AGGREGATION
-	# Query for CSAT
-	query = {
+# Dataset and metadata fields, can be changed for another dataset (see demolib/config.py)
+dataset_id = dataset("5b2286583a35940001399b1a")
+
+# CSAT per subcategory
+CSAT_PER_SUBCATEGORY = {
+	"url": "https://api.dictanova.io/v1/aggregation/datasets/%s/documents" % dataset_id,
+	"json": {
 		"type" : "CSAT",
-		"field" : "metadata.note_moyenne",
+		"field" : field("note_moyenne"),
 		"dimensions" : [
 			{
-				"field" : "metadata.subcategory",
+				"field" : field("subcategory"),
 				"group" : "DISTINCT"
 			}
 		]
 	}
-	print("Query:")
-	print(json.dumps(query, indent=4, sort_keys=False))
-	
-	# Requests
-	r_ref = requests.post(
-		"https://api.dictanova.io/v1/aggregation/datasets/5b2286583a35940001399b1a/documents",
-		json=query,
-		auth=dictanova_auth)
-	print(r_ref)
-	query["query"] = {
+}
+# Same CSAT for the reviews negative about the price
+CSAT_PER_SUBCATEGORY_PRICE_NEGATIVE = {
+	"url": CSAT_PER_SUBCATEGORY["url"],
+	"json": dict(CSAT_PER_SUBCATEGORY["json"], query={
 		"field": "TERMS",
 		"operator": "EQ",
 		"value": "prix_NOUN",
 		"opinion": "NEGATIVE"
-	}
-	r_neg = requests.post(
-		"https://api.dictanova.io/v1/aggregation/datasets/5b2286583a35940001399b1a/documents",
-		json=query,
-		auth=dictanova_auth)
-	print(r_neg)
-	query["query"] = {
+	})
+}
+# Same CSAT for the reviews positive about the price
+CSAT_PER_SUBCATEGORY_PRICE_POSITIVE = {
+	"url": CSAT_PER_SUBCATEGORY["url"],
+	"json": dict(CSAT_PER_SUBCATEGORY["json"], query={
 		"field": "TERMS",
 		"operator": "EQ",
 		"value": "prix_NOUN",
 		"opinion": "POSITIVE"
-	}
-	r_pos = requests.post(
-		"https://api.dictanova.io/v1/aggregation/datasets/5b2286583a35940001399b1a/documents",
-		json=query,
-		auth=dictanova_auth)
+	})
+}
+
+# Requests not depending on other responses, prefetched by dictanova-demo.py run
+# (see demolib/usecases.py)
+FETCHES = [CSAT_PER_SUBCATEGORY, CSAT_PER_SUBCATEGORY_PRICE_NEGATIVE, CSAT_PER_SUBCATEGORY_PRICE_POSITIVE]
+
+if __name__ == "__main__":
+	# Heavy imports only when the use case runs, not when its FETCHES are read
+	import pandas as pd
+	import numpy as np
+	
+	# Prepare Auth handler with API client id and secret
+	# https://docs.dictanova.io/docs/authentication-and-security
+	clientId, clientSecret = credentials()
+	dictanova_auth = DictanovaAPIAuth(clientId, clientSecret)
+	# Responses are memoized and shared with the use cases run in the same process
+	api = client()
+
+	####################################################################### AGGREGATION
+	# Query for CSAT
+	query = CSAT_PER_SUBCATEGORY["json"]
+	print("Query:")
+	print(json.dumps(query, indent=4, sort_keys=False))
+
+	# Requests
+	r_ref = api.post(auth=dictanova_auth, **CSAT_PER_SUBCATEGORY)
+	print(r_ref)
+	r_neg = api.post(auth=dictanova_auth, **CSAT_PER_SUBCATEGORY_PRICE_NEGATIVE)
+	print(r_neg)
+	r_pos = api.post(auth=dictanova_auth, **CSAT_PER_SUBCATEGORY_PRICE_POSITIVE)
 	print(r_pos)
 	
 	# Merge results
@@ -116,6 +103,6 @@ if __name__ == "__main__":
 	df["var_if_neg"] = 100*(df["value_priceneg"] - df["value"]) / df["value"]
 	print(df[["var_if_pos", "var_if_neg", "volume"]])
 	df[["var_if_pos","var_if_neg"]].plot.bar(color=["seagreen","orangered"], rot=0)
-	plt.show()
+	plt.savefig("uc2-price-impact-per-subcategory.png")
 
 	
\ No newline at end of file
@@ -5,56 +5,41 @@ This script implements the third use case:
 Top brands in satisfaction regarding leaks.
 """
 
-import pandas as pd
-import requests, json
-import numpy as np
-import sys
+import json
+import sys, os
 
-class DictanovaAPIAuth(requests.auth.AuthBase):
-	"""Attaches Dictanova Bearer Authentication to the given Request object."""
-	
-	def __init__(self, id, secret):
-		self.apiclient_id = id
-		self.apiclient_secret = secret
-		self._token = None
-	
-	def __eq__(self, other):
-		return all([
-			self.apiclient_id == getattr(other, 'apiclient_id', None),
-			self.apiclient_secret == getattr(other, 'apiclient_secret', None)
-		])
-	
-	def __ne__(self, other):
-		return not self == other
-	
-	def __call__(self, r):
-		r.headers['Authorization'] = self.get_token()
-		return r
-	
-	def get_token(self):
-		# Get authentication token
-		if self._token is None:
-			payload = {
-				"clientId": self.apiclient_id,
-				"clientSecret": self.apiclient_secret
-			}
-			r = requests.post("https://api.dictanova.io/v1/token", json=payload)
-			self._token = r.json()
-		# Always use the one in cache
-		return "Bearer %s" % self._token["access_token"]
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from demolib.config import credentials, dataset, field
+from demolib.client import DictanovaAPIAuth, client
+
+# Dataset and metadata fields, can be changed for another dataset (see demolib/config.py)
+dataset_id = dataset("5b2286583a35940001399b1a")
+
+# Opinions containing "fuite"
+LEAK_OPINIONS = {
+	"url": "https://api.dictanova.io/v1/search/datasets/%s/terms?q=fuite" % dataset_id
+}
+
+# Requests not depending on other responses, prefetched by dictanova-demo.py run
+# (see demolib/usecases.py)
+FETCHES = [LEAK_OPINIONS]
 
 if __name__ == "__main__":
+	# Heavy imports only when the use case runs, not when its FETCHES are read
+	import pandas as pd
+	import numpy as np
+	
 	# Prepare Auth handler with API client id and secret
 	# https://docs.dictanova.io/docs/authentication-and-security
-	clientId, clientSecret = open("../credentials", "r").readline().strip().split(";")
+	clientId, clientSecret = credentials()
 	dictanova_auth = DictanovaAPIAuth(clientId, clientSecret)
-	
+	# Responses are memoized and shared with the use cases run in the same process
+	api = client()
+
 	####################################################################### LIST OPINIONS
 	# Query for opinions containing "fuite"
 	# Requests
-	r = requests.post(
-		"https://api.dictanova.io/v1/search/datasets/5b2286583a35940001399b1a/terms?q=fuite",
-		auth=dictanova_auth)
+	r = api.post(auth=dictanova_auth, **LEAK_OPINIONS)
 	print(r)
 	
 	all_leaks = [o["id"] for o in r.json()["items"]]
@@ -64,12 +49,12 @@ if __name__ == "__main__":
 	# Query for CSAT
 	query = {
 		"type" : "CSAT",
-		"field" : "metadata.note_moyenne",
+		"field" : field("note_moyenne"),
 		"query" : {
 			"operator": "AND",
 			"criteria": [
 				{
-					"field": "metadata.subcategory",
+					"field": field("subcategory"),
 					"operator": "EQ",
 					"value": "Couches Bébé"
 				},
@@ -82,7 +67,7 @@ if __name__ == "__main__":
 		},
 		"dimensions" : [
 			{
-				"field" : "metadata.marque",
+				"field" : field("marque"),
 				"group" : "DISTINCT"
 			}
 		]
@@ -92,8 +77,8 @@ if __name__ == "__main__":
 	print(json.dumps(query, indent=4, sort_keys=False))
 	
 	# Requests
-	r = requests.post(
-		"https://api.dictanova.io/v1/aggregation/datasets/5b2286583a35940001399b1a/documents",
+	r = api.post(
+		"https://api.dictanova.io/v1/aggregation/datasets/%s/documents" % dataset_id,
 		json=query,
 		auth=dictanova_auth)
 	print(r)
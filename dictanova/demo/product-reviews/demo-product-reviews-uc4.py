@@ -5,117 +5,96 @@ This script implements the fourth use case:
 Llosa matrix for diapers. Compute CSAT for each opinion.
 """
 
-import pandas as pd
-import requests, json
-import numpy as np
-import sys
+import json
+import sys, os
 
-class DictanovaAPIAuth(requests.auth.AuthBase):
-	"""Attaches Dictanova Bearer Authentication to the given Request object."""
-	
-	def __init__(self, id, secret):
-		self.apiclient_id = id
-		self.apiclient_secret = secret
-		self._token = None
-	
-	def __eq__(self, other):
-		return all([
-			self.apiclient_id == getattr(other, 'apiclient_id', None),
-			self.apiclient_secret == getattr(other, 'apiclient_secret', None)
-		])
-	
-	def __ne__(self, other):
-		return not self == other
-	
-	def __call__(self, r):
-		r.headers['Authorization'] = self.get_token()
-		return r
-	
-	def get_token(self):
-		# Get authentication token
-		if self._token is None:
-			payload = {
-				"clientId": self.apiclient_id,
-				"clientSecret": self.apiclient_secret
-			}
-			r = requests.post("https://api.dictanova.io/v1/token", json=payload)
-			self._token = r.json()
-		# Always use the one in cache
-		return "Bearer %s" % self._token["access_token"]
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from demolib.config import credentials, dataset, field
+from demolib.client import DictanovaAPIAuth, client
+from demolib.query import Aggregation, eq, term
+
+# Dataset and metadata fields, can be changed for another dataset (see demolib/config.py)
+dataset_id = dataset("5b2286583a35940001399b1a")
+
+# Top positive and negative opinions of the subcategory
+subcategory_query = {
+	"field": field("subcategory"),
+	"operator": "EQ",
+	"value": "Couches Bébé"
+}
+TOP_POSITIVE_OPINIONS = {
+	"url": "https://api.dictanova.io/v1/search/datasets/%s/terms?opinions=POSITIVE" % dataset_id,
+	"json": subcategory_query
+}
+TOP_NEGATIVE_OPINIONS = {
+	"url": "https://api.dictanova.io/v1/search/datasets/%s/terms?opinions=NEGATIVE" % dataset_id,
+	"json": subcategory_query
+}
+
+# Requests not depending on other responses, prefetched by dictanova-demo.py run
+# (see demolib/usecases.py)
+FETCHES = [TOP_POSITIVE_OPINIONS, TOP_NEGATIVE_OPINIONS]
 
 if __name__ == "__main__":
+	# Heavy imports only when the use case runs, not when its FETCHES are read
+	import pandas as pd
+	import numpy as np
+	from demolib.interning import intern_table, decode_frame
+	
 	# Prepare Auth handler with API client id and secret
 	# https://docs.dictanova.io/docs/authentication-and-security
-	clientId, clientSecret = open("../credentials", "r").readline().strip().split(";")
+	clientId, clientSecret = credentials()
 	dictanova_auth = DictanovaAPIAuth(clientId, clientSecret)
-	
+	# Responses are memoized and shared with the use cases run in the same process
+	api = client()
+
 	################################################################ TOP POLARIZED TERMS
-	query = {
-		"field": "metadata.subcategory",
-		"operator": "EQ",
-		"value": "Couches Bébé"
-	}
 	# Get top positive and negative opinions
-	r_pos = requests.post(
-		"https://api.dictanova.io/v1/search/datasets/5b2286583a35940001399b1a/terms?opinions=POSITIVE",
-		json=query,
-		auth=dictanova_auth)
-	r_neg = requests.post(
-		"https://api.dictanova.io/v1/search/datasets/5b2286583a35940001399b1a/terms?opinions=NEGATIVE",
-		json=query,
-		auth=dictanova_auth)
-	top_pos = {op["id"]:op["occurrences"] for op in r_pos.json()["items"]}
-	top_neg = {op["id"]:op["occurrences"] for op in r_neg.json()["items"]}
-	top_polarized = [op for op in top_pos if op in top_neg]
-	print("Selected %d top opinions: %s" % (len(top_polarized), ",".join(top_polarized)))
+	r_pos = api.post(auth=dictanova_auth, **TOP_POSITIVE_OPINIONS)
+	r_neg = api.post(auth=dictanova_auth, **TOP_NEGATIVE_OPINIONS)
+	# Opinions are interned as int32 codes, labels are only decoded for display
+	table = intern_table(dataset_id)
+	opinions = table["opinion"]
+	top_pos = pd.Series(
+		[op["occurrences"] for op in r_pos.json()["items"]],
+		index=opinions.encode(op["id"] for op in r_pos.json()["items"]))
+	top_neg = pd.Series(
+		[op["occurrences"] for op in r_neg.json()["items"]],
+		index=opinions.encode(op["id"] for op in r_neg.json()["items"]))
+	top_polarized = top_pos.index[top_pos.index.isin(top_neg.index)]
+	print("Selected %d top opinions: %s" % (len(top_polarized), ",".join(opinions.decode(top_polarized))))
 	
 	############################################################ COMPUTE CSAT PER OPINION
-	csat = {}
-	query = {
-		"type": "CSAT",
-		"field": "metadata.note_moyenne",
-		"query": {
-			"operator": "AND",
-			"criteria": [
-				{
-					"field": "metadata.subcategory",
-					"operator": "EQ",
-					"value": "Couches Bébé"
-				}, {
-					"field": "TERMS",
-					"operator": "EQ",
-					"value": None
-				}
-			]
-		}
-	}
-	for opinion in top_polarized:
+	csat = pd.Series(dtype=np.float64)
+	# Queries are immutable, one is derived per opinion (see demolib/query.py)
+	subcategory = eq(field("subcategory"), "Couches Bébé")
+	csat_query = Aggregation("CSAT", field("note_moyenne")).where(subcategory)
+	for code in top_polarized:
+		opinion = opinions.label(code)
 		# Build specific query
 		print("Query for %s:" % opinion)
-		query["query"]["criteria"][1]["value"] = opinion
-		print(json.dumps(query, indent=4, sort_keys=False))	
+		query = csat_query.where(term(opinion))
+		print(query.dumps(indent=4))
 		# Requests
-		r = requests.post(
-			"https://api.dictanova.io/v1/aggregation/datasets/5b2286583a35940001399b1a/documents",
+		r = api.post(
+			"https://api.dictanova.io/v1/aggregation/datasets/%s/documents" % dataset_id,
 			json=query,
 			auth=dictanova_auth)
 		print(r)
 		# Add results
-		csat[opinion] = r.json()["periods"][0]["total"]["value"]
+		csat[code] = r.json()["periods"][0]["total"]["value"]
 	
 	##################################################################### PREPARE RESULTS
 	# Build dataframe
-	df = pd.concat([
-			pd.DataFrame.from_dict(csat, orient="index"),
-			pd.DataFrame.from_dict(top_pos, orient="index"),
-			pd.DataFrame.from_dict(top_neg, orient="index")
-		], axis="columns", join='inner')
+	df = pd.concat([csat, top_pos, top_neg], axis="columns", join='inner')
 	df.columns = ["csat", "vol_pos", "vol_neg"]
+	df.index.name = "opinion"
 	# Compute polarity ratio
 	df["polarity_vol"] = df["vol_pos"] + df["vol_neg"]
 	df["polarity_ratio"] = (df["vol_pos"] / df["polarity_vol"]) - (df["vol_neg"] / df["polarity_vol"])
 	
 	##################################################################### DISPLAY RESULTS
+	df = decode_frame(df, ["opinion"], table)
 	
 	# Pretty print results
 	print("Relation between polarity and satisfaction score on top opinions:")
@@ -132,6 +111,6 @@ if __name__ == "__main__":
 		alpha=0.5)
 	for row in df.iterrows():
 		ax.annotate(row[0], (row[1]["polarity_ratio"], row[1]["csat"]))
-	plt.show()
+	plt.savefig("uc4-llosa-matrix.png")
 	
 	
\ No newline at end of file
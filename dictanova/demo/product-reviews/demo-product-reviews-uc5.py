@@ -5,61 +5,30 @@ This script implements the fourth use case:
 Attention points per brand.
 """
 
-import pandas as pd
-import requests, json
-import numpy as np
-import sys
+import json
+import sys, os
 
-class DictanovaAPIAuth(requests.auth.AuthBase):
-	"""Attaches Dictanova Bearer Authentication to the given Request object."""
-	
-	def __init__(self, id, secret):
-		self.apiclient_id = id
-		self.apiclient_secret = secret
-		self._token = None
-	
-	def __eq__(self, other):
-		return all([
-			self.apiclient_id == getattr(other, 'apiclient_id', None),
-			self.apiclient_secret == getattr(other, 'apiclient_secret', None)
-		])
-	
-	def __ne__(self, other):
-		return not self == other
-	
-	def __call__(self, r):
-		r.headers['Authorization'] = self.get_token()
-		return r
-	
-	def get_token(self):
-		# Get authentication token
-		if self._token is None:
-			payload = {
-				"clientId": self.apiclient_id,
-				"clientSecret": self.apiclient_secret
-			}
-			r = requests.post("https://api.dictanova.io/v1/token", json=payload)
-			self._token = r.json()
-		# Always use the one in cache
-		return "Bearer %s" % self._token["access_token"]
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from demolib.render import ChartSpec, render_charts
+from demolib.config import credentials, dataset, field
+from demolib.client import DictanovaAPIAuth, client
 
-if __name__ == "__main__":
-	# Prepare Auth handler with API client id and secret
-	# https://docs.dictanova.io/docs/authentication-and-security
-	clientId, clientSecret = open("../credentials", "r").readline().strip().split(";")
-	dictanova_auth = DictanovaAPIAuth(clientId, clientSecret)
-	
-	#################################### TOP NEGATIVE OPINIONS FROM DETRACTORS PER BRAND
-	query = {
+# Dataset and metadata fields, can be changed for another dataset (see demolib/config.py)
+dataset_id = dataset("5b2286583a35940001399b1a")
+
+# Top negative opinions of the detractors per brand
+TOP_NEGATIVE_OPINIONS_PER_BRAND = {
+	"url": "https://api.dictanova.io/v1/aggregation/datasets/%s/documents" % dataset_id,
+	"json": {
 		"type": "COUNT",
 		"field": "createdAt",
 		"query": {
-			"field": "metadata.recommande",
+			"field": field("recommande"),
 			"operator": "EQ",
 			"value": "Ne recommande pas"
 		},
 		"dimensions": [{
-				"field": "metadata.marque",
+				"field": field("marque"),
 				"group": "DISTINCT"
 			}, {
 				"field": "TERMS",
@@ -71,13 +40,30 @@ if __name__ == "__main__":
 			}
 		]
 	}
+}
+
+# Requests not depending on other responses, prefetched by dictanova-demo.py run
+# (see demolib/usecases.py)
+FETCHES = [TOP_NEGATIVE_OPINIONS_PER_BRAND]
+
+if __name__ == "__main__":
+	# Heavy imports only when the use case runs, not when its FETCHES are read
+	import pandas as pd
+	import numpy as np
+	
+	# Prepare Auth handler with API client id and secret
+	# https://docs.dictanova.io/docs/authentication-and-security
+	clientId, clientSecret = credentials()
+	dictanova_auth = DictanovaAPIAuth(clientId, clientSecret)
+	# Responses are memoized and shared with the use cases run in the same process
+	api = client()
+
+	#################################### TOP NEGATIVE OPINIONS FROM DETRACTORS PER BRAND
+	query = TOP_NEGATIVE_OPINIONS_PER_BRAND["json"]
 	print("Query:")
 	print(json.dumps(query, indent=4, sort_keys=False))
 	# Requests
-	r = requests.post(
-		"https://api.dictanova.io/v1/aggregation/datasets/5b2286583a35940001399b1a/documents",
-		json=query,
-		auth=dictanova_auth)
+	r = api.post(auth=dictanova_auth, **TOP_NEGATIVE_OPINIONS_PER_BRAND)
 	print(r)
 	
 	##################################################################### PREPARE RESULTS
@@ -90,37 +76,19 @@ if __name__ == "__main__":
 	df.sort_values(by=["brand", "value"], axis="index", ascending=False, inplace=True)
 
 	##################################################################### DISPLAY RESULTS
-	# Word cloud
+	# Word cloud per brand, rendered in a worker process
 	# pip3 install wordcloud
-	import math
-	from wordcloud import WordCloud
-	import matplotlib.pyplot as plt
-	from matplotlib import colors
-	onlyred = colors.ListedColormap(['orangered'])
-	brands = list(df["brand"].unique())
-	row = math.ceil(math.sqrt(len(brands)))
-	col = math.floor(math.sqrt(len(brands)))
-	fig, axis = plt.subplots(row, col)
-	fig.tight_layout()
-	for i, brand in enumerate(brands):
+	grid = []
+	for brand in df["brand"].unique():
 		# Pretty print results
 		print("Attention points for brand '%s':" % brand)
 		print(df[df["brand"]==brand])
 		# Compute word distribution for wordcloud
 		wc_freq = {row.opinion:row.volume for row in df[df["brand"]==brand].itertuples()}
-		wc = WordCloud(
-			prefer_horizontal=1, 
-			font_path='Geomanist-Regular.otf',
-			background_color="white", 
-			colormap=onlyred)
-		wordcloud = wc.fit_words(wc_freq)
-		# Add to subfig
-		r = i//col
-		c = i%col
-		axis[r][c].imshow(wordcloud)
-		axis[r][c].set_title(brand)
-		axis[r][c].axis("off")
+		grid.append((brand, wc_freq))
 	# Render
-	plt.show()
+	render_charts([ChartSpec("wordcloud_grid", grid, "uc5-attention-points-per-brand.png", {
+			"color": "orangered",
+			"wordcloud": {"font_path": 'Geomanist-Regular.otf'}
+		})])
 	
-	
\ No newline at end of file
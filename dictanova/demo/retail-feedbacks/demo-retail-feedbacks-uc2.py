@@ -5,133 +5,72 @@ UC#02: Main critics
 Extract the main critics from the customers (top negative opinions)
 """
 
-import pandas as pd
-import requests, json, re, sys
-import numpy as np
-from wordcloud import WordCloud # pip3 install wordcloud
-import matplotlib.pyplot as plt
-from matplotlib import colors
+import json, re, sys
+import os
 
-class DictanovaAPIAuth(requests.auth.AuthBase):
-	"""Attaches Dictanova Bearer Authentication to the given Request object."""
-	
-	def __init__(self, id, secret):
-		self.apiclient_id = id
-		self.apiclient_secret = secret
-		self._token = None
-	
-	def __eq__(self, other):
-		return all([
-			self.apiclient_id == getattr(other, 'apiclient_id', None),
-			self.apiclient_secret == getattr(other, 'apiclient_secret', None)
-		])
-	
-	def __ne__(self, other):
-		return not self == other
-	
-	def __call__(self, r):
-		r.headers['Authorization'] = self.get_token()
-		return r
-	
-	def get_token(self):
-		# Get authentication token
-		if self._token is None:
-			payload = {
-				"clientId": self.apiclient_id,
-				"clientSecret": self.apiclient_secret
-			}
-			r = requests.post("https://api.dictanova.io/v1/token", json=payload)
-			self._token = r.json()
-		# Always use the one in cache
-		return "Bearer %s" % self._token["access_token"]
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from demolib.render import ChartSpec, render_charts
+from demolib.config import credentials, dataset, metadata_code
+from demolib.client import DictanovaAPIAuth, client
+from demolib.pagination import paginate
 
-def searchresult2html(output, documents, only=None, meta=None):
+def searchresult2html(output, documents, only=None, meta=None, enrichments=None):
 	"""
 	Generate an html file to highlight semantic enrichments.
 	
 	output: path to the html file generated
-	documents: list of the documents (items in search result)
+	documents: list (or iterator) of the documents (items in search result)
 	only: if specified, the highlith will be limited to only the opinion id in parameter
 	meta: a list of metadata to display, if None they no metadata displayed
+	enrichments: EnrichmentArrays of the documents, read from each document if None
 	"""
 	with open(output, "w", encoding="utf-8") as fout:
-		# colormap
-		colormap = {
-			"POSITIVE": "LightGreen",
-			"NEGATIVE": "LightCoral",
-			"NEUTRAL": "LightGray"
-		}
-		# header
-		fout.write("<!DOCTYPE html>\n")
-		fout.write("<html lang=\"en\">\n")
-		fout.write("<head>\n<meta charset=\"utf-8\">\n<title>json2html</title>\n</head>\n")
-		fout.write("<body style=\"font-family : geomanist; padding:30px; \">\n");
-		fout.write("<ul style=\"list-style:none;\">\n");
-		# Each document
-		for doc in documents:
-			# Select enrichments and sort by offset
-			if only is None:
-				opinions = doc["enrichments"]
-			else:
-				opinions = [e for e in doc["enrichments"] if e["term"]==only]
-			opinions = sorted(opinions, key=lambda e: e["offset"]["begin"])
-			# Build html
-			fout.write("<li style=\"margin-bottom:20px; border:1px solid gray; padding:10px;\">\n")
-			fout.write("<h3>%s</h3>\n" % doc["externalId"])
-			if not meta is None:
-				fout.write("<ul style=\"list-style:none\">\n")
-				mtuples = [(m["code"], m["value"]) for m in doc["metadata"] if m["code"] in meta]
-				for code,value in mtuples:
-					fout.write("<li style=\"display: inline; font-size: 75%%; font-color: grey\">%s=%s</li>\n" % (code, value))
-				fout.write("</ul><br />\n")
-			curr_opinion = None
-			next_opinion = 0
-			fout.write("<p>\n")
-			for i,c in enumerate(doc["content"]):
-				# handle highlighting
-				if (not curr_opinion is None) and (i >= curr_opinion["offset"]["end"]):
-					curr_opinion = None
-					fout.write("</span>\n")
-				elif (next_opinion<len(opinions)) and (opinions[next_opinion]["offset"]["begin"]==i):
-					curr_opinion = opinions[next_opinion]
-					next_opinion += 1
-					if not curr_opinion is None:
-						fout.write("<span style=\"background-color: %s\">\n" % colormap[ curr_opinion["opinion"] ])
-				# add content
-				if c != "\n":
-					fout.write(c)
-				else:
-					fout.write("</ br>\n")
-			fout.write("</p></li>\n")
-		# footer
-		fout.write("</ul>\n</body>\n</html>\n")
+		write_html(fout, documents, only=only, meta=meta, enrichments=enrichments)
+
+# Dataset and metadata fields, can be changed for another dataset (see demolib/config.py)
+dataset_id = dataset("5b55b264dbcd8100019f0495")
+
+# Top negative opinions
+TOP_NEGATIVE_OPINIONS = {
+	"url": "https://api.dictanova.io/v1/search/datasets/%s/terms?opinions=NEGATIVE" % dataset_id,
+	"data": "" # empty query
+}
+# Top 100 opinions, for their labels
+TOP100_OPINIONS = {
+	"url": "https://api.dictanova.io/v1/search/datasets/%s/terms" % dataset_id,
+	"data": "", # empty query
+	"params": {"page": 1, "pageSize": 100}
+}
+
+# Requests not depending on other responses, prefetched by dictanova-demo.py run
+# (see demolib/usecases.py)
+FETCHES = [TOP_NEGATIVE_OPINIONS, TOP100_OPINIONS]
 
 if __name__ == "__main__":
+	# Heavy imports only when the use case runs, not when its FETCHES are read
+	import pandas as pd
+	import numpy as np
+	from demolib.interning import intern_table
+	from demolib.enrichments import EnrichmentArrays
+	from demolib.highlight import write_html
+	from demolib.cooccurrence import CooccurrenceEngine
+	
 	# Prepare Auth handler with API client id and secret
 	# https://docs.dictanova.io/docs/authentication-and-security
-	clientId, clientSecret = open("../credentials", "r").readline().strip().split(";")
+	clientId, clientSecret = credentials()
 	dictanova_auth = DictanovaAPIAuth(clientId, clientSecret)
-	
+	# Responses are memoized and shared with the use cases run in the same process
+	api = client()
+	terms = intern_table(dataset_id)["opinion"]
+
 	############################################################ TOP OPINION / WORDCLOUD
 	# Request for top negative opinions
-	r = requests.post(
-		"https://api.dictanova.io/v1/search/datasets/5b55b264dbcd8100019f0495/terms?opinions=NEGATIVE",
-		data="", # empty query
-		auth=dictanova_auth)
+	r = api.post(auth=dictanova_auth, **TOP_NEGATIVE_OPINIONS)
 	print(r)
 	top_opinions = r.json()['items']
 	
-	onlyred = colors.ListedColormap(['orangered'])
 	wc_freq = {opinion["label"]:opinion["occurrences"] for opinion in top_opinions}
-	wc = WordCloud(
-		prefer_horizontal=1, 
-		background_color="white", 
-		colormap=onlyred)
-	wordcloud = wc.fit_words(wc_freq)
-	plt.imshow(wordcloud)
-	plt.axis("off")
-	#plt.show()
-	plt.savefig("uc2-top-criticisms.png", bbox_inches='tight')
+	render_charts([ChartSpec("wordcloud", wc_freq, "uc2-top-criticisms.png", {"color": "orangered"})])
 	
 	############################################################### SEARCH FOR FEEDBACKS
 
@@ -146,50 +85,59 @@ if __name__ == "__main__":
 			"value": opinion["id"],
 			"opinion": "NEGATIVE"
 		}
-		r = requests.post(
-			"https://api.dictanova.io/v1/search/datasets/5b55b264dbcd8100019f0495/documents",
+		r = api.post(
+			"https://api.dictanova.io/v1/search/datasets/%s/documents" % dataset_id,
 			json=query,
 			auth=dictanova_auth)
+		documents = r.json()["items"]
+		enrichments = EnrichmentArrays.from_documents(documents, terms)
 		# Export as html files
 		fname = "uc2-search-%s.html"%opinion["label"]
 		print("\tExport search results as html: '%s'" % fname)
 		searchresult2html(
 			fname, 
-			r.json()["items"], 
+			documents, 
 			only=opinion["id"],
-			meta=["date_of_purchase", "rating_satisfaction", "category", "subcategory", "vendor", "shop"])
+			meta=[metadata_code(m) for m in ["date_of_purchase", "rating_satisfaction", "category", "subcategory", "vendor", "shop"]],
+			enrichments=enrichments)
 
 	################################################################ ASSOCIATED OPINIONS
 	
-	neutral_map = colors.ListedColormap(['darkblue'])
+	# Mirror the feedbacks containing any of the top criticisms, the co-occurrences are
+	# then computed locally instead of one request per criticism
+	print("Mirror feedbacks that contain the top criticisms")
+	query = {
+		"field": "TERMS",
+		"operator": "IN",
+		"value": [opinion["id"] for opinion in top_opinions],
+		"opinion": "NEGATIVE"
+	}
+	# The page size is tuned (see demolib/pagination.py)
+	documents = paginate(api,
+		"https://api.dictanova.io/v1/search/datasets/%s/documents" % dataset_id,
+		json=query, # https://docs.dictanova.io/docs/pagination
+		auth=dictanova_auth)
+	print("\t%d feedbacks" % len(documents))
+	cooccurrences = CooccurrenceEngine(EnrichmentArrays.from_documents(documents, terms, strip=True))
+	# Labels of the most frequent opinions, the id is displayed for the others
+	r = api.post(auth=dictanova_auth, **TOP100_OPINIONS)
+	labels = {op["id"]:op["label"] for op in r.json()["items"] + top_opinions}
 	
 	print("Extract opinions associated with each top 10 criticisms")
+	charts = []
 	for i, opinion in enumerate(top_opinions[:10]):
 		# Pretty print results
 		print("\n\n#%02d [%2d occ.]\t%s" % (i+1, opinion["occurrences"], opinion["id"]))
-		query = {
-			"field": "TERMS",
-			"operator": "EQ",
-			"value": opinion["id"],
-			"opinion": "NEGATIVE"
-		}
 		# Top cooccurrences
-		r = requests.post(
-			"https://api.dictanova.io/v1/search/datasets/5b55b264dbcd8100019f0495/terms",
-			json=query,
-			auth=dictanova_auth)
-		print("\t%s" % r)
+		associated = cooccurrences.associated(opinion["id"], polarity="NEGATIVE", top=50)
 		# Wordcloud
-		wc_freq = {op["label"]:op["occurrences"] for op in r.json()["items"] if op["id"]!=opinion["id"]}
-		wc = WordCloud(
-			prefer_horizontal=1, 
-			background_color="white", 
-			colormap=neutral_map)
-		wordcloud = wc.fit_words(wc_freq)
-		plt.imshow(wordcloud)
-		plt.title("Opinions mainly associated with criticism '%s'" % opinion["label"])
-		plt.axis("off")
-		#plt.show()
-		print("\tExport associated opinions as wordcloud")
-		plt.savefig("uc2-opinions-associated-with%s.png"%opinion["label"], bbox_inches='tight')
+		wc_freq = {labels.get(term, term):occ for term,occ in associated}
+		charts.append(ChartSpec("wordcloud", wc_freq,
+			"uc2-opinions-associated-with%s.png"%opinion["label"], {
+				"title": "Opinions mainly associated with criticism '%s'" % opinion["label"],
+				"color": "darkblue"
+			}))
+	# All the clouds in one batch, with warm word cloud instances
+	print("\tExport associated opinions as wordclouds")
+	render_charts(charts)
 
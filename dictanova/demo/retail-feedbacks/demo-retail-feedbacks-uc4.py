@@ -5,78 +5,84 @@ UC#04: Detailed NPS
 What's behind my NPS
 """
 
-import pandas as pd
-import requests, json, re, sys
-import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib import colors
+import json, re, sys, os
 
-class DictanovaAPIAuth(requests.auth.AuthBase):
-	"""Attaches Dictanova Bearer Authentication to the given Request object."""
-	
-	def __init__(self, id, secret):
-		self.apiclient_id = id
-		self.apiclient_secret = secret
-		self._token = None
-	
-	def __eq__(self, other):
-		return all([
-			self.apiclient_id == getattr(other, 'apiclient_id', None),
-			self.apiclient_secret == getattr(other, 'apiclient_secret', None)
-		])
-	
-	def __ne__(self, other):
-		return not self == other
-	
-	def __call__(self, r):
-		r.headers['Authorization'] = self.get_token()
-		return r
-	
-	def get_token(self):
-		# Get authentication token
-		if self._token is None:
-			payload = {
-				"clientId": self.apiclient_id,
-				"clientSecret": self.apiclient_secret
-			}
-			r = requests.post("https://api.dictanova.io/v1/token", json=payload)
-			self._token = r.json()
-		# Always use the one in cache
-		return "Bearer %s" % self._token["access_token"]
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from demolib.config import credentials, dataset, field
+from demolib.client import DictanovaAPIAuth, client
+from demolib.query import distribution_query
+
+# Dataset and metadata fields, can be changed for another dataset (see demolib/config.py)
+dataset_id = dataset("5b55b264dbcd8100019f0495")
+
+# Distributions of rating_nps for the top 10 opinions and for the top 10 opinions by
+# polarity: NPS and its groups are derived locally (see demolib/metrics.py), the global
+# NPS is the total of the queries
+url = "https://api.dictanova.io/v1/aggregation/datasets/%s/documents" % dataset_id
+NPS_DISTRIBUTION_PER_OPINION = {
+	"url": url,
+	"json": distribution_query(field("rating_nps"), [
+		{
+			"field": "TERMS",
+			"group": "DISTINCT",
+			"limit": 10
+		}
+	], metric="NPS")
+}
+NPS_DISTRIBUTION_PER_OPINION_POLARITY = {
+	"url": url,
+	"json": distribution_query(field("rating_nps"), [
+		{
+			"field": "TERMS",
+			"group": "DISTINCT",
+			"limit": 10
+		}, {
+			"field": "TERMS_POLARITY",
+			"group": "DISTINCT"
+		}
+	], metric="NPS")
+}
+
+# Requests not depending on other responses, prefetched by dictanova-demo.py run
+# (see demolib/usecases.py)
+FETCHES = [NPS_DISTRIBUTION_PER_OPINION, NPS_DISTRIBUTION_PER_OPINION_POLARITY]
+
+def fetch_distribution(api, fetch, auth):
+	"""
+	Distribution of the response of a fetch and its total, the global NPS.
+	Raises requests.HTTPError if the request failed.
+	"""
+	from demolib.metrics import Distribution
+	r = api.post(auth=auth, **fetch)
+	r.raise_for_status()
+	return Distribution.from_response(r.json(), "volume"), r.json()["periods"][0]["total"]["value"]
 
 if __name__ == "__main__":
+	# Heavy imports only when the use case runs, not when its FETCHES are read
+	import pandas as pd
+	import numpy as np
+	
 	# Prepare Auth handler with API client id and secret
 	# https://docs.dictanova.io/docs/authentication-and-security
-	clientId, clientSecret = open("../credentials", "r").readline().strip().split(";")
+	clientId, clientSecret = credentials()
 	dictanova_auth = DictanovaAPIAuth(clientId, clientSecret)
+	# Responses are memoized and shared with the use cases run in the same process
+	api = client()
 
 	################################################ NPS PER TOP OPINION
 	print("NPS per top opinion")
 	print("\tquery")
-	# Compute the NPS for the top 10 opinions
-	query = {
-		"type": "NPS",
-		"field": "metadata.rating_nps",
-		"dimensions": [
-			{
-				"field": "TERMS",
-				"group": "DISTINCT",
-				"limit": 10
-			}
-		]
-	}
-	r = requests.post(
-			"https://api.dictanova.io/v1/aggregation/datasets/5b55b264dbcd8100019f0495/documents",
-			json=query,
-			auth=dictanova_auth)
-	print("\t%s"%r)
+	# Distributions of rating_nps for the top 10 opinions and global NPS
+	distr_opinion, ref_nps = fetch_distribution(api, NPS_DISTRIBUTION_PER_OPINION, dictanova_auth)
 	# Load in pandas
 	print("\tprepare")
-	df = pd.io.json.json_normalize(r.json()["periods"][0]["values"])
-	df["opinion"] = df["dimensions"].apply(lambda x: x[0])
-	df["var_nps"] = df["value"] - r.json()["periods"][0]["total"]["value"]
+	df_metrics = distr_opinion.frame(["opinion"])
+	df = df_metrics[["opinion", "nps"]].rename(columns={"nps": "value"})
+	df["var_nps"] = df["value"] - ref_nps
 	df.sort_values("value", ascending=True, inplace=True)
-	# Plot absolute NPS
+	# Plot absolute NPS, matplotlib is only loaded once the data is there
+	import matplotlib.pyplot as plt
+	from matplotlib import colors
 	print("\trender absolute")
 	df.plot.barh(
 		x="opinion", y="value",
@@ -84,7 +90,6 @@ if __name__ == "__main__":
 		colormap=colors.ListedColormap(['darkblue'])
 	)
 	plt.savefig("uc4-nps-per-top10-opinions.png")
-	plt.show()
 	# Plot var NPS
 	print("\trender variations")
 	df.plot.barh(
@@ -93,44 +98,15 @@ if __name__ == "__main__":
 		colormap=colors.ListedColormap(['darkblue'])
 	)
 	plt.savefig("uc4-nps-variation-per-top10-opinions.png")
-	plt.show()
 
 	########################################### NPS DETAILS PER TOP OPINION
 	# Compute the NPS detail for the top 10 opinions
 	print("NPS detail per top opinion")
-	print("\tquery")
-	query = {
-		"type": "NPS",
-		"field": "metadata.rating_nps",
-		"dimensions": [
-			{
-				"field": "TERMS",
-				"group": "DISTINCT",
-				"limit": 10
-			}, {
-				"field": "metadata.rating_nps",
-				"group": "NPS_GROUP"
-			}
-		]
-	}
-	r = requests.post(
-			"https://api.dictanova.io/v1/aggregation/datasets/5b55b264dbcd8100019f0495/documents",
-			json=query,
-			auth=dictanova_auth
-	)
-	print("\t%s"%r)
-	# Load in pandas
+	# Same distributions as above, no request
 	print("\tprepare")
-	df = pd.io.json.json_normalize(r.json()["periods"][0]["values"])
-	df["opinion"] = df["dimensions"].apply(lambda x: x[0])
-	df["nps_range"] = df["dimensions"].apply(lambda x: x[1])
-	df = df.pivot_table(index="opinion", columns="nps_range", values="volume")
-	df.fillna(0, inplace=True) # nan values are 0
+	df = df_metrics.set_index("opinion")[["promoters","passives","detractors","nps"]].copy()
 	df["total"] = df[["promoters","detractors","passives"]].sum(axis="columns")
-	df["perc_pro"] = 100. * df["promoters"]/df["total"]
-	df["perc_det"] = 100. * df["detractors"]/df["total"]
-	df["nps"] = df["perc_pro"] - df["perc_det"]
-	df["var_nps"] = df["nps"] - r.json()["periods"][0]["total"]["value"]
+	df["var_nps"] = df["nps"] - ref_nps
 	df["var_color"] = df["var_nps"].apply(lambda x: {True: "seagreen", False: "orangered"}[x>=0])
 	df.sort_values("nps", ascending=True, inplace=True)
 	# Plot detailed NPS
@@ -143,7 +119,6 @@ if __name__ == "__main__":
 		colormap=colors.ListedColormap(['orangered','gold','seagreen'])
 	)
 	plt.savefig("uc4-nps-detailed-per-top10-opinions.png")
-	plt.show()
 	# Plot NPS variation
 	print("\trender variations")
 	ax = df.plot.scatter(
@@ -156,7 +131,6 @@ if __name__ == "__main__":
 	for r in df.itertuples():
 		ax.annotate(r.Index, (r.var_nps,r.nps))
 	plt.savefig("uc4-nps-detailed-variation-per-top10-opinions.png")
-	plt.show()
 	# Save NPS per opinion of next step
 	df_nps_opinion = df["nps"]
 
@@ -164,32 +138,12 @@ if __name__ == "__main__":
 	# Compute the NPS for the top 10 opinions by polarity
 	print("NPS per top opinion with polarity")
 	print("\tquery")
-	query = {
-		"type": "NPS",
-		"field": "metadata.rating_nps",
-		"dimensions": [
-			{
-				"field": "TERMS",
-				"group": "DISTINCT",
-				"limit": 10
-			}, {
-				"field": "TERMS_POLARITY",
-				"group": "DISTINCT"
-			}
-		]
-	}
-	r = requests.post(
-			"https://api.dictanova.io/v1/aggregation/datasets/5b55b264dbcd8100019f0495/documents",
-			json=query,
-			auth=dictanova_auth)
-	print("\t%s"%r)
+	distr_polarity, ref_nps = fetch_distribution(api, NPS_DISTRIBUTION_PER_OPINION_POLARITY, dictanova_auth)
 	# Load in pandas
 	print("\tprepare")
-	df = pd.io.json.json_normalize(r.json()["periods"][0]["values"])
-	df["opinion"] = df["dimensions"].apply(lambda x: x[0])
-	df["polarity"] = df["dimensions"].apply(lambda x: x[1])
-	df = df.pivot_table(index="opinion", columns="polarity", values="value")
-	df["ref_nps_global"] = r.json()["periods"][0]["total"]["value"]
+	df = distr_polarity.frame(["opinion", "polarity"])
+	df = df.pivot_table(index="opinion", columns="polarity", values="nps")
+	df["ref_nps_global"] = ref_nps
 	df["var_npsg_pos"] = df["POSITIVE"] - df["ref_nps_global"]
 	df["var_npsg_neg"] = df["NEGATIVE"] - df["ref_nps_global"]
 	df["var_npsg_neu"] = df["NEUTRAL"] - df["ref_nps_global"]
@@ -207,7 +161,6 @@ if __name__ == "__main__":
 	)
 	ax.legend(labels=["Positive", "Negative", "Neutral"])
 	plt.savefig("uc4-global-nps-variation-per-top10-opinions-with-polarity.png")
-	plt.show()
 	# Plot local NPS variation per opinion and per polarity
 	print("\trender variation with local NPS (opinion)")
 	ax = df.plot.barh(
@@ -218,4 +171,3 @@ if __name__ == "__main__":
 	)
 	ax.legend(labels=["Positive", "Negative", "Neutral"]) 
 	plt.savefig("uc4-local-nps-variation-per-top10-opinions-with-polarity.png")
-	plt.show()
\ No newline at end of file
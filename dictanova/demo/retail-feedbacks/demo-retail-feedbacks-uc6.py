@@ -5,70 +5,35 @@ UC#06: Evolution over time
 How opinions evolve over time?
 """
 
-import pandas as pd
-import requests, json
-import numpy as np
-import sys
-import math
-from wordcloud import WordCloud
-import matplotlib.pyplot as plt
-from matplotlib import colors
+import json
+import sys, os
 
-class DictanovaAPIAuth(requests.auth.AuthBase):
-	"""Attaches Dictanova Bearer Authentication to the given Request object."""
-	
-	def __init__(self, id, secret):
-		self.apiclient_id = id
-		self.apiclient_secret = secret
-		self._token = None
-	
-	def __eq__(self, other):
-		return all([
-			self.apiclient_id == getattr(other, 'apiclient_id', None),
-			self.apiclient_secret == getattr(other, 'apiclient_secret', None)
-		])
-	
-	def __ne__(self, other):
-		return not self == other
-	
-	def __call__(self, r):
-		r.headers['Authorization'] = self.get_token()
-		return r
-	
-	def get_token(self):
-		# Get authentication token
-		if self._token is None:
-			payload = {
-				"clientId": self.apiclient_id,
-				"clientSecret": self.apiclient_secret
-			}
-			r = requests.post("https://api.dictanova.io/v1/token", json=payload)
-			self._token = r.json()
-		# Always use the one in cache
-		return "Bearer %s" % self._token["access_token"]
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from demolib.render import ChartSpec, render_charts
+from demolib.config import credentials, dataset, field, period
+from demolib.client import DictanovaAPIAuth, client
 
-if __name__ == "__main__":
-	# Prepare Auth handler with API client id and secret
-	# https://docs.dictanova.io/docs/authentication-and-security
-	clientId, clientSecret = open("../credentials", "r").readline().strip().split(";")
-	dictanova_auth = DictanovaAPIAuth(clientId, clientSecret)
-	
-	################################################# OPINIONS COUNT OVER TIME
-	print("Volume of opinions over time")
-	print("\tquery")
-	query = {
+# Dataset and metadata fields, can be changed for another dataset (see demolib/config.py)
+dataset_id = dataset("5b55b264dbcd8100019f0495")
+period_from, period_to = period("2015-01-01T00:00:00Z", "2015-12-31T23:59:59Z")
+
+# Volume of the top 10 opinions per month, one query per month, only the open months once
+# stored (see demolib/timeseries.py)
+TOP10_OPINIONS_PER_MONTH = {
+	"url": "https://api.dictanova.io/v1/aggregation/datasets/%s/documents" % dataset_id,
+	"json": {
 		"type": "COUNT",
 		"field": "externalId",
 		"periods": [
 			{
-				"field": "metadata.date_of_purchase",
-				"from": "2015-01-01T00:00:00Z",
-				"to": "2015-12-31T23:59:59Z"
+				"field": field("date_of_purchase"),
+				"from": period_from,
+				"to": period_to
 			}
 		],
 		"dimensions" : [
 			{
-				"field": "metadata.date_of_purchase",
+				"field": field("date_of_purchase"),
 				"group": "MONTH"
 			}, {
 				"field": "TERMS",
@@ -76,49 +41,25 @@ if __name__ == "__main__":
 				"limit": 10
 			}
 		]
-	}
-	r = requests.post(
-		"https://api.dictanova.io/v1/aggregation/datasets/5b55b264dbcd8100019f0495/documents",
-		json=query,
-		auth=dictanova_auth)
-	print("\t%s" % r)
-	
-	# Prepare data
-	print("\tprepare data")
-	df = pd.io.json.json_normalize(r.json()["periods"][0]["values"])
-	df["month"] = df["dimensions"].apply(lambda x: x[0])
-	df["opinion"] = df["dimensions"].apply(lambda x: x[1])
-	df = df.pivot_table(index="month", columns="opinion", values="volume")
-	df.fillna(0, inplace=True) # approx
-
-	# Plot top 5 over period
-	print("\trender")
-	df.plot.line(
-		y=df.sum().sort_values(ascending=False).iloc[:5].index,
-		title="Volume of top opinions over time",
-	)
-	plt.savefig(
-		"uc6-evolution-volume-opinions.png",
-		bbox_inches="tight"
-	)
-	plt.clf()
-
-	######################################## OPINIONS COUNT OVER TIME WITH POLARITY
-	print("Volume of opinions over time with polarity")
-	print("\tquery")
-	query = {
+	},
+	"shard": "MONTH"
+}
+# Same with polarity
+TOP10_OPINIONS_PER_MONTH_POLARITY = {
+	"url": "https://api.dictanova.io/v1/aggregation/datasets/%s/documents" % dataset_id,
+	"json": {
 		"type": "COUNT",
 		"field": "externalId",
 		"periods": [
 			{
-				"field": "metadata.date_of_purchase",
-				"from": "2015-01-01T00:00:00Z",
-				"to": "2015-12-31T23:59:59Z"
+				"field": field("date_of_purchase"),
+				"from": period_from,
+				"to": period_to
 			}
 		],
 		"dimensions" : [
 			{
-				"field": "metadata.date_of_purchase",
+				"field": field("date_of_purchase"),
 				"group": "MONTH"
 			}, {
 				"field": "TERMS",
@@ -129,64 +70,25 @@ if __name__ == "__main__":
 				"group": "DISTINCT"
 			}
 		]
-	}
-	r = requests.post(
-		"https://api.dictanova.io/v1/aggregation/datasets/5b55b264dbcd8100019f0495/documents",
-		json=query,
-		auth=dictanova_auth)
-	print("\t%s" % r)
-	
-	# Prepare data
-	print("\tprepare data")
-	df = pd.io.json.json_normalize(r.json()["periods"][0]["values"])
-	df["month"] = df["dimensions"].apply(lambda x: x[0])
-	df["opinion"] = df["dimensions"].apply(lambda x: x[1])
-	df["polarity"] = df["dimensions"].apply(lambda x: x[2])
-	df.fillna(0, inplace=True) # approx
-	df = df.pivot_table(index=["opinion", "month"], columns="polarity", values="volume")
-	df["POS_PERC"] = 100. * df["POSITIVE"] / df.sum(axis="columns")
-	df["NEG_PERC"] = 100. * df["NEGATIVE"] / df.sum(axis="columns")
-	df["NEU_PERC"] = 100. * df["NEUTRAL"] / df.sum(axis="columns")
-
-	# Plot
-	for opinion in df.index.levels[0]:
-		print("\trender volume '%s'" % opinion)
-		df.loc[opinion][["POSITIVE","NEGATIVE","NEUTRAL"]].plot.line(
-			title="Volume of '%s' per polarity over time" % opinion,
-			colormap=colors.ListedColormap(["seagreen", "orangered", "darkgrey"])
-		)
-		plt.savefig(
-			"uc6-evolution-volume-with-polarity-%s.png" % opinion,
-			bbox_inches="tight"
-		)
-		plt.clf()
-		print("\trender proportions '%s'" % opinion)
-		df.loc[opinion][["POS_PERC","NEG_PERC","NEU_PERC"]].plot.line(
-			title="Proporition of polarity for '%s' over time" % opinion,
-			colormap=colors.ListedColormap(["seagreen", "orangered", "darkgrey"])
-		)
-		plt.savefig(
-			"uc6-evolution-proportion-of-polarity-%s.png" % opinion,
-			bbox_inches="tight"
-		)
-		plt.clf()
-
-	######################################## NPS EVOLUTION PER OPINION
-	print("NPS per opinion over time")
-	print("\tquery")
-	query = {
+	},
+	"shard": "MONTH"
+}
+# NPS of the top 5 opinions per month
+NPS_TOP5_OPINIONS_PER_MONTH = {
+	"url": "https://api.dictanova.io/v1/aggregation/datasets/%s/documents" % dataset_id,
+	"json": {
 		"type": "NPS",
-		"field": "metadata.rating_nps",
+		"field": field("rating_nps"),
 		"periods": [
 			{
-				"field": "metadata.date_of_purchase",
-				"from": "2015-01-01T00:00:00Z",
-				"to": "2015-12-31T23:59:59Z"
+				"field": field("date_of_purchase"),
+				"from": period_from,
+				"to": period_to
 			}
 		],
 		"dimensions" : [
 			{
-				"field": "metadata.date_of_purchase",
+				"field": field("date_of_purchase"),
 				"group": "MONTH"
 			}, {
 				"field": "TERMS",
@@ -194,51 +96,25 @@ if __name__ == "__main__":
 				"limit": 5
 			}
 		]
-	}
-	r = requests.post(
-		"https://api.dictanova.io/v1/aggregation/datasets/5b55b264dbcd8100019f0495/documents",
-		json=query,
-		auth=dictanova_auth)
-	print("\t%s" % r)
-	
-	# Prepare data
-	print("\tprepare data")
-	df = pd.io.json.json_normalize(r.json()["periods"][0]["values"])
-	df["month"] = df["dimensions"].apply(lambda x: x[0])
-	df["opinion"] = df["dimensions"].apply(lambda x: x[1])
-	df.set_index(["opinion", "month"], inplace=True)
-	df.rename(columns={"value": "NPS"}, inplace=True)
-	df.drop(columns=["dimensions"], inplace=True)
-
-	# Plot over period
-	for opinion in df.index.levels[0]:
-		print("\trender '%s'" % opinion)
-		df.loc[opinion].plot.line(
-			title="NPS of '%s' over time" % opinion,
-			subplots=True
-		)
-		plt.savefig(
-			"uc6-evolution-nps-%s.png" % opinion,
-			bbox_inches="tight"
-		)
-		plt.clf()
-	
-	################################# NPS EVOLUTION PER OPINION WITH POLARITY
-	print("NPS per opinion over time with polarity")
-	print("\tquery")
-	query = {
+	},
+	"shard": "MONTH"
+}
+# Same with polarity
+NPS_TOP5_OPINIONS_PER_MONTH_POLARITY = {
+	"url": "https://api.dictanova.io/v1/aggregation/datasets/%s/documents" % dataset_id,
+	"json": {
 		"type": "NPS",
-		"field": "metadata.rating_nps",
+		"field": field("rating_nps"),
 		"periods": [
 			{
-				"field": "metadata.date_of_purchase",
-				"from": "2015-01-01T00:00:00Z",
-				"to": "2015-12-31T23:59:59Z"
+				"field": field("date_of_purchase"),
+				"from": period_from,
+				"to": period_to
 			}
 		],
 		"dimensions" : [
 			{
-				"field": "metadata.date_of_purchase",
+				"field": field("date_of_purchase"),
 				"group": "MONTH"
 			}, {
 				"field": "TERMS",
@@ -249,32 +125,127 @@ if __name__ == "__main__":
 				"group": "DISTINCT"
 			}
 		]
-	}
-	r = requests.post(
-		"https://api.dictanova.io/v1/aggregation/datasets/5b55b264dbcd8100019f0495/documents",
-		json=query,
-		auth=dictanova_auth)
+	},
+	"shard": "MONTH"
+}
+
+# Requests not depending on other responses, prefetched by dictanova-demo.py run
+# (see demolib/usecases.py)
+FETCHES = [TOP10_OPINIONS_PER_MONTH, TOP10_OPINIONS_PER_MONTH_POLARITY, NPS_TOP5_OPINIONS_PER_MONTH,
+	NPS_TOP5_OPINIONS_PER_MONTH_POLARITY]
+
+if __name__ == "__main__":
+	# Heavy imports only when the use case runs, not when its FETCHES are read
+	import pandas as pd
+	import numpy as np
+	from demolib.interning import intern_table, values_frame, decode_frame
+	from demolib.cube import OpinionCube
+	
+	# Prepare Auth handler with API client id and secret
+	# https://docs.dictanova.io/docs/authentication-and-security
+	clientId, clientSecret = credentials()
+	dictanova_auth = DictanovaAPIAuth(clientId, clientSecret)
+	# Responses are memoized and shared with the use cases run in the same process
+	api = client()
+	# Months and opinions are handled as int32 codes, labels decoded for display
+	table = intern_table(dataset_id)
+	opinions = table["opinion"]
+	# Charts are rendered at the end, in parallel
+	charts = []
+	
+	################################################# OPINIONS COUNT OVER TIME
+	print("Volume of opinions over time")
+	print("\tquery")
+	r = api.post(auth=dictanova_auth, **TOP10_OPINIONS_PER_MONTH)
 	print("\t%s" % r)
 	
 	# Prepare data
 	print("\tprepare data")
-	df = pd.io.json.json_normalize(r.json()["periods"][0]["values"])
-	df["month"] = df["dimensions"].apply(lambda x: x[0])
-	df["opinion"] = df["dimensions"].apply(lambda x: x[1])
-	df["polarity"] = df["dimensions"].apply(lambda x: x[2])
-	df = df.pivot_table(index=["opinion", "month"], columns="polarity", values="value")
+	df = values_frame(r.json()["periods"][0]["values"], ["month", "opinion"], table)
+	df = df.pivot_table(index="month", columns="opinion", values="volume")
+	df.fillna(0, inplace=True) # approx
+	df = decode_frame(df, ["month"], table).sort_index()
+	df.columns = opinions.decode(df.columns)
+
+	# Plot top 5 over period
+	charts.append(ChartSpec("plot", df[df.sum().sort_values(ascending=False).iloc[:5].index],
+		"uc6-evolution-volume-opinions.png", {
+			"plot": {"title": "Volume of top opinions over time"}
+		}))
+
+	######################################## OPINIONS COUNT OVER TIME WITH POLARITY
+	print("Volume of opinions over time with polarity")
+	print("\tquery")
+	r = api.post(auth=dictanova_auth, **TOP10_OPINIONS_PER_MONTH_POLARITY)
+	print("\t%s" % r)
+	
+	# Prepare data
+	print("\tprepare data")
+	cube = OpinionCube(terms=opinions)
+	cube.update_values(r.json()["periods"][0]["values"], "MONTH")
+	df = cube.pivot("volume", "MONTH").sort_index()
+	df.fillna(0, inplace=True) # approx
+	df["POS_PERC"] = 100. * df["POSITIVE"] / df.sum(axis="columns")
+	df["NEG_PERC"] = 100. * df["NEGATIVE"] / df.sum(axis="columns")
+	df["NEU_PERC"] = 100. * df["NEUTRAL"] / df.sum(axis="columns")
+
+	# Plot
+	for code in df.index.levels[0]:
+		opinion = opinions.label(code)
+		charts.append(ChartSpec("plot", df.loc[code][["POSITIVE","NEGATIVE","NEUTRAL"]],
+			"uc6-evolution-volume-with-polarity-%s.png" % opinion, {
+				"plot": {"title": "Volume of '%s' per polarity over time" % opinion},
+				"colors": ["seagreen", "orangered", "darkgrey"]
+			}))
+		charts.append(ChartSpec("plot", df.loc[code][["POS_PERC","NEG_PERC","NEU_PERC"]],
+			"uc6-evolution-proportion-of-polarity-%s.png" % opinion, {
+				"plot": {"title": "Proporition of polarity for '%s' over time" % opinion},
+				"colors": ["seagreen", "orangered", "darkgrey"]
+			}))
+
+	######################################## NPS EVOLUTION PER OPINION
+	print("NPS per opinion over time")
+	print("\tquery")
+	r = api.post(auth=dictanova_auth, **NPS_TOP5_OPINIONS_PER_MONTH)
+	print("\t%s" % r)
+	
+	# Prepare data
+	print("\tprepare data")
+	df = values_frame(r.json()["periods"][0]["values"], ["month", "opinion"], table)
+	df.set_index(["opinion", "month"], inplace=True)
+	df.rename(columns={"value": "NPS"}, inplace=True)
+	df = decode_frame(df, ["month"], table).sort_index()
+
+	# Plot over period
+	for code in df.index.levels[0]:
+		opinion = opinions.label(code)
+		charts.append(ChartSpec("plot", df.loc[code],
+			"uc6-evolution-nps-%s.png" % opinion, {
+				"plot": {"title": "NPS of '%s' over time" % opinion, "subplots": True}
+			}))
+	
+	################################# NPS EVOLUTION PER OPINION WITH POLARITY
+	print("NPS per opinion over time with polarity")
+	print("\tquery")
+	r = api.post(auth=dictanova_auth, **NPS_TOP5_OPINIONS_PER_MONTH_POLARITY)
+	print("\t%s" % r)
+	
+	# Prepare data
+	print("\tprepare data")
+	cube = OpinionCube(metric="NPS", terms=opinions)
+	cube.update_values(r.json()["periods"][0]["values"], "MONTH", kind="NPS")
+	df = cube.pivot("metric", "MONTH").sort_index()
 
 	# Plot over period
-	for opinion in df.index.levels[0]:
-		print("\trender '%s'" % opinion)
-		df.loc[opinion][["POSITIVE","NEGATIVE"]].plot.line(
-			title="NPS of '%s' over time" % opinion,
-			subplots=True,
-			ylim=(-100, 100),
-			colormap=colors.ListedColormap(["seagreen", "orangered"])
-		)
-		plt.savefig(
-			"uc6-evolution-nps-%s-polarized.png" % opinion,
-			bbox_inches="tight"
-		)
-		plt.clf()
+	for code in df.index.levels[0]:
+		opinion = opinions.label(code)
+		charts.append(ChartSpec("plot", df.loc[code][["POSITIVE","NEGATIVE"]],
+			"uc6-evolution-nps-%s-polarized.png" % opinion, {
+				"plot": {"title": "NPS of '%s' over time" % opinion, "subplots": True, "ylim": (-100, 100)},
+				"colors": ["seagreen", "orangered"]
+			}))
+	
+	##################################################################### RENDER CHARTS
+	print("Render %d charts" % len(charts))
+	for path in render_charts(charts):
+		print("\t%s" % path)
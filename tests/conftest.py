@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""
+Fixtures of the tests of demolib: a local fake of the Dictanova API.
+
+The fake API answers:
+* `POST .../token` with a token
+* `POST .../search/...` with pages (`page`, `pageSize`) of `SEARCH_ITEMS` items
+* `POST .../aggregation/...` with a payload depending on the query
+Every request is recorded in `calls`, `delay` slows down the answers and compressed
+requests are answered with the status `reject_gzip`, if any.
+"""
+
+import gzip, json, os, sys, threading, time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dictanova", "demo"))
+
+SEARCH_ITEMS = 300
+
+class _Handler(BaseHTTPRequestHandler):
+
+	protocol_version = "HTTP/1.1"
+
+	def log_message(self, format, *args):
+		pass
+
+	def do_POST(self):
+		body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+		compressed = self.headers.get("Content-Encoding") == "gzip"
+		if compressed:
+			body = gzip.decompress(body)
+		query = json.loads(body.decode("utf-8")) if body else None
+		url = urlsplit(self.path)
+		with self.server.lock:
+			self.server.calls.append((url.path, parse_qs(url.query), query, dict(self.headers)))
+		time.sleep(self.server.delay)
+		if compressed and self.server.reject_gzip:
+			self.send_response(self.server.reject_gzip)
+			self.send_header("Content-Length", "0")
+			self.end_headers()
+			return
+		if url.path.endswith("/token"):
+			payload = {"access_token": "token-%s" % (query or {}).get("clientId"), "token_type": "Bearer"}
+		elif "/search/" in url.path:
+			params = parse_qs(url.query)
+			page, size = int(params.get("page", ["1"])[0]), int(params.get("pageSize", ["20"])[0])
+			items = [{"id": "op%d" % i, "occurrences": SEARCH_ITEMS - i} for i in range(SEARCH_ITEMS)]
+			payload = {"items": items[(page-1)*size:page*size], "total": SEARCH_ITEMS, "page": page, "pageSize": size}
+		else:
+			payload = {"periods": [{"total": {"value": len(body)}, "values": [], "query": query}]}
+		content = json.dumps(payload).encode("utf-8")
+		self.send_response(200)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(content)))
+		self.end_headers()
+		self.wfile.write(content)
+
+class FakeAPI(ThreadingMixIn, HTTPServer):
+
+	daemon_threads = True
+
+	def __init__(self):
+		HTTPServer.__init__(self, ("127.0.0.1", 0), _Handler)
+		self.lock = threading.Lock()
+		self.calls = []
+		self.delay = 0.
+		self.reject_gzip = None
+		self.url = "http://127.0.0.1:%d/v1" % self.server_address[1]
+
+	def queries(self):
+		"""Calls of the fake API other than the token ones."""
+		return [c for c in self.calls if not c[0].endswith("/token")]
+
+@pytest.fixture
+def fake_api():
+	server = FakeAPI()
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	yield server
+	server.shutdown()
+	server.server_close()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from demolib import chunking
+from demolib.chunking import ChunkingError, chunk_queries, merge
+from demolib.client import DictanovaClient
+
+def _query(ids, query_type="COUNT", dimensions=()):
+	return {
+		"type": query_type,
+		"field": "metadata.rating",
+		"query": {"operator": "AND", "criteria": [
+			{"field": "metadata.vendor", "operator": "EQ", "value": "v"},
+			{"field": "TERMS", "operator": "IN", "value": ids}
+		]},
+		"dimensions": list(dimensions)
+	}
+
+def _payload(values, total=None):
+	period = {"values": [{"dimensions": list(dims), "value": 1} for dims in values]}
+	if total is not None:
+		period["total"] = {"value": total}
+	return {"periods": [period]}
+
+def test_chunk_queries():
+	ids = ["t%d" % i for i in range(5)]
+	assert chunk_queries(_query(ids), size=5) is None
+	queries = chunk_queries(_query(ids, "CSAT"), size=2)
+	assert [q["query"]["criteria"][1]["value"] for q in queries] == [ids[0:2], ids[2:4], ids[4:]]
+	assert all(q["type"] == "COUNT" and q["dimensions"][-2:] == [chunking.DOCUMENT,
+		{"field": "metadata.rating", "group": "DISTINCT"}] for q in queries)
+
+def test_merge_counts_documents_once():
+	query = _query(["t1", "t2", "t3"], dimensions=[{"field": "metadata.shop", "group": "DISTINCT"}])
+	merged = merge(query, [
+		_payload([("s1", "d1"), ("s1", "d2"), ("s2", "d3")]),
+		_payload([("s1", "d2"), ("s2", "d4")])])["periods"][0]
+	assert merged["values"] == [
+		{"dimensions": ["s1"], "value": 2, "volume": 2},
+		{"dimensions": ["s2"], "value": 2, "volume": 2}]
+	assert merged["total"]["value"] == 4
+
+def test_merge_csat():
+	query = _query(["t1", "t2", "t3"], "CSAT")
+	merged = merge(query, [_payload([("d1", 5), ("d2", 3)]), _payload([("d2", 3), ("d3", 1)])])["periods"][0]
+	assert merged["values"] == [{"dimensions": [], "value": 3., "volume": 3}]
+	assert merged["total"] == {"value": 3., "volume": 3}
+
+def test_truncated_chunks_fail(monkeypatch):
+	monkeypatch.setattr(chunking, "MAX_DOCUMENTS", 3)
+	query = _query(["t1", "t2", "t3"], dimensions=[{"field": "metadata.shop", "group": "DISTINCT"}])
+	with pytest.raises(ChunkingError):
+		merge(query, [_payload([("s1", "d1"), ("s1", "d2"), ("s1", "d3")]), _payload([])])
+	# Without other dimension, the documents of a COUNT chunk add up to its total
+	query = _query(["t1", "t2", "t3"])
+	assert merge(query, [_payload([("d1",), ("d2",)], total=2)])["periods"][0]["total"]["value"] == 2
+	with pytest.raises(ChunkingError):
+		merge(query, [_payload([("d1",), ("d2",)], total=2), _payload([("d3",)], total=5)])
+
+@pytest.mark.parametrize("status", [400, 413, 415])
+def test_compressed_bodies_rejected(fake_api, status):
+	fake_api.reject_gzip = status
+	api = DictanovaClient(base_url=fake_api.url, chunk_size=0, gzip_min=10)
+	url = fake_api.url + "/aggregation/datasets/d/documents"
+	r = api.post(url, json=_query(["t%d" % i for i in range(10)]))
+	assert r.status_code == 200 and api.gzip_min is None
+	# Sent uncompressed from now on
+	assert api.post(url, json=_query(["t%d" % i for i in range(20)])).status_code == 200
+	assert [c[3].get("Content-Encoding") for c in fake_api.queries()] == ["gzip", None, None]
+
+def test_bad_requests_keep_compression(fake_api):
+	# A request rejected compressed and uncompressed is not due to the compression
+	api = DictanovaClient(base_url=fake_api.url, chunk_size=0, gzip_min=10)
+	fake_api.reject_gzip = 413
+	api.session.hooks["response"].append(lambda r, *args, **kwargs: setattr(r, "status_code", 400) or r)
+	r = api.post(fake_api.url + "/aggregation/datasets/d/documents", json=_query(["t%d" % i for i in range(10)]))
+	assert r.status_code == 400 and api.gzip_min == 10
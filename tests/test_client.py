@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import asyncio, json, threading
+
+from demolib.client import DictanovaClient, request_key
+from demolib.query import canonical_json
+
+QUERY = {"operator": "AND", "criteria": [
+	{"field": "metadata.vendor", "operator": "EQ", "value": "v"},
+	{"field": "TERMS", "operator": "IN", "value": ["b", "a"]}
+]}
+
+def _url(fake_api):
+	return fake_api.url + "/aggregation/datasets/d/documents"
+
+def test_single_flight_of_threads(fake_api):
+	fake_api.delay = 0.3
+	api = DictanovaClient(base_url=fake_api.url, chunk_size=0)
+	responses = [None] * 8
+	def post(i):
+		responses[i] = api.post(_url(fake_api), json=QUERY)
+	threads = [threading.Thread(target=post, args=(i,)) for i in range(len(responses))]
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+	assert len(fake_api.queries()) == 1 and api.calls == 1
+	assert api.shared == len(responses) - 1
+	assert all(r.json() == responses[0].json() for r in responses)
+	# The responses of the waiting requests were not fetched by them
+	assert sum(1 for r in responses if getattr(r, "from_cache", False)) == len(responses) - 1
+
+def test_single_flight_of_tasks_and_threads(fake_api):
+	fake_api.delay = 0.3
+	api = DictanovaClient(base_url=fake_api.url, chunk_size=0)
+	# An equivalent query: other order of the criteria and of the IN values
+	equivalent = {"operator": "AND", "criteria": [dict(QUERY["criteria"][1], value=["a", "b"]), QUERY["criteria"][0]]}
+	thread = threading.Thread(target=api.post, args=(_url(fake_api), equivalent))
+	async def gather():
+		return await asyncio.gather(*[api.apost(_url(fake_api), json=QUERY) for _ in range(4)])
+	thread.start()
+	responses = asyncio.run(gather())
+	thread.join()
+	assert len(fake_api.queries()) == 1 and api.shared == 4
+	assert all(r.json() == responses[0].json() for r in responses)
+
+def test_max_memo_forgets_least_recently_used(fake_api):
+	api = DictanovaClient(base_url=fake_api.url, chunk_size=0, max_memo=2)
+	queries = [dict(QUERY, criteria=[dict(QUERY["criteria"][0], value=v)]) for v in ("a", "b", "c")]
+	api.post(_url(fake_api), json=queries[0])
+	api.post(_url(fake_api), json=queries[1])
+	# The first query is used again, the second one is the least recently used
+	api.post(_url(fake_api), json=queries[0])
+	api.post(_url(fake_api), json=queries[2])
+	assert len(fake_api.queries()) == 3 and api.hits == 1
+	assert api.memoized("POST", _url(fake_api), json=queries[1]) is None
+	assert api.memoized("POST", _url(fake_api), json=queries[0]) is not None
+	api.post(_url(fake_api), json=queries[1])
+	assert len(fake_api.queries()) == 4 and len(api._memo) == 2
+
+def test_request_key_of_json_and_data_bodies():
+	url = "https://api.dictanova.io/v1/aggregation/datasets/d/documents"
+	key = request_key("POST", url, json=QUERY)
+	# Same request sent as its canonical JSON, as str or bytes
+	body = canonical_json(QUERY)
+	assert request_key("POST", url, data=body) == key
+	assert request_key("POST", url, data=body.encode("utf-8")) == key
+	assert request_key("post", url, json=json.loads(body)) == key
+	# Parameters in the URL or as params
+	assert request_key("POST", url + "?b=2&a=1", json=QUERY) == request_key("POST", url, {"a": 1, "b": "2"}, json=QUERY)
+	assert request_key("POST", url, json=dict(QUERY, operator="OR")) != key
+	assert request_key("POST", url, json=QUERY, scope="other") != key
+
+def test_uncached_requests_skip_the_memo(fake_api):
+	api = DictanovaClient(base_url=fake_api.url, chunk_size=0)
+	api.post(_url(fake_api), json=QUERY)
+	for _ in range(2):
+		r = api.post(_url(fake_api), json=QUERY, cached=False)
+		assert not getattr(r, "from_cache", False)
+	assert len(fake_api.queries()) == 3 and api.hits == 0
+	# The memo holds the last response for the other requests
+	assert api.post(_url(fake_api), json=QUERY).from_cache and api.hits == 1
+	# Identical uncached requests in flight are still sent once
+	fake_api.delay = 0.3
+	threads = [threading.Thread(target=api.post, args=(_url(fake_api), QUERY), kwargs={"cached": False})
+		for _ in range(4)]
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+	assert len(fake_api.queries()) == 4 and api.shared == 3
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import json, os
+
+import numpy as np
+import pytest
+
+from demolib.columnar import ColumnarError, ColumnarStore, ColumnarWriter
+from demolib.enrichments import POLARITY_CODES
+
+def _document(i):
+	content = "Document %d, très bon produit mais livraison lente" % i
+	return {
+		"externalId": "doc-%d" % i,
+		"content": content,
+		"metadata": [{"code": "rating", "value": i % 5 + 1}],
+		"enrichments": [
+			{"term": "produit", "opinion": "POSITIVE", "offset": {"begin": 19, "end": 26}},
+			{"term": "livraison", "opinion": "NEGATIVE", "offset": {"begin": 32, "end": 41}},
+		][:i % 3]
+	}
+
+def _assert_store(path, documents):
+	store = ColumnarStore(path)
+	assert len(store) == len(documents)
+	assert list(store.documents()) == [{k: d[k] for k in ("externalId", "content", "metadata")} for d in documents]
+	enrichments = store.enrichments()
+	assert len(enrichments) == len(documents)
+	expected = [e for d in documents for e in d["enrichments"]]
+	assert list(store.terms.labels[c] for c in enrichments.term) == [e["term"] for e in expected]
+	assert list(enrichments.polarity) == [POLARITY_CODES[e["opinion"]] for e in expected]
+	assert list(enrichments.begin) == [e["offset"]["begin"] for e in expected]
+	assert list(enrichments.end) == [e["offset"]["end"] for e in expected]
+	assert list(np.diff(enrichments.doc_offsets)) == [len(d["enrichments"]) for d in documents]
+	return store
+
+def test_round_trip_across_writers(tmp_path):
+	path = str(tmp_path / "store")
+	documents = [_document(i) for i in range(10)]
+	with ColumnarWriter(path) as writer:
+		writer.append(documents[:4])
+		# Committed batches are visible before the writer is closed
+		_assert_store(path, documents[:4])
+		writer.append(documents[4:7])
+	with ColumnarWriter(path) as writer:
+		writer.append(documents[7:])
+	store = _assert_store(path, documents)
+	sub = store.enrichments(3, 6)
+	assert list(np.diff(sub.doc_offsets)) == [len(d["enrichments"]) for d in documents[3:6]]
+
+def test_failed_batch_is_rolled_back(tmp_path):
+	path = str(tmp_path / "store")
+	documents = [_document(i) for i in range(6)]
+	with ColumnarWriter(path) as writer:
+		writer.append(documents[:3])
+		with pytest.raises(KeyError):
+			writer.append(documents[3:5] + [{"externalId": "no content"}])
+		writer.append(documents[3:])
+	_assert_store(path, documents)
+
+def test_interrupted_writer(tmp_path):
+	path = str(tmp_path / "store")
+	documents = [_document(i) for i in range(6)]
+	writer = ColumnarWriter(path)
+	writer.append(documents[:3])
+	# Killed while writing a batch: its files are longer than committed
+	for name, _ in writer._files.items():
+		writer._files[name].write(b"partial")
+		writer._files[name].flush()
+	# ... which releases its lock
+	writer._lock.close()
+	_assert_store(path, documents[:3])
+	with ColumnarWriter(path) as recovered:
+		recovered.append(documents[3:])
+	_assert_store(path, documents)
+
+def test_truncated_store_is_rejected(tmp_path):
+	path = str(tmp_path / "store")
+	with ColumnarWriter(path) as writer:
+		writer.append([_document(i) for i in range(5)])
+	with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as fin:
+		sizes = json.load(fin)["sizes"]
+	os.truncate(os.path.join(path, "begin.i4"), sizes["begin.i4"] - 4)
+	with pytest.raises(ColumnarError):
+		ColumnarStore(path)
+	with pytest.raises(ColumnarError):
+		ColumnarWriter(path)
+
+def test_single_writer(tmp_path):
+	path = str(tmp_path / "store")
+	documents = [_document(i) for i in range(6)]
+	with ColumnarWriter(path) as writer:
+		writer.append(documents[:3])
+		# Opening a second writer would truncate the batches of the first one
+		with pytest.raises(ColumnarError):
+			ColumnarWriter(path)
+		writer.append(documents[3:])
+		# Readers do not take the lock
+		_assert_store(path, documents).close()
+	with ColumnarWriter(path):
+		pass
+	_assert_store(path, documents)
+
+def test_store_is_closed(tmp_path):
+	path = str(tmp_path / "store")
+	documents = [_document(i) for i in range(5)]
+	with ColumnarWriter(path) as writer:
+		writer.append(documents)
+	with ColumnarStore(path) as store:
+		assert store.content(1) == documents[1]["content"]
+		mmaps = list(store._mmaps)
+	assert mmaps and all(m.closed for m in mmaps)
+	# Arrays still used keep their maps until they are freed
+	store = ColumnarStore(path)
+	enrichments = store.enrichments()
+	store.close()
+	assert list(enrichments.begin) == [e["offset"]["begin"] for d in documents for e in d["enrichments"]]
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import collections
+
+import numpy as np
+import pytest
+
+from demolib.columnar import ColumnarStore, ColumnarWriter
+from demolib.cube import OpinionCube, bucket_label
+
+DAYS = ["2015-04-27", "2015-04-30", "2015-05-01", "2015-05-04", "2015-12-31", "2016-01-02"]
+
+def _document(i):
+	# Terms in the content at their offsets
+	terms = [("prix", "NEGATIVE"), ("accueil", "POSITIVE"), ("prix", "POSITIVE")][:i % 3 + 1]
+	content = " ".join(t for t, _ in terms)
+	enrichments, begin = [], 0
+	for term, opinion in terms:
+		enrichments.append({"term": term, "opinion": opinion, "offset": {"begin": begin, "end": begin + len(term)}})
+		begin += len(term) + 1
+	return {
+		"externalId": "doc-%d" % i,
+		"content": content,
+		"metadata": [{"code": "date", "value": DAYS[i % len(DAYS)] + "T10:00:00Z"}, {"code": "rating", "value": i % 5 + 1}],
+		"enrichments": enrichments
+	}
+
+def _exact(documents, granularity):
+	# (term, bucket, polarity) -> documents, with ANY
+	volumes = collections.Counter()
+	for doc in documents:
+		bucket = bucket_label(doc["metadata"][0]["value"][:10], granularity)
+		cells = set((e["term"], bucket, e["opinion"]) for e in doc["enrichments"])
+		cells |= set((term, bucket, "ANY") for term, _, _ in cells)
+		volumes.update(cells)
+	return volumes
+
+def _volumes(cube, granularity):
+	df = cube.frame(granularity)
+	return collections.Counter({(cube.terms.label(row.opinion), getattr(row, granularity.lower()), row.polarity): row.volume
+		for row in df.itertuples()})
+
+def test_incremental_update_from_store(tmp_path):
+	path = str(tmp_path / "store")
+	documents = [_document(i) for i in range(30)]
+	cube = OpinionCube(date="date", rating="rating")
+	with ColumnarWriter(path) as writer:
+		writer.append(documents[:12])
+		assert cube.update_store(ColumnarStore(path), chunk=5) == 12
+		writer.append(documents[12:])
+		# Only the documents appended since are read
+		assert cube.update_store(ColumnarStore(path), chunk=5) == 18
+		assert cube.update_store(ColumnarStore(path)) == 0
+	full = OpinionCube(date="date", rating="rating")
+	full.update_store(ColumnarStore(path))
+	assert _volumes(cube, "DAY") == _volumes(full, "DAY") == _exact(documents, "DAY")
+	assert np.array_equal(cube.measures["numerator"], full.measures["numerator"])
+	# Persisted cubes resume the updates
+	cube.save(str(tmp_path / "cube"))
+	loaded = OpinionCube.load(str(tmp_path / "cube"))
+	assert loaded.synced == 30 and _volumes(loaded, "DAY") == _volumes(cube, "DAY")
+
+def test_rollup_of_days(tmp_path):
+	documents = [_document(i) for i in range(30)]
+	cube = OpinionCube(date="date", rating="rating")
+	with ColumnarWriter(str(tmp_path / "store")) as writer:
+		writer.append(documents)
+	cube.update_store(ColumnarStore(str(tmp_path / "store")))
+	for granularity in ("WEEK", "MONTH", "YEAR"):
+		assert _volumes(cube, granularity) == _exact(documents, granularity)
+	# The week of 2015-04-27 straddles April and May
+	assert set(cube.frame("WEEK")["week"]) == {"2015-W18", "2015-W19", "2015-W53"}
+	csat = cube.pivot("metric", "YEAR")
+	ratings = [d["metadata"][1]["value"] for d in documents if d["metadata"][0]["value"] < "2016"]
+	assert csat.loc[(cube.terms.encode(["prix"])[0], "2015"), "ANY"] == pytest.approx(np.mean(ratings))
+
+def test_aggregation_cells():
+	values = [
+		{"dimensions": ["2015-01", "prix", "POSITIVE"], "value": 20, "volume": 10},
+		{"dimensions": ["2015-01", "prix", "NEGATIVE"], "value": -50, "volume": 4},
+		{"dimensions": ["2015-02", "prix", "POSITIVE"], "value": 50, "volume": 30},
+		{"dimensions": ["2015-02", "accueil", "POSITIVE"], "value": None, "volume": 0}
+	]
+	cube = OpinionCube(metric="NPS")
+	cube.update_values(values, "MONTH", kind="NPS")
+	df = cube.pivot("metric", "MONTH")
+	prix = cube.terms.encode(["prix"])[0]
+	assert df.loc[(prix, "2015-01"), "POSITIVE"] == pytest.approx(20)
+	assert df.loc[(prix, "2015-01"), "NEGATIVE"] == pytest.approx(-50)
+	# Months roll up to years weighted by the volumes
+	assert cube.pivot("metric", "YEAR").loc[(prix, "2015"), "POSITIVE"] == pytest.approx((20*10 + 50*30) / 40.)
+	assert cube.pivot("volume", "YEAR").loc[(prix, "2015"), "POSITIVE"] == 40
+	with pytest.raises(ValueError):
+		cube.rollup("WEEK")
+	with pytest.raises(ValueError):
+		cube.update_values(values, "WEEK", kind="NPS")
+	with pytest.raises(ValueError):
+		cube.update_values(values, "MONTH", kind="CSAT")
+	counts = OpinionCube()
+	counts.update_values([{"dimensions": ["2015-W14", "prix"], "value": 7, "volume": 7}], "WEEK")
+	assert counts.pivot("volume", "WEEK").loc[(0, "2015-W14"), "ANY"] == 7
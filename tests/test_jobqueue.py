@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from demolib import jobqueue
+from demolib.jobqueue import DONE, FAILED, PENDING, JobQueue
+from demolib.scheduler import Job, JobResult
+
+class _Clock(object):
+	# Replaces the time module of the queue
+
+	def __init__(self):
+		self.now = 1000.
+
+	def time(self):
+		return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+	clock = _Clock()
+	monkeypatch.setattr(jobqueue, "time", clock)
+	return clock
+
+def _queues(tmp_path, **kwargs):
+	# Two workers, eg. on two hosts, opening the same SQLite file
+	path = str(tmp_path / "jobs.sqlite")
+	return JobQueue(path, **kwargs), JobQueue(path, **kwargs)
+
+JOBS = [Job("d1", "retail", "uc1", {}), Job("d2", "retail", "uc1", {"date": "metadata.date"}, "2015")]
+
+def test_expired_lease_is_reclaimed(tmp_path, clock):
+	first, second = _queues(tmp_path)
+	assert first.put(JOBS[:1]) == 1 and second.put(JOBS[:1]) == 0
+	lease = first.lease("w1", duration=10)
+	assert lease.job == JOBS[0] and lease.attempt == 1
+	assert second.lease("w2", duration=10) is None
+	# w1 died, its lease expires
+	clock.now += 11
+	reclaimed = second.lease("w2", duration=10)
+	assert reclaimed.id == lease.id and reclaimed.attempt == 2
+	assert not first.heartbeat(lease, "w1") and first.complete(lease, "w1") is None
+	assert second.complete(reclaimed, "w2") == DONE
+	assert first.counts() == {DONE: 1} and first.lease("w1") is None
+
+def test_failed_jobs_are_retried_until_max_attempts(tmp_path, clock):
+	first, second = _queues(tmp_path, max_attempts=3, retry_delay=5)
+	first.put(JOBS[:1])
+	states = []
+	for attempt in range(1, 4):
+		lease = first.lease("w1")
+		assert lease.job == JOBS[0] and lease.attempt == attempt
+		states.append(first.complete(lease, "w1", error="error %d" % attempt))
+		# Not leased again before the retry delay
+		assert second.lease("w2") is None
+		clock.now += 6
+	assert states == [PENDING, PENDING, FAILED]
+	assert second.lease("w2") is None and second.failures() == [(JOBS[0], "error 3")]
+	# A job whose workers die is failed once the lease of its last attempt expired
+	second.put(JOBS[1:])
+	for attempt in range(1, 4):
+		assert second.lease("w2", duration=10).attempt == attempt
+		clock.now += 11
+	assert first.lease("w1") is None
+	assert [job for job, error in first.failures()] == JOBS
+	assert first.unfinished() == 0 and first.counts() == {FAILED: 2}
+
+def test_heartbeat_extends_the_lease(tmp_path, clock):
+	first, second = _queues(tmp_path)
+	first.put(JOBS[:1])
+	lease = first.lease("w1", duration=10)
+	for _ in range(3):
+		clock.now += 8
+		assert first.heartbeat(lease, "w1", duration=10)
+		assert second.lease("w2", duration=10) is None
+	# Past the last heartbeat, the lease is lost
+	clock.now += 11
+	assert second.lease("w2", duration=10).id == lease.id
+	assert not first.heartbeat(lease, "w1", duration=10)
+
+def test_worker_drops_the_lost_leases(tmp_path, monkeypatch):
+	path = str(tmp_path / "jobs.sqlite")
+	other = JobQueue(path)
+
+	class _StalledQueue(JobQueue):
+		# The lease expires while the job runs and another worker completes the job
+		def heartbeat(self, lease, owner, duration=600.):
+			with self._connect() as db:
+				db.execute("UPDATE jobs SET expires = 0")
+			other.complete(other.lease("w2"), "w2")
+			return JobQueue.heartbeat(self, lease, owner, duration)
+
+	def _job(job, output):
+		time.sleep(0.3)
+		return JobResult(job, 0.3, "should be ignored")
+
+	monkeypatch.setattr(jobqueue, "ProcessPoolExecutor", ThreadPoolExecutor)
+	monkeypatch.setattr(jobqueue, "run_job", _job)
+	queue = _StalledQueue(path)
+	queue.put(JOBS[:1])
+	worker = jobqueue.Worker(queue, str(tmp_path), heartbeat=0.05, poll=0.05, progress=None)
+	assert worker.run() == []
+	assert worker.lost == JOBS[:1]
+	# Not failed by the worker that lost it
+	assert queue.counts() == {DONE: 1} and queue.failures() == []
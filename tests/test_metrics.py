@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from demolib.metrics import Distribution, distribution_query
+
+# (opinion, rating) -> documents
+COUNTS = {("prix", 1): 4, ("prix", 3): 2, ("prix", 5): 4, ("accueil", 4): 3, ("accueil", 5): 7}
+
+def _values(counts, key="value"):
+	return [{"dimensions": [opinion, str(rating)], key: count} for (opinion, rating), count in counts.items()]
+
+def _exact(opinion, low=0, high=10, counts=COUNTS):
+	ratings = [r for (o, r), c in counts.items() if o == opinion and low <= r <= high for _ in range(c)]
+	return np.mean(ratings) if ratings else np.nan
+
+def test_distribution_query():
+	q = distribution_query("metadata.rating", [{"field": "TERMS", "group": "DISTINCT", "limit": 10}])
+	assert q["type"] == "COUNT" and q["dimensions"][-1] == {"field": "metadata.rating", "group": "DISTINCT"}
+	assert distribution_query("metadata.rating", metric="NPS")["type"] == "NPS"
+
+def test_metrics_per_group():
+	d = Distribution.from_values(_values(COUNTS))
+	assert d.groups == [("prix",), ("accueil",)] and list(d.ratings) == [1, 3, 4, 5]
+	assert list(d.volume()) == [10, 10]
+	assert d.average() == pytest.approx([_exact("prix"), _exact("accueil")])
+	assert d.top_box() == pytest.approx([40., 100.])
+	assert d.rating_counts(1) == {1: 0., 3: 0., 4: 3., 5: 7.}
+	# NPS of a 1-5 scale: promoters 5, detractors 1 to 3
+	promoters, passives, detractors = d.nps_groups(promoter=5, detractor=3)
+	assert list(promoters) == [4, 7] and list(passives) == [0, 3] and list(detractors) == [6, 0]
+	assert d.nps(promoter=5, detractor=3) == pytest.approx([-20., 70.])
+	# On the default 0-10 scale, no rating of 1-5 is a promoter
+	assert d.nps() == pytest.approx([-100., -100.])
+	frame = d.frame(["opinion"], promoter=5, detractor=3)
+	assert list(frame["opinion"]) == ["prix", "accueil"] and list(frame["nps"]) == pytest.approx([-20., 70.])
+	assert list(frame[5]) == [4, 7]
+	# Counts of CSAT and NPS queries are their volumes
+	assert np.array_equal(Distribution.from_values(_values(COUNTS, "volume"), "volume").counts, d.counts)
+
+def test_variants_of_the_average():
+	d = Distribution.from_values(_values(COUNTS))
+	assert d.select(low=4).average() == pytest.approx([_exact("prix", low=4), _exact("accueil", low=4)])
+	assert d.select(high=3).average()[0] == pytest.approx(_exact("prix", high=3))
+	assert np.isnan(d.select(high=3).average()[1])
+	# The perimeter without the documents of each opinion
+	perimeter = {("_", 1): 10, ("_", 2): 5, ("_", 3): 5, ("_", 4): 10, ("_", 5): 20}
+	ref = Distribution.from_values(_values(perimeter))
+	without = ref.without(d)
+	assert without.groups == d.groups and list(without.ratings) == [1, 2, 3, 4, 5]
+	rest = {("prix", r): c - COUNTS.get(("prix", r), 0) for (_, r), c in perimeter.items()}
+	assert without.average()[0] == pytest.approx(_exact("prix", counts=rest))
+	assert list(without.volume()) == [40, 40]
+	with pytest.raises(ValueError):
+		d.without(ref)
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+from conftest import SEARCH_ITEMS
+from demolib import config
+from demolib.client import DictanovaClient
+from demolib.pagination import PageSizeTuner, paginate
+
+class _CountingTuner(PageSizeTuner):
+
+	def __init__(self, *args, **kwargs):
+		PageSizeTuner.__init__(self, *args, **kwargs)
+		self.observed = []
+
+	def observe(self, url, size, items, seconds, nbytes):
+		self.observed.append(size)
+		PageSizeTuner.observe(self, url, size, items, seconds, nbytes)
+
+def test_memoized_pages_are_not_observed(fake_api):
+	api = DictanovaClient(base_url=fake_api.url)
+	url = fake_api.url + "/search/datasets/d/terms"
+	tuner = _CountingTuner(minimum=100, maximum=100, initial=100)
+	items = paginate(api, url, json={"operator": "AND", "criteria": []}, tuner=tuner)
+	assert len(items) == SEARCH_ITEMS and tuner.observed == [100] * 3
+	calls = len(fake_api.queries())
+	again = paginate(api, url, json={"operator": "AND", "criteria": []}, tuner=tuner)
+	assert again == items and len(fake_api.queries()) == calls
+	assert tuner.observed == [100] * 3
+
+def test_page_sizes_recorded_only_if_configured(monkeypatch, tmp_path):
+	monkeypatch.delenv("DICTANOVA_PAGE_SIZES", raising=False)
+	assert config.page_sizes_path() is None
+	path = tmp_path / "page-sizes.json"
+	monkeypatch.setenv("DICTANOVA_PAGE_SIZES", str(path))
+	assert config.page_sizes_path() == str(path)
+	tuner = PageSizeTuner(config.page_sizes_path())
+	tuner.observe("/search/datasets/d/terms", 50, 50, 0.1, 1000)
+	tuner.save()
+	assert PageSizeTuner(str(path))._state == tuner._state
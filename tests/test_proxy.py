@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import requests
+
+from demolib.client import DictanovaAPIAuth, DictanovaClient
+from demolib.proxy import CachingProxy, RateLimiter
+from demolib.responsecache import ResponseCache
+
+QUERY = {"type": "COUNT", "field": "rating"}
+
+class _CountingLimiter(RateLimiter):
+
+	def __init__(self):
+		RateLimiter.__init__(self)
+		self.clients = []
+
+	def acquire(self, client):
+		self.clients.append(client)
+
+def _proxy(fake_api, cache=None):
+	proxy = CachingProxy(cache, ("127.0.0.1", 0), upstream=fake_api.url)
+	proxy.start()
+	return proxy
+
+def _client(proxy, id, secret="secret"):
+	# One process of a client of the proxy, with its own token
+	return DictanovaClient(auth=DictanovaAPIAuth(id, secret, base_url=proxy.url()), base_url=proxy.url(), chunk_size=0)
+
+def test_requests_without_token_are_rejected(fake_api):
+	proxy = _proxy(fake_api)
+	try:
+		url = proxy.url() + "/aggregation/datasets/d/documents"
+		assert _client(proxy, "a").post(url, json=QUERY).ok
+		r = requests.post(url, json=QUERY)
+		assert r.status_code == 401
+		assert len(fake_api.queries()) == 1
+	finally:
+		proxy.shutdown()
+		proxy.server_close()
+
+def test_responses_are_shared_per_credentials(fake_api, tmp_path):
+	proxy = _proxy(fake_api, ResponseCache(str(tmp_path)))
+	try:
+		url = proxy.url() + "/aggregation/datasets/d/documents"
+		for process in range(3):
+			assert _client(proxy, "a").post(url, json=QUERY).ok
+		assert len(fake_api.queries()) == 1
+		# Other credentials, or an unknown token, do not read the responses of "a"
+		assert _client(proxy, "b").post(url, json=QUERY).ok
+		assert len(fake_api.queries()) == 2
+		requests.post(url, json=QUERY, headers={"Authorization": "Bearer forged"})
+		assert len(fake_api.queries()) == 3
+		assert fake_api.queries()[-1][3]["Authorization"] == "Bearer forged"
+	finally:
+		proxy.shutdown()
+		proxy.server_close()
+	# Nor do they after a restart of the proxy, from the persistent cache
+	proxy = _proxy(fake_api, ResponseCache(str(tmp_path)))
+	try:
+		assert _client(proxy, "a").post(proxy.url() + "/aggregation/datasets/d/documents", json=QUERY).ok
+		assert len(fake_api.queries()) == 3
+		requests.post(proxy.url() + "/aggregation/datasets/d/documents", json=QUERY, headers={"Authorization": "Bearer forged2"})
+		assert len(fake_api.queries()) == 4
+	finally:
+		proxy.shutdown()
+		proxy.server_close()
+
+def test_every_request_is_rate_limited(fake_api):
+	proxy = _proxy(fake_api)
+	proxy.limiter = _CountingLimiter()
+	try:
+		api = _client(proxy, "a")
+		url = proxy.url() + "/aggregation/datasets/d/documents"
+		for i in range(3):
+			# The memo of the client is bypassed to hit the memo of the proxy
+			api.session.post(url, json=QUERY, auth=api.auth)
+		assert proxy.answers["hit"] == 2 and len(proxy.limiter.clients) == 3
+		assert len(set(proxy.limiter.clients)) == 1
+	finally:
+		proxy.shutdown()
+		proxy.server_close()
+
+def test_rate_limiter_token_bucket():
+	limiter = RateLimiter(10, 2)
+	assert [round(limiter.delay("a", now=0.), 2) for _ in range(4)] == [0., 0., .1, .2]
+	assert limiter.delay("b", now=0.) == 0.
+	assert limiter.delay("a", now=1.) == 0.
+	assert RateLimiter().delay("a") == 0.
+
+def test_failed_requests_are_bad_gateway(fake_api):
+	proxy = _proxy(fake_api)
+
+	def _fail(*args, **kwargs):
+		raise ValueError("broken cache entry")
+
+	proxy.api.request = _fail
+	try:
+		r = _client(proxy, "a").post(proxy.url() + "/aggregation/datasets/d/documents", json=QUERY)
+		assert r.status_code == 502 and "broken cache entry" in r.json()["error"]
+		assert proxy.answers["error"] == 1
+	finally:
+		proxy.shutdown()
+		proxy.server_close()
+
+def test_issued_tokens_are_bounded(fake_api):
+	proxy = CachingProxy(None, ("127.0.0.1", 0), upstream=fake_api.url, max_tokens=2)
+	try:
+		for i, expires_in in enumerate([3600, -1, 3600, 3600]):
+			response = requests.Response()
+			response._content = json.dumps({"access_token": "t%d" % i, "expires_in": expires_in}).encode("utf-8")
+			proxy.issued(json.dumps({"clientId": "c%d" % i, "clientSecret": "s"}).encode("utf-8"), response)
+		# t1 expired, t0 is the oldest
+		assert list(proxy._tokens) == ["t2", "t3"]
+	finally:
+		proxy.server_close()
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+import matplotlib
+import matplotlib.pyplot as plt
+import pandas as pd
+
+from demolib import render
+from demolib.render import ChartSpec, render_charts
+from demolib.rendercache import RenderManifest, spec_digest
+
+def test_in_process_rendering_keeps_the_backend(tmp_path):
+	backend = matplotlib.get_backend()
+	plt.switch_backend("svg")
+	try:
+		fig = plt.figure()
+		path = str(tmp_path / "plot.png")
+		assert render_charts([ChartSpec("plot", pd.Series([1, 3, 2]), path)], processes=1, cache=False) == [path]
+		# The figures of the caller are left open for plt.show()
+		assert matplotlib.get_backend() == "svg" and plt.get_fignums() == [fig.number]
+		assert (tmp_path / "plot.png").stat().st_size > 0
+	finally:
+		plt.close("all")
+		plt.switch_backend(backend)
+
+def test_single_chart_is_rendered_in_process(tmp_path, monkeypatch):
+	def _no_pool(*args, **kwargs):
+		raise AssertionError("worker started for a single chart")
+
+	monkeypatch.setattr(render, "RenderPool", _no_pool)
+	path = str(tmp_path / "plot.png")
+	assert render_charts([ChartSpec("plot", pd.Series([1, 3, 2]), path)], processes=4, cache=False) == [path]
+	assert (tmp_path / "plot.png").stat().st_size > 0
+
+def test_pool_renders_in_started_workers(tmp_path):
+	paths = [str(tmp_path / ("plot%d.png" % i)) for i in range(3)]
+	specs = [ChartSpec("plot", pd.Series([1, i, 2]), path) for i, path in enumerate(paths)]
+	assert render.RenderPool(2).map(specs) == paths
+	assert render._START_METHOD in ("forkserver", "spawn")
+	assert all((tmp_path / ("plot%d.png" % i)).stat().st_size > 0 for i in range(3))
+
+def test_concurrent_manifests_are_merged(tmp_path):
+	# Two processes rendering in the same directory, each with the manifest it read
+	first, second = RenderManifest(str(tmp_path)), RenderManifest(str(tmp_path))
+	specs = [ChartSpec("plot", [i], str(tmp_path / ("plot%d.png" % i))) for i in range(2)]
+	first.record(specs[0], spec_digest(specs[0]))
+	second.record(specs[1], spec_digest(specs[1]))
+	first.save()
+	second.save()
+	charts = RenderManifest(str(tmp_path)).charts
+	assert {name: entry["digest"] for name, entry in charts.items()} == {
+		"plot0.png": spec_digest(specs[0]), "plot1.png": spec_digest(specs[1])}
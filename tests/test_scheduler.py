@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from demolib import scheduler
+from demolib.scheduler import Job, JobResult, Scheduler, run_job
+
+def _crashing_job(job, output):
+	# Kills its worker process, the first time only unless the use case is "always"
+	marker = os.path.join(output, "%s-%s.crashed" % (job.dataset, job.use_case))
+	if job.use_case == "always" or (job.use_case == "crash" and not os.path.exists(marker)):
+		open(marker, "w").close()
+		os._exit(1)
+	return JobResult(job, 0., None)
+
+def test_broken_pool_is_replaced(tmp_path, monkeypatch):
+	monkeypatch.setattr(scheduler, "run_job", _crashing_job)
+	jobs = [Job("d1", "retail", "crash", {}), Job("d2", "retail", "uc1", {}), Job("d3", "retail", "uc2", {})]
+	results = Scheduler(str(tmp_path), processes=2, per_dataset=0, progress=None).run(jobs)
+	assert sorted(r.job.dataset for r in results) == ["d1", "d2", "d3"]
+	assert all(r.error is None for r in results)
+	# A job killing every worker it runs on is failed once retried
+	jobs = [Job("d1", "retail", "always", {}), Job("d2", "retail", "uc1", {})]
+	results = Scheduler(str(tmp_path), processes=1, progress=None, retries=1).run(jobs)
+	errors = {r.job.dataset: r.error for r in results}
+	assert "BrokenProcessPool" in errors["d1"] and errors["d2"] is None
+
+def test_environment_is_restored(tmp_path, monkeypatch):
+	def _script(path, output):
+		assert os.environ["DICTANOVA_DATASET"] == "d1" and os.environ["DICTANOVA_PERIOD"] == "2015"
+		os.environ["SET_BY_THE_SCRIPT"] = "1"
+
+	monkeypatch.setattr(scheduler, "run_script", _script)
+	monkeypatch.delenv("DICTANOVA_DATASET", raising=False)
+	environ = dict(os.environ)
+	assert run_job(Job("d1", "retail", "uc1", {}, "2015"), str(tmp_path)).error is None
+	assert dict(os.environ) == environ
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from demolib.sharding import ShardingError, merge, shard_queries
+
+QUERY = {
+	"type": "NPS",
+	"field": "metadata.rating_nps",
+	"periods": [{"field": "metadata.date", "from": "2015-01-15T00:00:00Z", "to": "2015-03-10T23:59:59Z"}],
+	"dimensions": [{"field": "metadata.vendor", "group": "DISTINCT"}]
+}
+
+def _payload(counts):
+	# Response of a distribution query, counts: {(group..., rating): documents}
+	values = [{"dimensions": list(key), "value": n} for key, n in counts.items()]
+	return {"periods": [{"values": values, "total": {"value": sum(counts.values())}}]}
+
+def test_shard_queries():
+	shards = shard_queries(QUERY, "MONTH")
+	assert [(q["periods"][0]["from"], q["periods"][0]["to"]) for q, _ in shards] == [
+		("2015-01-15T00:00:00Z", "2015-01-31T23:59:59Z"),
+		("2015-02-01T00:00:00Z", "2015-02-28T23:59:59Z"),
+		("2015-03-01T00:00:00Z", "2015-03-10T23:59:59Z")]
+	values, total = shards[0]
+	assert values["type"] == "COUNT" and values["dimensions"][-1] == {"field": QUERY["field"], "group": "DISTINCT"}
+	assert total["dimensions"] == [values["dimensions"][-1]]
+	with pytest.raises(ShardingError):
+		shard_queries(dict(QUERY, dimensions=[{"field": "TERMS", "group": "DISTINCT", "limit": 10}]))
+
+def test_merge_nps_and_csat():
+	shards = [
+		{("a", 10): 3, ("a", 5): 1, ("b", 7): 2},
+		{("a", 9): 1, ("b", 2): 2, ("c", 8): 1}
+	]
+	payloads = [(_payload(s), _payload({(r,): n for (g, r), n in s.items()})) for s in shards]
+	merged = merge(QUERY, payloads)["periods"][0]
+	assert merged["values"] == [
+		{"dimensions": ["a"], "value": 100. * (4 - 1) / 5, "volume": 5},
+		{"dimensions": ["b"], "value": 100. * (0 - 2) / 4, "volume": 4},
+		{"dimensions": ["c"], "value": 0., "volume": 1}]
+	assert merged["total"] == {"value": 100. * (4 - 3) / 10, "volume": 10}
+	merged = merge(dict(QUERY, type="CSAT"), payloads)["periods"][0]
+	assert merged["values"][0] == {"dimensions": ["a"], "value": (30 + 5 + 9) / 5., "volume": 5}
+	assert merged["total"] == {"value": (30 + 5 + 14 + 9 + 4 + 8) / 10., "volume": 10}
+
+def test_merge_empty_period():
+	merged = merge(QUERY, [(_payload({}), _payload({}))])["periods"][0]
+	assert merged["values"] == [] and merged["total"] == {"value": None, "volume": 0}
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import collections, random
+
+from demolib.sketches import CountMinSketch, SpaceSaving, StreamingTopTerms
+
+def _stream(n=20000, terms=2000, seed=1):
+	# Zipf-like stream: the frequency of the term of rank r is proportional to 1/r
+	rng = random.Random(seed)
+	weights = [1. / r for r in range(1, terms+1)]
+	return rng.choices(["term%d" % r for r in range(terms)], weights, k=n)
+
+def _shards(stream, n=3):
+	return [stream[i::n] for i in range(n)]
+
+def _check_space_saving(ss, exact):
+	total = sum(exact.values())
+	assert ss.total == total and len(ss) <= ss.capacity
+	for key, count, error in ss.top():
+		assert count - error <= exact[key] <= count
+	# Keys more frequent than total / capacity are tracked, the others are bounded by min_count
+	for key, count in exact.items():
+		if count > total / ss.capacity:
+			assert key in ss.counters
+		if key not in ss.counters:
+			assert count <= ss.min_count()
+
+def _check_count_min(cms, exact):
+	assert cms.total == sum(exact.values())
+	over = [cms.estimate(key) - count for key, count in exact.items()]
+	assert min(over) >= 0
+	# Within the error bound with probability 1 - delta
+	assert sum(1 for o in over if o > cms.error_bound()) <= cms.delta * len(over)
+
+def test_space_saving():
+	stream = _stream()
+	ss = SpaceSaving(100)
+	for term in stream:
+		ss.update(term)
+	exact = collections.Counter(stream)
+	_check_space_saving(ss, exact)
+	assert [k for k,c,e in ss.top(10)] == [k for k,c in exact.most_common(10)]
+
+def test_space_saving_merge():
+	stream = _stream()
+	merged = SpaceSaving(100)
+	for shard in _shards(stream):
+		ss = SpaceSaving(100)
+		for term in shard:
+			ss.update(term)
+		merged.merge(ss)
+	exact = collections.Counter(stream)
+	_check_space_saving(merged, exact)
+	assert [k for k,c,e in merged.top(10)] == [k for k,c in exact.most_common(10)]
+
+def test_count_min():
+	stream = _stream()
+	cms = CountMinSketch(512, 4)
+	for term in stream:
+		cms.update(term)
+	_check_count_min(cms, collections.Counter(stream))
+
+def test_count_min_merge():
+	stream = _stream()
+	merged = CountMinSketch(512, 4)
+	for shard in _shards(stream):
+		cms = CountMinSketch(512, 4)
+		for term in shard:
+			cms.update(term)
+		merged.merge(cms)
+	_check_count_min(merged, collections.Counter(stream))
+
+def _documents(stream, seed=2):
+	rng = random.Random(seed)
+	documents = []
+	for i in range(0, len(stream), 5):
+		enrichments = [{"term": t, "opinion": rng.choice(["POSITIVE", "NEGATIVE"]), "offset": {"begin": 0, "end": 1}}
+			for t in stream[i:i+5]]
+		documents.append({"week": i % 4, "enrichments": enrichments})
+	return documents
+
+def _check_top(top, documents, polarity, week=None):
+	exact = collections.Counter(e["term"] for d in documents if week is None or d["week"] == week
+		for e in d["enrichments"] if e["opinion"] == polarity)
+	assert [item["id"] for item in top] == [k for k,c in exact.most_common(len(top))]
+	for item in top:
+		assert item["occurrences"] - item["error"] <= exact[item["id"]] <= item["occurrences"]
+
+def test_streaming_top_terms():
+	documents = _documents(_stream())
+	week = lambda doc: doc["week"]
+	single = StreamingTopTerms(capacity=100, width=512)
+	single.update_documents(documents, bucket=week)
+	merged = StreamingTopTerms(capacity=100, width=512)
+	for shard in _shards(documents):
+		sketch = StreamingTopTerms(capacity=100, width=512)
+		sketch.update_documents(shard, bucket=week)
+		merged.merge(sketch)
+	for sketch in (single, merged):
+		for polarity in ("POSITIVE", "NEGATIVE"):
+			_check_top(sketch.top(polarity, n=5), documents, polarity)
+			_check_top(sketch.top(polarity, bucket=1, n=5), documents, polarity, week=1)
+	assert single.top("NEUTRAL") == []
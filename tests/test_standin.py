@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import requests
+
+from demolib.client import DictanovaClient
+from demolib.responsecache import ResponseCache
+from demolib.standin import StandinServer
+
+QUERY = {"type": "COUNT", "field": "rating", "dimensions": [{"field": "vendor", "group": "DISTINCT"}]}
+
+def _record(fake_api, directory):
+	# Responses recorded by a client of the fake API
+	api = DictanovaClient(base_url=fake_api.url, cache=ResponseCache(directory), chunk_size=0)
+	aggregation = api.post(fake_api.url + "/aggregation/datasets/d/documents", json=QUERY)
+	search = api.post(fake_api.url + "/search/datasets/d/terms", data="", params={"page": 1, "pageSize": 50})
+	assert aggregation.ok and search.ok
+	return aggregation, search
+
+def _standin(fake_api, directory):
+	server = StandinServer(ResponseCache(directory), ("127.0.0.1", 0), api_url=fake_api.url)
+	server.start()
+	return server
+
+def test_replay_json_and_empty_bodies(fake_api, tmp_path):
+	aggregation, search = _record(fake_api, str(tmp_path))
+	server = _standin(fake_api, str(tmp_path))
+	try:
+		api = DictanovaClient(base_url=server.url(), chunk_size=0)
+		r = api.post(server.url() + "/aggregation/datasets/d/documents", json=QUERY)
+		assert r.status_code == 200 and r.json() == aggregation.json()
+		r = api.post(server.url() + "/search/datasets/d/terms", data="", params={"page": 1, "pageSize": 50})
+		assert r.status_code == 200 and r.json() == search.json()
+		# Raw HTTP, as any client of the stand-in
+		r = requests.post(server.url() + "/search/datasets/d/terms?page=1&pageSize=50", data="")
+		assert r.status_code == 200 and r.json() == search.json()
+		r = requests.post(server.url() + "/search/datasets/d/terms?page=2&pageSize=50", data="")
+		assert r.status_code == 404
+	finally:
+		server.shutdown()
+		server.server_close()
+
+def test_conditional_requests(fake_api, tmp_path):
+	_record(fake_api, str(tmp_path))
+	server = _standin(fake_api, str(tmp_path))
+	try:
+		url = server.url() + "/aggregation/datasets/d/documents"
+		r = requests.post(url, json=QUERY)
+		tag, modified = r.headers["ETag"], r.headers["Last-Modified"]
+		assert requests.post(url, json=QUERY, headers={"If-None-Match": tag}).status_code == 304
+		assert requests.post(url, json=QUERY, headers={"If-None-Match": '"other"'}).status_code == 200
+		assert requests.post(url, json=QUERY, headers={"If-Modified-Since": modified}).status_code == 304
+	finally:
+		server.shutdown()
+		server.server_close()
+
+def test_revalidation_of_expired_entries(fake_api, tmp_path):
+	_record(fake_api, str(tmp_path / "recorded"))
+	server = _standin(fake_api, str(tmp_path / "recorded"))
+	try:
+		url = server.url() + "/aggregation/datasets/d/documents"
+		first = DictanovaClient(base_url=server.url(), cache=ResponseCache(str(tmp_path / "client"), ttl=0), chunk_size=0)
+		expected = first.post(url, json=QUERY).json()
+		second = DictanovaClient(base_url=server.url(), cache=ResponseCache(str(tmp_path / "client"), ttl=0), chunk_size=0)
+		r = second.post(url, json=QUERY)
+		assert second.revalidated == 1 and r.status_code == 200 and r.json() == expected
+		assert server.answers[304] == 1
+	finally:
+		server.shutdown()
+		server.server_close()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+
+from demolib.client import DictanovaClient
+from demolib.query import Aggregation, Dimension, Period, eq, terms
+from demolib.sharding import shard_queries
+from demolib.timeseries import SeriesStore, signature
+
+URL = "https://api.dictanova.io/v1/aggregation/datasets/d/documents"
+
+def _query(start, end, criteria, limit=10):
+	return {
+		"type": "COUNT",
+		"field": "externalId",
+		"query": {"operator": "AND", "criteria": criteria},
+		"periods": [{"field": "metadata.date", "from": start, "to": end}],
+		"dimensions": [{"field": "metadata.date", "group": "MONTH"}, {"field": "TERMS", "group": "DISTINCT", "limit": limit}]
+	}
+
+VENDOR = {"field": "metadata.vendor", "operator": "EQ", "value": "v"}
+TERMS = {"field": "TERMS", "operator": "IN", "value": ["b", "a", "b"]}
+
+def test_signature_of_equivalent_queries():
+	sig = signature(URL, _query("2015-01-01T00:00:00Z", "2015-12-31T23:59:59Z", [VENDOR, TERMS]))
+	# Other bounds, criteria in another order, IN values deduplicated
+	assert signature(URL, _query("2016-01-01", "2016-06-30", [TERMS, VENDOR])) == sig
+	assert signature(URL, _query("2015-01-01", "2015-12-31", [dict(TERMS, value=["a", "b"]), VENDOR])) == sig
+	# Query values have the signature of their JSON
+	value = Aggregation("COUNT", "externalId", eq("metadata.vendor", "v") & terms(["a", "b"]),
+		[Period("metadata.date", "2017-01-01", "2017-03-31")],
+		[Dimension("metadata.date", "MONTH"), Dimension("TERMS", limit=10)])
+	assert signature(URL, value) == sig
+
+def test_signature_of_other_queries():
+	sig = signature(URL, _query("2015-01-01", "2015-12-31", [VENDOR, TERMS]))
+	assert signature(URL, _query("2015-01-01", "2015-12-31", [VENDOR, TERMS], limit=5)) != sig
+	assert signature(URL, _query("2015-01-01", "2015-12-31", [VENDOR])) != sig
+	assert signature(URL.replace("/d/", "/e/"), _query("2015-01-01", "2015-12-31", [VENDOR, TERMS])) != sig
+
+def test_open_buckets_are_fetched_again(fake_api, tmp_path):
+	store = SeriesStore(str(tmp_path / "series"))
+	api = DictanovaClient(base_url=fake_api.url, series=store, chunk_size=0)
+	url = fake_api.url + "/aggregation/datasets/d/documents"
+	# From 2015-11 to the end of next year: the months until last month are closed
+	end = "%d-12-31T23:59:59Z" % (datetime.date.today().year + 1)
+	query = {
+		"type": "COUNT",
+		"field": "externalId",
+		"periods": [{"field": "metadata.date", "from": "2015-11-01T00:00:00Z", "to": end}],
+		"dimensions": [{"field": "metadata.date", "group": "MONTH"}]
+	}
+	months = len(shard_queries(query, "MONTH"))
+	open_months = sum(1 for q, _ in shard_queries(query, "MONTH") if not store.closed(q["periods"][0]["to"]))
+	assert open_months >= 13
+	for refresh in range(3):
+		calls = len(fake_api.queries())
+		r = api.post(url, json=query, shard="MONTH")
+		assert r.ok and not getattr(r, "from_cache", False)
+		# Only the open months are fetched again by the refreshes of the same process
+		assert len(fake_api.queries()) - calls == (months if refresh == 0 else open_months)
+	assert store.fetched == months + 2 * open_months
+	assert store.reused == 2 * (months - open_months)
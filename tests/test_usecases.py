@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import os, subprocess, sys, warnings
+
+from demolib.usecases import DEMO_DIR, DEMOS, fetches, pipeline, run_script, use_cases
+
+KEYS = {"url", "json", "data", "params", "shard"}
+
+def test_fetches_of_every_script():
+	for demo in DEMOS:
+		for uc, path in use_cases(demo).items():
+			declared = fetches(path)
+			assert declared, "%s %s declares no fetch" % (demo, uc)
+			for fetch in declared:
+				assert set(fetch) <= KEYS and fetch["url"].startswith("https://api.dictanova.io/v1/")
+
+def test_fetches_follow_the_configuration(monkeypatch):
+	monkeypatch.setenv("DICTANOVA_DATASET", "other")
+	monkeypatch.setenv("DICTANOVA_FIELDS", '{"rating_nps": "nps"}')
+	declared = fetches(use_cases("retail")["uc4"])
+	assert all("/datasets/other/" in fetch["url"] for fetch in declared)
+	assert declared[0]["json"]["field"] == "metadata.nps"
+
+def test_pipeline_shares_the_fetches():
+	p = pipeline([("retail", "uc1"), ("retail", "uc2")], auth=object())
+	# The page of the top 100 opinions is declared by both use cases
+	assert p.resolve("retail/uc2/fetch2") == "retail/uc1/fetch1"
+	assert p.nodes["retail/uc2"].deps == ("retail/uc2/fetch1", "retail/uc1/fetch1")
+	assert p.nodes["retail/uc1"].exclusive and p.nodes["retail/uc2"].exclusive
+
+def test_fetches_do_not_import_heavy_modules():
+	# In a fresh interpreter, as `dictanova-demo.py run` before its first request
+	code = ("import sys; sys.path.insert(0, %r); from demolib.usecases import DEMOS, fetches, use_cases; "
+		"[fetches(p) for d in DEMOS for p in use_cases(d).values()]; "
+		"print(sorted(m for m in ('numpy', 'pandas', 'matplotlib') if m in sys.modules))") % DEMO_DIR
+	out = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, check=True).stdout
+	assert out.decode("utf-8").strip() == "[]"
+
+SCRIPT = """
+import os, warnings
+import matplotlib
+import matplotlib.pyplot as plt
+warnings.simplefilter("error")
+plt.figure()
+with open("backend.txt", "w") as fout:
+	fout.write("%s %s" % (os.environ["MPLBACKEND"], matplotlib.get_backend()))
+"""
+
+def test_run_script_is_headless(tmp_path, monkeypatch):
+	import matplotlib.pyplot as plt
+	monkeypatch.setenv("MPLBACKEND", "TkAgg")
+	script = tmp_path / "script.py"
+	script.write_text(SCRIPT)
+	filters = list(warnings.filters)
+	run_script(str(script), str(tmp_path / "out"))
+	assert (tmp_path / "out" / "backend.txt").read_text().lower() == "agg agg"
+	# The environment, the warning filters and the figures are left as before
+	assert os.environ["MPLBACKEND"] == "TkAgg" and warnings.filters == filters
+	assert plt.get_fignums() == []